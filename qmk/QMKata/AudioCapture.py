@@ -0,0 +1,365 @@
+import numpy as np
+import threading, time, json
+
+from FramePacer import FramePacer
+from AudioSpectrum import FreqBandTable, STFTAnalyzer, OnsetDetector
+from AudioSource import LoopbackAudioSource, PacedAudioSource
+from DebugTracer import DebugTracer
+if not LoopbackAudioSource.available():
+    print("pyaudiowpatch not installed")
+
+#-------------------------------------------------------------------------------
+# single producer/single consumer sample ring, no lock: the producer only
+# moves write_count, the consumer only read_count. a block that doesn't fit
+# is dropped (overrun) instead of blocking the producer.
+class SampleRing:
+
+    def __init__(self, capacity):
+        self.buf = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.write_count = 0
+        self.read_count = 0
+        self.num_overruns = 0
+
+    # producer (portaudio callback)
+    def write(self, samples):
+        n = len(samples)
+        if n > self.capacity - (self.write_count - self.read_count):
+            self.num_overruns += 1
+            return False
+        pos = self.write_count % self.capacity
+        first = min(n, self.capacity - pos)
+        self.buf[pos:pos + first] = samples[:first]
+        self.buf[:n - first] = samples[first:]
+        self.write_count += n
+        return True
+
+    # consumer: all available samples (copy), multiple of align
+    def read(self, align=1):
+        n = self.write_count - self.read_count
+        n -= n % align
+        pos = self.read_count % self.capacity
+        first = min(n, self.capacity - pos)
+        samples = np.concatenate((self.buf[pos:pos + first], self.buf[:n - first]))
+        self.read_count += n
+        return samples
+
+#-------------------------------------------------------------------------------
+# audio capture (default wasapi loopback, see AudioSource), callback(peak_levels)
+# every hop (interval) on the worker thread, callback(None) when stopped or the
+# source failed to open (finished is set before it). peak
+# levels of the last window_time seconds (stft, overlapping windows): frequency
+# resolution of a long window, latency/update rate of a short hop.
+#
+# live sources (portaudio callback mode): the source callback only copies the
+# block into a SampleRing, this thread (worker) does the analysis, so slow
+# processing doesn't overrun the input. pull sources (file, signal) are read
+# in real time (PacedAudioSource) or with realtime=False as fast as the
+# analysis runs (offline, callbacks get every hop, no ring). callbacks must
+# not touch qt widgets, see ThrottledChannel.
+#
+# onset_callback(event) (optional) gets onset/beat events of OnsetDetector from
+# the same spectra, time.monotonic() time of the hop (offline: audio time),
+# before the hop's peak levels.
+class AudioCaptureThread(threading.Thread):
+    HOP_TIME    = 0.01
+    WINDOW_TIME = 0.046
+    WINDOW      = "hann"
+    RING_TIME   = 0.5 # seconds of audio buffered for the worker
+
+    # default (loopback) source available
+    @staticmethod
+    def available():
+        return LoopbackAudioSource.available()
+
+    def __init__(self, freq_bands, interval=HOP_TIME, window_time=WINDOW_TIME, window=WINDOW, source=None, realtime=True):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        super().__init__(name="AudioCaptureThread", daemon=True)
+        self.running = False
+        self.finished = False
+        self.freq_bands = freq_bands
+        self.freq_bands_changed = True
+        self.interval = interval
+        self.window_time = max(window_time, interval)
+        self.window = window
+        self.source = source or LoopbackAudioSource()
+        self.realtime = realtime
+        self.data_event = threading.Event()
+        self.ring = None
+        self.callback = None
+        self.onset_callback = None
+
+    def connect_callback(self, callback):
+        self.callback = callback
+
+    # before start
+    def connect_onset_callback(self, callback):
+        self.onset_callback = callback
+
+    # band table rebuilt on capture thread with next chunk
+    def set_freq_bands(self, freq_bands):
+        self.freq_bands = freq_bands
+        self.freq_bands_changed = True
+
+    def run(self):
+        source = self.source
+        if self.realtime and not source.LIVE:
+            source = PacedAudioSource(source)
+        try:
+            source.open(self.interval) # one hop per block
+        except Exception as e:
+            self.dbg.tr('D', "audio source: {}", e)
+            self.finished = True
+            self.callback(None)
+            return
+        self.rate, self.channels = source.rate, source.channels
+        self.stft = STFTAnalyzer(self.rate, self.window_time, self.interval, self.window)
+        self.onsets = OnsetDetector(self.rate, self.stft.fft_size, self.interval) if self.onset_callback else None
+        self.band_table = None
+        self.dbg.tr('D', "audio source {}: rate {}, channels {}", type(self.source).__name__, self.rate, self.channels)
+        self.dbg.tr('D', "stft: window {} ({}), hop {}, fft size {}",
+                    self.stft.window_size, self.window, self.stft.hop_size, self.stft.fft_size)
+
+        self.running = True
+        try:
+            if source.LIVE:
+                self.run_live(source)
+            else:
+                self.run_offline(source)
+        finally:
+            source.close()
+        self.finished = True
+        self.callback(None)
+
+    def run_live(self, source):
+        # blocks are paced by the audio clock, pacer only measures callback jitter
+        self.pacer = FramePacer(1 / self.interval, "audio")
+        self.ring = SampleRing(int(self.rate * self.RING_TIME) * self.channels)
+        def on_block(samples):
+            self.ring.write(samples)
+            self.pacer.tick()
+            self.data_event.set()
+        source.start(on_block)
+
+        while self.running:
+            if not self.data_event.wait(0.5):
+                if not source.is_active():
+                    self.dbg.tr('E', "audio stream stopped")
+                    break
+                continue
+            self.data_event.clear()
+            read_time = time.monotonic()
+            self.process(self.ring.read(self.channels), read_time)
+
+        source.stop()
+        self.dbg.tr('D', "audio stream closed, {}, ring overruns {}, {}",
+                    self.pacer.stats_text(), self.ring.num_overruns, source.stats_text())
+
+    # as fast as possible, event times are audio times
+    def run_offline(self, source):
+        while self.running:
+            samples = source.read()
+            if samples is None:
+                break
+            self.process(samples, (self.stft.num_samples + len(samples) // self.channels) / self.rate)
+
+    # interleaved samples, read_time: time of the last sample
+    def process(self, samples, read_time):
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels).mean(axis=1)
+
+        if self.freq_bands_changed:
+            self.freq_bands_changed = False
+            self.band_table = FreqBandTable(self.freq_bands, self.rate, self.stft.fft_size)
+            self.dbg.tr('D', "band table: bin ranges {}", self.band_table.indices)
+        stft = self.stft
+        end = stft.num_samples + len(samples)
+        for spectrum in stft.spectra(samples):
+            if self.onsets:
+                # hop time: read time minus the samples after the hop
+                for event in self.onsets.process(spectrum, read_time - (end - stft.num_samples) / self.rate):
+                    self.onset_callback(event)
+            self.callback(self.band_table.peaks(spectrum).tolist())
+
+    def stop(self):
+        self.running = False
+        self.data_event.set()
+
+#-------------------------------------------------------------------------------
+# peak levels per frequency band to rgb color, with "auto gain" (max level
+# adjusted every N samples) or user defined min/max level per band
+#
+# per band state (db min, max level, running max level, colors, user min/max
+# level) is kept in numpy arrays, db conversion, normalization, agc update and
+# the color weighted sum are one array operation each over all bands, per
+# band factors are only recomputed when the max level is updated. bands with
+# zero max level are ignored (level 0).
+class AudioPeakRGB:
+    MAX_LEVEL_TIME          = 0.8 # max level adjust interval in seconds
+    DB_MIN                  = -27
+    MAX_LEVEL               = 15
+    NO_AUDIO_LEVEL          = 0.05 # all bands below: no audio
+    RGB_SUM_SCALE           = 6
+    MIN_RATIO               = 1e-10 # peak / max level floor, -200 dB
+
+    # interval: time between peak level samples
+    def __init__(self, interval=AudioCaptureThread.HOP_TIME):
+        self.dbg = DebugTracer(zones={'D':0, "FREQ_BAND":0, "PEAK_LEVEL":0, "MAX_PEAK":0}, obj=self)
+
+        self.num_samples_max_level = max(1, round(self.MAX_LEVEL_TIME / interval))
+
+        self.freq_bands = []
+        self.freq_rgb = []
+        self.min_max_level = []
+        self.reset_levels()
+
+    def reset_levels(self):
+        n = len(self.freq_bands)
+        self.db_min = np.full(n, float(self.DB_MIN))
+        self.max_level = np.full(n, float(self.MAX_LEVEL)) # max level used for rgb intensity
+        self.max_level_running = np.zeros(n) # max level updated every sample
+        self.sample_count = 0
+        self.update_scales()
+
+    # lists for ui/json, arrays for processing
+    @property
+    def freq_rgb(self):
+        return self._freq_rgb
+
+    @freq_rgb.setter
+    def freq_rgb(self, freq_rgb):
+        self._freq_rgb = freq_rgb
+        # rgb values are added for all bands, normalized with a factor
+        self.rgb_weights = np.asarray(freq_rgb, dtype=np.float64).reshape(-1, 3) / self.RGB_SUM_SCALE
+
+    @property
+    def min_max_level(self):
+        return self._min_max_level
+
+    @min_max_level.setter
+    def min_max_level(self, min_max_level):
+        self._min_max_level = min_max_level
+        levels = np.asarray(min_max_level if min_max_level is not None else [], dtype=np.float64).reshape(-1, 2)
+        self.user_min_level = levels[:, 0].copy()
+        self.user_max_level = levels[:, 1].copy()
+
+    def load_freq_bands_colors(self, file_name='freq_bands_colors.json'):
+        try:
+            with open(file_name, 'r') as file:
+                freq_bands_colors = json.load(file)
+                self.freq_bands = freq_bands_colors['freq_bands']
+                self.freq_rgb = freq_bands_colors['colors']
+                self.min_max_level = freq_bands_colors['min_max_level']
+                if len(self.freq_bands) > 31:
+                    raise Exception("too many freq bands")
+                if len(self.freq_bands) != len(self.freq_rgb):
+                    raise Exception("freq_bands and colors have different lengths")
+                self.dbg.tr('FREQ_BAND', "freq_bands:{}", self.freq_bands)
+                self.dbg.tr('FREQ_BAND', "freq_rgb:{}", self.freq_rgb)
+                self.dbg.tr('FREQ_BAND', "min_max_level:{}", self.min_max_level)
+                if self.min_max_level is None or len(self.min_max_level) != len(self.freq_bands):
+                    self.min_max_level = [(0,0) for _ in range(len(self.freq_bands))]
+        except Exception as e:
+            self.dbg.tr('D', "error loading file: {}", e)
+            self.freq_bands = []
+            self.freq_rgb = []
+            self.min_max_level = []
+        self.reset_levels()
+
+    def save_freq_bands_colors(self, file_name='freq_bands_colors.json'):
+        freq_bands_colors = {
+            'freq_bands': self.freq_bands,
+            'colors': self.freq_rgb,
+            'min_max_level':self.min_max_level
+        }
+        with open(file_name, 'w') as file:
+            json.dump(freq_bands_colors, file, indent=4)
+
+    #-------------------------------------------------------------------------------
+    # per band factors of band_levels(), after each max level/db min change:
+    # level 0..1 = 1 + 20 * log10(peak / max level) / -db_min, clipped. bands
+    # with zero max level (or db min) get 0.
+    def update_scales(self):
+        n = len(self.max_level)
+        self.inv_max_level = np.divide(1.0, self.max_level, out=np.zeros(n), where=self.max_level > 0)
+        self.db_scale = np.divide(-20.0, self.db_min, out=np.zeros(n), where=self.db_min != 0)
+        self.db_offset = (self.db_min != 0).astype(np.float64)
+
+    # per band level 0..1 on the db scale of the rgb intensity (spectrum renderer)
+    def band_levels(self, peak_levels):
+        peak_levels = np.asarray(peak_levels, dtype=np.float64)
+        n = min(len(peak_levels), len(self.max_level))
+        levels = peak_levels[:n] * self.inv_max_level[:n]
+        np.maximum(levels, self.MIN_RATIO, out=levels)
+        np.log10(levels, out=levels)
+        levels *= self.db_scale[:n]
+        levels += self.db_offset[:n]
+        np.maximum(levels, 0.0, out=levels)
+        np.minimum(levels, 1.0, out=levels)
+        return levels
+
+    def peak_level_to_rgb(self, peak_levels, log_scale = True):
+        if log_scale:
+            intensity = self.band_levels(peak_levels)
+            intensity *= 255
+            np.rint(intensity, out=intensity)
+        else:
+            peak_levels = np.asarray(peak_levels, dtype=np.float64)
+            n = min(len(peak_levels), len(self.max_level))
+            intensity = peak_levels[:n] * self.inv_max_level[:n] * 255
+        n = min(len(intensity), len(self.rgb_weights))
+        rgb = intensity[:n] @ self.rgb_weights[:n]
+        np.minimum(rgb, 255, out=rgb)
+        r, g, b = rgb.tolist()
+        return r,g,b
+
+    #-------------------------------------------------------------------------------
+    # "max level" from the running max level of the last N samples (or user
+    # defined max level), db min from user defined min level. returns max of
+    # the running max levels.
+    def update_max_level(self):
+        n = len(self.max_level)
+        user_min, user_max = np.zeros(n), np.zeros(n)
+        k = min(n, len(self.user_min_level))
+        user_min[:k] = self.user_min_level[:k]
+        user_max[:k] = self.user_max_level[:k]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            user_db_min = 20 * np.log10(user_min / self.max_level)
+        self.db_min = np.where(user_min == 0, float(self.DB_MIN),
+                               np.where(np.isfinite(user_db_min), user_db_min, self.db_min))
+        running = self.max_level_running
+        self.max_level = np.where(user_max > 0, user_max, self.max_level + (running - self.max_level) / 2)
+        self.update_scales()
+
+        band = int(np.argmax(running)) if n else 0
+        max_level_running = float(running[band]) if n else 0
+        if self.dbg.enabled('MAX_PEAK'):
+            self.dbg.tr('MAX_PEAK', "{}:max level[{}] {}", time.monotonic(), band, max_level_running)
+        self.max_level_running = np.zeros(n)
+        return max_level_running
+
+    # returns (rgb, max level) rgb None if no audio, max level of all bands
+    # every N samples when "max level" is updated, else None
+    def process(self, peak_levels):
+        self.sample_count += 1
+        if self.dbg.enabled('PEAK_LEVEL'):
+            self.dbg.tr('PEAK_LEVEL', "peak {}: {}", self.sample_count, peak_levels)
+
+        # update "running max level", after N samples "max level" is adjusted with this
+        levels = np.asarray(peak_levels, dtype=np.float64)
+        n = min(len(levels), len(self.max_level_running))
+        np.maximum(self.max_level_running[:n], levels[:n], out=self.max_level_running[:n])
+
+        # update "max level" every N samples, brightness is based on current peak levels and "max level"
+        max_level_running = None
+        if self.sample_count >= self.num_samples_max_level:
+            self.sample_count = 0
+            max_level_running = self.update_max_level()
+
+        if not len(levels) or levels.max() < self.NO_AUDIO_LEVEL:
+            # no audio
+            return None, max_level_running
+
+        return self.peak_level_to_rgb(levels), max_level_running
@@ -0,0 +1,259 @@
+import numpy as np
+import threading, wave
+
+from FramePacer import FramePacer
+from DebugTracer import DebugTracer
+try:
+    import pyaudiowpatch as pyaudio
+except:
+    pyaudio = None
+
+#-------------------------------------------------------------------------------
+# audio sources for AudioCaptureThread
+#
+# open(block_time) sets rate and channels, blocks of block_time seconds are
+# interleaved float32 samples (frames * channels).
+#
+# - push sources (LIVE): start(on_block) calls on_block(samples) on the source's
+#   own thread (portaudio callback) until stop(), is_active() False when the
+#   stream ended
+# - pull sources: read() returns the next block, None at end. read as fast as
+#   possible (offline analysis/benchmarks) or in real time with PacedAudioSource.
+#-------------------------------------------------------------------------------
+class LoopbackAudioSource:
+    LIVE = True
+
+    @staticmethod
+    def available():
+        return pyaudio is not None
+
+    def __init__(self):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+        self.paudio = None
+        self.stream = None
+        self.num_input_overflows = 0
+
+    # wasapi loopback of the default output device
+    def open(self, block_time):
+        self.paudio = pyaudio.PyAudio()
+        try:
+            # see https://github.com/s0d3s/PyAudioWPatch/blob/master/examples/pawp_record_wasapi_loopback.py
+            wasapi_info = self.paudio.get_host_api_info_by_type(pyaudio.paWASAPI)
+            self.dbg.tr('D', "wasapi: {}", wasapi_info)
+            default_speakers = self.paudio.get_device_info_by_index(wasapi_info["defaultOutputDevice"])
+            if not default_speakers["isLoopbackDevice"]:
+                for loopback in self.paudio.get_loopback_device_info_generator():
+                    if default_speakers["name"] in loopback["name"]:
+                        default_speakers = loopback
+                        break
+            self.dbg.tr('D', "loopback device: {}", default_speakers)
+        except Exception as e:
+            self.paudio.terminate()
+            raise Exception(f"wasapi not supported: {e}")
+
+        self.device = default_speakers
+        self.rate = int(default_speakers["defaultSampleRate"])
+        self.channels = default_speakers["maxInputChannels"]
+        self.block_frames = int(self.rate * block_time)
+
+    def start(self, on_block):
+        def on_stream_block(in_data, frame_count, time_info, status):
+            if status & pyaudio.paInputOverflow:
+                self.num_input_overflows += 1
+            on_block(np.frombuffer(in_data, dtype=np.float32))
+            return (None, pyaudio.paContinue)
+
+        self.stream = self.paudio.open(format=pyaudio.paFloat32,
+                        channels=self.channels,
+                        rate=self.rate,
+                        input=True,
+                        frames_per_buffer=self.block_frames,
+                        input_device_index=self.device["index"],
+                        stream_callback=on_stream_block)
+        self.dbg.tr('D', "audio stream opened: rate={}, chunk size={}, channels={}, input device={}",
+                    self.rate, self.block_frames, self.channels, self.device["index"])
+
+    def is_active(self):
+        return self.stream.is_active()
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+
+    def close(self):
+        self.stop()
+        if self.paudio:
+            self.paudio.terminate()
+            self.paudio = None
+
+    def stats_text(self):
+        return f"input overflows {self.num_input_overflows}"
+
+#-------------------------------------------------------------------------------
+# wav/flac file: soundfile (libsndfile) if installed, else wav with the wave
+# module (8/16/24/32 bit pcm). loop: restart at end of file.
+class FileAudioSource:
+    LIVE = False
+
+    def __init__(self, filename, loop=False):
+        self.filename = filename
+        self.loop = loop
+        self.file = None
+        self.sf = None
+
+    def open(self, block_time):
+        try:
+            import soundfile
+            self.sf = soundfile.SoundFile(self.filename)
+            self.rate, self.channels = self.sf.samplerate, self.sf.channels
+        except ImportError:
+            self.file = wave.open(self.filename, 'rb')
+            self.rate, self.channels = self.file.getframerate(), self.file.getnchannels()
+            self.sample_width = self.file.getsampwidth()
+        self.block_frames = max(1, int(self.rate * block_time))
+
+    def read_frames(self, n):
+        if self.sf:
+            return self.sf.read(n, dtype='float32').reshape(-1)
+        data = self.file.readframes(n)
+        width = self.sample_width
+        if width == 1:
+            return (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+        if width == 3:
+            b = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+            s = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 # sign from bit 31
+            return s.astype(np.float32) / 2**31
+        dtype = np.int16 if width == 2 else np.int32
+        return np.frombuffer(data, dtype=dtype).astype(np.float32) / 2**(8 * width - 1)
+
+    def rewind(self):
+        if self.sf:
+            self.sf.seek(0)
+        else:
+            self.file.rewind()
+
+    def read(self):
+        samples = self.read_frames(self.block_frames)
+        if len(samples) < self.block_frames * self.channels and self.loop:
+            self.rewind()
+            samples = np.concatenate((samples, self.read_frames(self.block_frames - len(samples) // self.channels)))
+        return samples if len(samples) else None
+
+    def close(self):
+        if self.sf:
+            self.sf.close()
+        if self.file:
+            self.file.close()
+
+#-------------------------------------------------------------------------------
+# numpy test signals: "sine" (freq), "sweep" (log sweep 20 Hz..20 kHz over
+# period), "noise", "beats" (kick every 60/bpm seconds over noise). duration
+# None: endless.
+class SignalAudioSource:
+    LIVE = False
+    SIGNALS = ("sine", "sweep", "noise", "beats")
+
+    def __init__(self, signal="sweep", rate=48000, channels=2, duration=None, freq=1000.0, period=10.0, bpm=120.0, level=0.5):
+        if signal not in self.SIGNALS:
+            raise Exception(f"unknown signal {signal}")
+        self.signal = signal
+        self.rate = rate
+        self.channels = channels
+        self.duration = duration
+        self.freq = freq
+        self.period = period
+        self.bpm = bpm
+        self.level = level
+        self.rng = np.random.default_rng(0)
+
+    def open(self, block_time):
+        self.block_frames = max(1, int(self.rate * block_time))
+        self.pos = 0 # frames
+
+    def generate(self, t):
+        if self.signal == "sine":
+            return np.sin(2 * np.pi * self.freq * t)
+        if self.signal == "sweep":
+            # log sweep, phase is the integral of 20 * k^x over the period
+            k = np.log(1000.0)
+            x = (t % self.period) / self.period
+            return np.sin(2 * np.pi * 20.0 * self.period * (np.exp(k * x) - 1) / k)
+        noise = self.rng.standard_normal(len(t))
+        if self.signal == "noise":
+            return noise * 0.3
+        beat_time = t % (60.0 / self.bpm)
+        return np.sin(2 * np.pi * 60.0 * beat_time) * np.exp(-20.0 * beat_time) + noise * 0.05
+
+    def read(self):
+        n = self.block_frames
+        if self.duration is not None:
+            n = min(n, int(self.duration * self.rate) - self.pos)
+            if n <= 0:
+                return None
+        t = (self.pos + np.arange(n)) / self.rate
+        self.pos += n
+        mono = (self.level * self.generate(t)).astype(np.float32)
+        return np.repeat(mono, self.channels)
+
+    def close(self):
+        pass
+
+#-------------------------------------------------------------------------------
+# pull source as a push source in real time: one block per block time, paced
+# on the audio clock of the source (late blocks are read and sent together)
+class PacedAudioSource:
+    LIVE = True
+
+    def __init__(self, source):
+        self.source = source
+        self.thread = None
+        self.running = False
+
+    def open(self, block_time):
+        self.source.open(block_time)
+        self.rate, self.channels = self.source.rate, self.source.channels
+        self.block_frames = self.source.block_frames
+
+    def start(self, on_block):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=(on_block,), name="PacedAudioSource", daemon=True)
+        self.thread.start()
+
+    def run(self, on_block):
+        pacer = FramePacer(self.rate / self.block_frames, "audio source")
+        while self.running:
+            blocks = [ self.source.read() for _ in range(pacer.wait()) ]
+            blocks = [ block for block in blocks if block is not None ]
+            if not blocks:
+                break
+            on_block(np.concatenate(blocks))
+        self.running = False
+
+    def is_active(self):
+        return self.running
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def close(self):
+        self.stop()
+        self.source.close()
+
+    def stats_text(self):
+        return ""
+
+#-------------------------------------------------------------------------------
+# "loopback", "file:<name>", "signal:<sine|sweep|noise|beats>"
+def create_audio_source(spec, loop=True):
+    if spec == "loopback":
+        return LoopbackAudioSource()
+    kind, _, arg = spec.partition(":")
+    if kind == "file":
+        return FileAudioSource(arg, loop)
+    if kind == "signal":
+        return SignalAudioSource(arg or "sweep")
+    raise Exception(f"unknown audio source {spec}")
@@ -0,0 +1,182 @@
+import collections
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# fft length >= n with fast fft (power of 2), block is zero padded to it
+def fast_fft_length(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+#-------------------------------------------------------------------------------
+# frequency band peak levels of a rfft magnitude spectrum
+#
+# band (f_min, f_max) to bin range tables are built once for (bands, sample
+# rate, fft length), per block all band peaks come from one
+# np.maximum.reduceat over [start0, stop0, start1, stop1, ...] (every other
+# result). the magnitude buffer has one extra zero bin so stop can be the
+# number of bins, bands without bins are 0.
+#
+class FreqBandTable:
+
+    def __init__(self, freq_bands, rate, fft_size):
+        self.freq_bands = [ tuple(band) for band in freq_bands ]
+        self.rate = rate
+        self.fft_size = fft_size
+        self.num_bins = fft_size // 2 + 1
+        self.magnitude = np.zeros(self.num_bins + 1, dtype=np.float32)
+
+        bands = np.asarray(self.freq_bands, dtype=np.float64).reshape(-1, 2)
+        start = np.ceil(bands[:, 0] * fft_size / rate)
+        stop = np.floor(bands[:, 1] * fft_size / rate) + 1
+        start = np.clip(start, 0, self.num_bins).astype(np.intp)
+        stop = np.clip(stop, 0, self.num_bins).astype(np.intp)
+        self.valid = stop > start
+        self.indices = np.stack((start, np.maximum(start, stop)), axis=1).ravel()
+
+    # spectrum: rfft of fft_size block
+    def peaks(self, spectrum):
+        if not len(self.indices):
+            return np.zeros(0, dtype=np.float32)
+        np.abs(spectrum, out=self.magnitude[:self.num_bins], casting='unsafe')
+        peaks = np.maximum.reduceat(self.magnitude, self.indices)[::2]
+        return np.where(self.valid, peaks, 0.0)
+
+    # peak levels of a time domain block (zero padded to fft_size)
+    def block_peaks(self, block):
+        return self.peaks(np.fft.rfft(block, self.fft_size))
+
+#-------------------------------------------------------------------------------
+# short time fourier analysis: the last window_time seconds of audio, analysed
+# every hop_time seconds (overlapping windows), independent of the block size
+# the audio arrives in.
+#
+# samples go into a ring buffer written twice (at pos and pos + window size),
+# so the current window is always one contiguous view. the window function is
+# normalized to mean 1 so peak levels are comparable to an unwindowed block of
+# the same length.
+#
+class STFTAnalyzer:
+    WINDOWS = { "hann": np.hanning, "hamming": np.hamming, "blackman": np.blackman, "rect": np.ones }
+
+    def __init__(self, rate, window_time=0.046, hop_time=0.01, window="hann"):
+        self.rate = rate
+        self.window_size = max(2, int(rate * window_time))
+        self.hop_size = max(1, int(rate * hop_time))
+        self.fft_size = fast_fft_length(self.window_size)
+        self.window = self.WINDOWS[window](self.window_size).astype(np.float32)
+        self.window /= self.window.mean()
+        self.ring = np.zeros(2 * self.window_size, dtype=np.float32)
+        self.block = np.empty(self.window_size, dtype=np.float32)
+        self.pos = 0        # oldest sample, next write
+        self.pending = 0    # samples since last window
+        self.num_samples = 0 # samples consumed, at a yield: up to the end of the window
+
+    # windowed block (reused buffer) for every hop completed by samples
+    def blocks(self, samples):
+        W = self.window_size
+        i, n = 0, len(samples)
+        while i < n:
+            k = min(n - i, W - self.pos, self.hop_size - self.pending)
+            segment = samples[i:i + k]
+            self.ring[self.pos:self.pos + k] = segment
+            self.ring[self.pos + W:self.pos + W + k] = segment
+            self.pos = (self.pos + k) % W
+            self.pending += k
+            self.num_samples += k
+            i += k
+            if self.pending == self.hop_size:
+                self.pending = 0
+                np.multiply(self.ring[self.pos:self.pos + W], self.window, out=self.block)
+                yield self.block
+
+    def spectra(self, samples):
+        for block in self.blocks(samples):
+            yield np.fft.rfft(block, self.fft_size)
+
+#-------------------------------------------------------------------------------
+# onset/beat detection by spectral flux, one hop at a time (no look ahead)
+#
+# flux: mean increase of the log compressed magnitude since the previous hop
+# over a bin range, "onset" over most of the spectrum, "beat" over the bass
+# range. a detector fires when its flux rises above an adaptive threshold,
+# mean + k * std of the last threshold_time seconds of flux, and not within
+# its min interval of the last event. bpm from the median of recent beat
+# intervals.
+#
+# process() returns events (time, kind, strength 0..1, bpm or None)
+#
+class OnsetDetector:
+    BANDS           = { "onset": (30.0, 8000.0), "beat": (30.0, 150.0) }
+    MIN_INTERVAL    = { "onset": 0.05, "beat": 0.25 }
+    THRESHOLD_TIME  = 1.0
+    THRESHOLD_K     = 1.5
+    MIN_FLUX        = 0.01  # silence
+    COMPRESSION     = 100.0 # log(1 + c * magnitude)
+    BPM_RANGE       = (60.0, 200.0)
+
+    def __init__(self, rate, fft_size, hop_time, threshold_time=THRESHOLD_TIME, threshold_k=THRESHOLD_K):
+        self.kinds = list(self.BANDS)
+        self.threshold_k = threshold_k
+        self.min_interval = np.array([self.MIN_INTERVAL[kind] for kind in self.kinds])
+        num_bins = fft_size // 2 + 1
+
+        bands = np.array([self.BANDS[kind] for kind in self.kinds], dtype=np.float64)
+        start = np.clip(np.ceil(bands[:, 0] * fft_size / rate), 0, num_bins - 1).astype(np.intp)
+        stop = np.clip(np.floor(bands[:, 1] * fft_size / rate) + 1, start + 1, num_bins).astype(np.intp)
+        self.indices = np.stack((start, stop), axis=1).ravel()
+        self.band_bins = (stop - start).astype(np.float32)
+
+        self.magnitude = np.zeros(num_bins, dtype=np.float32)
+        self.log_mag = np.zeros(num_bins, dtype=np.float32)
+        self.prev_log_mag = np.zeros(num_bins, dtype=np.float32)
+        self.rise = np.zeros(num_bins + 1, dtype=np.float32) # extra zero bin for reduceat stop
+
+        self.history = np.zeros((max(4, int(threshold_time / hop_time)), len(self.kinds)), dtype=np.float32)
+        self.history_pos = 0
+        self.history_count = 0
+        self.above = np.zeros(len(self.kinds), dtype=bool)
+        self.last_event = np.full(len(self.kinds), -np.inf)
+        self.beat_times = collections.deque(maxlen=9)
+
+    def flux(self, spectrum):
+        n = len(self.magnitude)
+        np.abs(spectrum, out=self.magnitude, casting='unsafe')
+        np.multiply(self.magnitude, self.COMPRESSION, out=self.log_mag)
+        np.log1p(self.log_mag, out=self.log_mag)
+        np.subtract(self.log_mag, self.prev_log_mag, out=self.rise[:n])
+        np.maximum(self.rise[:n], 0.0, out=self.rise[:n])
+        self.log_mag, self.prev_log_mag = self.prev_log_mag, self.log_mag
+        return np.add.reduceat(self.rise, self.indices)[::2] / self.band_bins
+
+    def bpm(self):
+        intervals = np.diff(self.beat_times)
+        lo, hi = 60.0 / self.BPM_RANGE[1], 60.0 / self.BPM_RANGE[0]
+        intervals = intervals[(intervals >= lo) & (intervals <= hi)]
+        if len(intervals) < 2:
+            return None
+        return 60.0 / float(np.median(intervals))
+
+    # spectrum: rfft of the hop's window, t: time of the hop
+    def process(self, spectrum, t):
+        flux = self.flux(spectrum)
+
+        # threshold from the flux before this hop, no events until some history
+        events = []
+        if self.history_count >= len(self.history) // 4:
+            history = self.history[:self.history_count]
+            threshold = np.maximum(history.mean(axis=0) + self.threshold_k * history.std(axis=0), self.MIN_FLUX)
+            above = flux > threshold
+            fire = above & ~self.above & (t - self.last_event >= self.min_interval)
+            self.above = above
+            for i in np.flatnonzero(fire):
+                kind = self.kinds[i]
+                self.last_event[i] = t
+                bpm = None
+                if kind == "beat":
+                    self.beat_times.append(t)
+                    bpm = self.bpm()
+                events.append((t, kind, float(1.0 - threshold[i] / flux[i]), bpm))
+
+        self.history[self.history_pos] = flux
+        self.history_pos = (self.history_pos + 1) % len(self.history)
+        self.history_count = min(self.history_count + 1, len(self.history))
+        return events
@@ -0,0 +1,44 @@
+import traceback
+
+#-------------------------------------------------------------------------------
+# plain callback "signal" with the connect/emit api of a qt signal, used where
+# no qt event loop is available (headless). callbacks run on the emitting
+# thread, a failing callback doesn't stop the others.
+#
+class CallbackSignal:
+
+    class Bound:
+        def __init__(self, name):
+            self.name = name
+            self.callbacks = []
+
+        def connect(self, callback):
+            self.callbacks.append(callback)
+
+        def disconnect(self, callback=None):
+            if callback is None:
+                self.callbacks = []
+            elif callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+        def emit(self, *args):
+            for callback in list(self.callbacks):
+                try:
+                    callback(*args)
+                except Exception:
+                    print(f"E: {self.name} callback {callback}")
+                    traceback.print_exc()
+
+    def __init__(self, *types):
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        # bound signal per instance, stored in instance dict on first access
+        bound = self.Bound(self.name)
+        obj.__dict__[self.name] = bound
+        return bound
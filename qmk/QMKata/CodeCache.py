@@ -0,0 +1,32 @@
+import collections, hashlib
+
+#-------------------------------------------------------------------------------
+# compiled code objects of user code (animation editor) by source hash: the
+# same text (restart, reload without change, switching back to an earlier
+# version) isn't compiled again. compile() raises SyntaxError like compile().
+#
+class CodeCache:
+    MAX_ENTRIES = 32
+
+    def __init__(self):
+        self.codes = collections.OrderedDict()
+        self.num_compiled = 0
+
+    def compile(self, source, filename="<code>"):
+        key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        code = self.codes.get(key)
+        if code is None:
+            code = compile(source, filename, "exec")
+            self.num_compiled += 1
+            self.codes[key] = code
+            if len(self.codes) > self.MAX_ENTRIES:
+                self.codes.popitem(last=False)
+        else:
+            self.codes.move_to_end(key)
+        return code
+
+    # names defined by source executed in globals_dict
+    def exec(self, source, globals_dict, filename="<code>"):
+        local_scope = {}
+        exec(self.compile(source, filename), globals_dict, local_scope)
+        return local_scope
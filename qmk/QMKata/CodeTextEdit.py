@@ -0,0 +1,34 @@
+from PySide6.QtWidgets import QTextEdit
+from PySide6.QtGui import QFont, QKeyEvent
+from PySide6.QtCore import Qt
+
+#-------------------------------------------------------------------------------
+class CodeTextEdit(QTextEdit):
+    def __init__(self, filepath=None, parent=None):
+        super().__init__(parent)
+        self.setFont(QFont("Courier New", 9))
+        if filepath:
+            self.load_text_file(filepath)
+
+    def insertFromMimeData(self, source):
+        if source.hasText():
+            # only plain text
+            plain_text = source.text()
+            self.insertPlainText(plain_text)
+        else:
+            super().insertFromMimeData(source)
+
+    def load_text_file(self, filepath):
+        try:
+            with open(filepath, "r", encoding="utf-8") as file:
+                content = file.read()
+                self.setPlainText(content)
+        except Exception as e:
+            print(f"Error opening {filepath}: {e}")
+
+    def keyPressEvent(self, event: QKeyEvent):
+        if event.key() == Qt.Key_Tab:
+            # four spaces instead of a tab
+            self.insertPlainText("    ")
+        else:
+            super().keyPressEvent(event)
@@ -0,0 +1,105 @@
+import time, math
+
+#-------------------------------------------------------------------------------
+# drift free frame pacing: frame n is due at t0 + n/fps (monotonic), deadlines
+# don't accumulate timer/processing delays. when behind by more than a frame
+# the late frames are dropped to catch up.
+#
+# - wait(): sleep until next frame is due (worker threads)
+# - tick(): frame timer fired (qt timer), time_to_next() to arm the timer again
+# - ready(): non blocking throttle, True if next frame slot is due
+#
+# lateness of each frame vs its deadline is collected as jitter statistics.
+#
+class FramePacer:
+
+    def __init__(self, fps, name="pacer"):
+        self.name = name
+        self.schedule = (time.monotonic(), fps) # t0, fps
+        self.index = 0
+        self.reset_stats()
+
+    def reset(self, fps=None):
+        self.schedule = (time.monotonic(), fps or self.schedule[1])
+        self.index = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_frames = 0
+        self.num_dropped = 0
+        self.jitter_sum = 0.0
+        self.jitter_sum_sq = 0.0
+        self.jitter_max = 0.0
+
+    @property
+    def fps(self):
+        return self.schedule[1]
+
+    def set_fps(self, fps):
+        # keep current position when changing frame rate
+        t0, _fps = self.schedule
+        now = time.monotonic()
+        pos = (now - t0) * _fps
+        self.schedule = (now - pos / fps, fps)
+        self.index = int(pos)
+
+    def deadline(self, index):
+        t0, fps = self.schedule
+        return t0 + index / fps
+
+    def due_index(self):
+        t0, fps = self.schedule
+        return int((time.monotonic() - t0) * fps)
+
+    def time_to_next(self):
+        return max(0.0, self.deadline(self.index + 1) - time.monotonic())
+
+    #-------------------------------------------------------------------------------
+    # advance to next frame, or drop late frames, returns number of frames advanced
+    def _advance(self, now, record=True):
+        lateness = now - self.deadline(self.index + 1)
+        advance = 1
+        due = self.due_index()
+        if due > self.index + 1:
+            advance = due - self.index
+            lateness = now - self.deadline(due)
+            if record:
+                self.num_dropped += advance - 1
+        self.index += advance
+        if record:
+            self.num_frames += 1
+            self.jitter_sum += lateness
+            self.jitter_sum_sq += lateness * lateness
+            self.jitter_max = max(self.jitter_max, lateness)
+        return advance
+
+    def wait(self):
+        delay = self.time_to_next()
+        if delay > 0:
+            time.sleep(delay)
+        return self._advance(time.monotonic())
+
+    def tick(self):
+        return self._advance(time.monotonic())
+
+    def ready(self, tolerance=0.25):
+        now = time.monotonic()
+        deadline = self.deadline(self.index + 1)
+        if now < deadline - tolerance / self.fps:
+            return False
+        # source idle for more than a frame: resync, not a late frame
+        self._advance(now, record=now - deadline < 1 / self.fps)
+        return True
+
+    #-------------------------------------------------------------------------------
+    # jitter in ms
+    def stats(self):
+        n = max(1, self.num_frames)
+        mean = self.jitter_sum / n
+        std = math.sqrt(max(0.0, self.jitter_sum_sq / n - mean * mean))
+        return { 'frames': self.num_frames, 'dropped': self.num_dropped,
+                 'jitter_mean': mean * 1000, 'jitter_std': std * 1000, 'jitter_max': self.jitter_max * 1000 }
+
+    def stats_text(self):
+        s = self.stats()
+        return f"{s['frames']} frames, {s['dropped']} dropped, jitter {s['jitter_mean']:.1f}/{s['jitter_std']:.1f}/{s['jitter_max']:.1f} ms (mean/std/max)"
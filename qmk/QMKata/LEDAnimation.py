@@ -0,0 +1,265 @@
+import threading, time, traceback
+import numpy as np
+
+from FramePacer import FramePacer
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# hue 0..1 (any shape) to rgb 0..1 (shape + (3,)), full saturation and value
+def hue_to_rgb(hue):
+    hue = np.asarray(hue, dtype=np.float32)[..., None]
+    return np.clip(np.abs((hue * 6.0 + np.array([0.0, 4.0, 2.0], dtype=np.float32)) % 6.0 - 3.0) - 1.0, 0.0, 1.0)
+
+# hsv 0..1 (arrays of the same shape or scalars) to rgb 0..1 (shape + (3,))
+def hsv_to_rgb(hue, sat, val):
+    sat = np.asarray(sat, dtype=np.float32)[..., None]
+    val = np.asarray(val, dtype=np.float32)[..., None]
+    return val * (1.0 - sat + sat * hue_to_rgb(hue))
+
+#-------------------------------------------------------------------------------
+# per led geometry of the rgb matrix, computed once per matrix size (keyboard
+# model) and shared read-only by all shaders. led positions in qmk led_config
+# units (x 0..224, y 0..64) so qmk effect math (dx, dy, dist, atan2 relative
+# to k_rgb_matrix_center { 112, 32 }) can be ported as it is:
+#
+# col, row: matrix column/row, x, y: position, dx, dy: position - center,
+# dist: sqrt(dx^2 + dy^2), angle: atan2(dy, dx) -pi..pi, all (h, w) float32
+class LEDGeometry:
+    QMK_SIZE = (224.0, 64.0)
+
+    def __init__(self, matrix_size, center=None):
+        w, h = matrix_size
+        self.size = (w, h)
+        self.center = center if center else (self.QMK_SIZE[0] / 2, self.QMK_SIZE[1] / 2)
+        self.col, self.row = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        self.x = self.col * np.float32(self.QMK_SIZE[0] / max(1, w - 1))
+        self.y = self.row * np.float32(self.QMK_SIZE[1] / max(1, h - 1))
+        self.dx = self.x - np.float32(self.center[0])
+        self.dy = self.y - np.float32(self.center[1])
+        self.dist = np.hypot(self.dx, self.dy)
+        self.angle = np.arctan2(self.dy, self.dx)
+        for a in (self.col, self.row, self.x, self.y, self.dx, self.dy, self.dist, self.angle):
+            a.setflags(write=False)
+
+led_geometries = {}
+
+def led_geometry(matrix_size, center=None):
+    key = (tuple(matrix_size), tuple(center) if center else None)
+    geometry = led_geometries.get(key)
+    if geometry is None:
+        geometry = led_geometries[key] = LEDGeometry(matrix_size, center)
+    return geometry
+
+#-------------------------------------------------------------------------------
+# hot reload of the animate function (gui thread) while the animation thread
+# renders: host state is kept, init isn't run again. the previous function is
+# kept, revert() goes back to it when the new one fails.
+class AnimationRenderer:
+    previous_animate_fn = None
+
+    def swap(self, animate_fn):
+        self.previous_animate_fn = self.animate_fn
+        self.animate_fn = animate_fn
+
+    def revert(self):
+        if self.previous_animate_fn is None:
+            return False
+        self.animate_fn, self.previous_animate_fn = self.previous_animate_fn, None
+        return True
+
+#-------------------------------------------------------------------------------
+# animation at led resolution, no figure: user functions (methods of host, the
+# "self" of the animation code) draw into a float32 (h, w, 3) rgb 0..1 frame
+# at rgb matrix size
+#
+# - init(self, frame)
+# - animate(self, frame, i, t): modify frame in place or return a new array
+#
+# host.led_x, host.led_y: column/row of every led (h, w) float32, host.led_size
+# (w, h). render() returns a new (h, w, 3) uint8 frame (it is handed to the
+# keyboard thread).
+#
+class NumpyAnimation(AnimationRenderer):
+
+    def __init__(self, host, matrix_size, init_fn, animate_fn):
+        self.host = host
+        self.animate_fn = animate_fn
+        w, h = matrix_size
+        self.frame = np.zeros((h, w, 3), dtype=np.float32)
+        host.led_size = (w, h)
+        host.led_x, host.led_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        init_fn(host, self.frame)
+
+    def render(self, i, t):
+        frame = self.animate_fn(self.host, self.frame, i, t)
+        if frame is None:
+            frame = self.frame
+        elif frame.shape != self.frame.shape:
+            raise Exception(f"animate returned frame {frame.shape}, expected {self.frame.shape}")
+        else:
+            self.frame = frame
+        return (np.clip(frame, 0.0, 1.0) * 255).astype(np.uint8)
+
+#-------------------------------------------------------------------------------
+# per led shader (led_shader.py): one vectorized call per frame for all leds,
+# like a qmk effect_runner_dx_dy_dist loop body but over the whole matrix.
+#
+# - init(self, g)
+# - shader(self, g, t): returns rgb 0..1 (h, w, 3) (or anything broadcasting
+#   to it), g the shared LEDGeometry, t seconds since start
+#
+# host.frame_index is the frame index i for shaders counting frames.
+class ShaderAnimation(AnimationRenderer):
+
+    def __init__(self, host, matrix_size, init_fn, shader_fn):
+        self.host = host
+        self.animate_fn = shader_fn
+        self.geometry = led_geometry(matrix_size)
+        w, h = matrix_size
+        self.shape = (h, w, 3)
+        host.frame_index = 0
+        init_fn(host, self.geometry)
+
+    def render(self, i, t):
+        self.host.frame_index = i
+        rgb = np.broadcast_to(self.animate_fn(self.host, self.geometry, t), self.shape)
+        return (np.clip(rgb, 0.0, 1.0) * 255).astype(np.uint8)
+
+#-------------------------------------------------------------------------------
+# matplotlib compatibility (animation.py): init(self), animate(self, i) draw
+# into host.figure/host.ax of an off-screen Agg canvas of led resolution *
+# supersample pixels. render() reads the Agg buffer straight into numpy and
+# box filters it down to led resolution, no gui canvas, no qt.
+#
+# the figure keeps the size in inches of the former 800 px wide gui figure so
+# line widths/marker sizes (points) look the same, only the dpi is lowered.
+#
+class AggAnimation(AnimationRenderer):
+    FIGURE_WIDTH = 8.0 # inches
+
+    def __init__(self, host, matrix_size, init_fn, animate_fn, supersample=4):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.host = host
+        self.animate_fn = animate_fn
+        self.w, self.h = matrix_size
+        self.supersample = supersample
+        dpi = self.w * supersample / self.FIGURE_WIDTH
+        self.figure = Figure(figsize=(self.FIGURE_WIDTH, self.h * supersample / dpi), dpi=dpi, facecolor='black')
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.figure.subplots_adjust(left=0, right=1, top=1, bottom=0)
+        host.figure = self.figure
+        host.ax = self.figure.add_subplot(111)
+        host.ax.set_facecolor('black')
+        # ticks are outside the figure anyway, their labels fail at low dpi
+        host.ax.xaxis.set_visible(False)
+        host.ax.yaxis.set_visible(False)
+        init_fn(host)
+
+    def render(self, i, t):
+        self.animate_fn(self.host, i)
+        self.canvas.draw()
+        w, h, s = self.w, self.h, self.supersample
+        rgb = np.asarray(self.canvas.buffer_rgba())[:h * s, :w * s, :3]
+        if s > 1:
+            rgb = rgb.reshape(h, s, w, s, 3).mean(axis=(1, 3))
+        return rgb.astype(np.uint8)
+
+#-------------------------------------------------------------------------------
+# deterministic animations (frame i only depends on i, loops after n_frames):
+# every frame is rendered once into a (n_frames, h, w, 3) uint8 buffer, then
+# played from it. the renderer gets t = i / fps so the loop is the same every
+# time. frames are filled on first use (skipped ones too), returned frames are
+# read-only views of the buffer, no render or copy once it is full. hot reload
+# (swap/revert) starts filling again.
+class LoopBuffer(AnimationRenderer):
+    MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, renderer, n_frames, fps, matrix_size):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+        w, h = matrix_size
+        if n_frames * h * w * 3 > self.MAX_BYTES:
+            raise Exception(f"loop buffer of {n_frames} frames exceeds {self.MAX_BYTES} bytes")
+        self.renderer = renderer
+        self.fps = fps
+        self.frames = np.zeros((n_frames, h, w, 3), dtype=np.uint8)
+        self.filled = 0
+        self.fill_time = 0.0
+
+    def swap(self, animate_fn):
+        self.renderer.swap(animate_fn)
+        self.filled = 0
+
+    def revert(self):
+        if not self.renderer.revert():
+            return False
+        self.filled = 0
+        return True
+
+    def render(self, i, t):
+        n_frames = len(self.frames)
+        i %= n_frames
+        if self.filled <= i:
+            if self.filled == 0:
+                self.fill_time = 0.0
+            t0 = time.monotonic()
+            while self.filled <= i:
+                self.frames[self.filled] = self.renderer.render(self.filled, self.filled / self.fps)
+                self.filled += 1
+            self.fill_time += time.monotonic() - t0
+            if self.filled == n_frames:
+                self.dbg.tr('D', "loop buffer: {} frames {} bytes, rendered in {:.3f} s", n_frames, self.frames.nbytes, self.fill_time)
+        frame = self.frames[i]
+        frame.flags.writeable = False
+        return frame
+
+#-------------------------------------------------------------------------------
+# renders frames at fps on its own thread (FramePacer deadlines, late frames
+# dropped), on_frame(frame) on this thread, on_frame(None) when stopped.
+# renderer: render(i, t) -> (h, w, 3) uint8, i wraps at n_frames (0: no wrap),
+# t seconds since start.
+class AnimationThread(threading.Thread):
+
+    def __init__(self, renderer, fps, on_frame, n_frames=0):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        super().__init__(name="AnimationThread", daemon=True)
+        self.renderer = renderer
+        self.fps = fps
+        self.on_frame = on_frame
+        self.n_frames = n_frames
+        self.running = False
+        self.stop_event = threading.Event()
+        self.render_time = 0.0
+
+    def run(self):
+        self.pacer = FramePacer(self.fps, "animation")
+        self.running = True
+        t0 = time.monotonic()
+        index = 0
+        while self.running:
+            t = time.monotonic()
+            try:
+                frame = self.renderer.render(index % self.n_frames if self.n_frames else index, t - t0)
+            except Exception:
+                traceback.print_exc()
+                if self.renderer.revert():
+                    self.dbg.tr('D', "animate failed, reverted to previous function")
+                    continue
+                break
+            self.render_time += time.monotonic() - t
+            self.on_frame(frame)
+            # wait for the next deadline, stop() wakes up
+            delay = self.pacer.time_to_next()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            index += self.pacer.tick()
+        self.running = False
+        self.dbg.tr('D', "animation: {}, render {:.1f} us/frame", self.pacer.stats_text(),
+                    self.render_time * 1e6 / max(1, self.pacer.num_frames))
+        self.on_frame(None)
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
@@ -39,14 +39,17 @@ class LayerAutoSwitchTab(QWidget):
 
         self.current_layer = 0
         self.num_keyb_layers = num_keyb_layers
-        self.ws_server = None
+        self.ws_port = None
 
         super().__init__()
         self.init_gui()
 
-    async def ws_handler(self, websocket, path):
+    # shared ws server thread, signal queued to gui thread
+    async def ws_handler(self, websocket, path=None):
         async for message in websocket:
             self.dbg.tr('DEBUG', f"ws_handler: {message}")
+            if isinstance(message, bytes):
+                message = message.decode('utf-8', 'ignore')
             if message.startswith("layer:"):
                 try:
                     layer = int(message.split(":")[1])
@@ -56,27 +59,28 @@ class LayerAutoSwitchTab(QWidget):
 
     def ws_server_startstop(self, state):
         #self.dbg.tr('DEBUG', f"{state}")
+        server = WSServer.shared()
         if Qt.CheckState(state) == Qt.CheckState.Checked:
-            self.ws_server = WSServer(self.ws_handler, int(self.layer_switch_server_port.text()))
-            self.ws_server.start()
+            server.add_route("layer", self.ws_handler, ("layer:",))
+            try:
+                self.ws_port = int(self.layer_switch_server_port.text())
+                server.listen(self.ws_port, "layer")
+            except Exception as e:
+                # port in use, ...: route not served, checkbox back to off
+                self.dbg.tr('DEBUG', f"{e}")
+                server.remove_route("layer")
+                self.ws_port = None
+                self.layer_switch_server_checkbox.blockSignals(True)
+                self.layer_switch_server_checkbox.setChecked(False)
+                self.layer_switch_server_checkbox.blockSignals(False)
         else:
             try:
-                self.ws_server.stop()
-                self.ws_server.wait()
-                self.ws_server = None
+                server.unlisten(self.ws_port)
+                server.remove_route("layer")
+                self.ws_port = None
             except Exception as e:
                 self.dbg.tr('DEBUG', f"{e}")
 
-    async def ws_handler(self, websocket, path):
-        async for message in websocket:
-            self.dbg.tr('DEBUG', f"ws_handler: {message}")
-            if message.startswith("layer:"):
-                try:
-                    layer = int(message.split(":")[1])
-                    self.signal_keyb_set_layer.emit(layer)
-                except Exception as e:
-                    self.dbg.tr('DEBUG', f"ws_handler: {e}")
-
     def init_gui(self):
         layout = QVBoxLayout()
         layout.setAlignment(Qt.AlignTop)
@@ -100,7 +104,7 @@ class LayerAutoSwitchTab(QWidget):
                             "select '-' to unselect program.\n"
                             "\n"
                             "enabling \"layer switch ws server\" allow applications to send layer switch requests\n"
-                            "by sending \"layer:<number>\" to \"ws://localhost:<port>\"\n"
+                            "by sending \"layer:<number>\" to \"ws://localhost:<port>\" (or \"ws://localhost:<port>/layer\")\n"
                             )
         layout.addWidget(self.label)
         #---------------------------------------
@@ -177,6 +181,5 @@ class LayerAutoSwitchTab(QWidget):
             self.winfocus_textedit.setPlainText('\n'.join(lines[-10:]))
 
     def closeEvent(self, event):
-        if self.ws_server:
-            self.ws_server.stop()
-            self.ws_server.wait()
+        if self.ws_port:
+            self.ws_server_startstop(Qt.CheckState.Unchecked)
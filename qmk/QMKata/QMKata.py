@@ -16,16 +16,20 @@
 # USA.
 
 # this code is like a box of bugs, you never know what you're gonna get
-import os, sys, argparse
+import os, sys, argparse, importlib
+
+from StartupTimer import StartupTimer
+startup_timer = StartupTimer()
 
 from PySide6 import QtCore
 from PySide6.QtCore import Qt, Signal
 from PySide6.QtWidgets import QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, QHBoxLayout, QFrame
 from PySide6.QtWidgets import QTextEdit, QPushButton,  QLabel, QLineEdit, QTreeView
-from PySide6.QtWidgets import  QComboBox, QMessageBox
+from PySide6.QtWidgets import  QComboBox, QMessageBox, QFileDialog
 from PySide6.QtGui import QFont, QTextCursor
 from PySide6.QtGui import QIntValidator, QDoubleValidator
 from PySide6.QtGui import QStandardItemModel, QStandardItem
+startup_timer.mark("import PySide6")
 
 from DebugTracer import DebugTracer
 try:
@@ -33,20 +37,35 @@ try:
 except:
     pass
 
-from QMKataKeyboard import QMKataKeyboard
+from QMKataKeyboardQt import QMKataKeyboardQt
+startup_timer.mark("import keyboard")
 from ConsoleTab import ConsoleTab
-from WSServer import WSServer
-from RGBVideoTab import RGBVideoTab
-from RGBAudioTab import RGBAudioTab
-from RGBAnimationTab import RGBAnimationTab, CodeTextEdit
-from RGBDynLDAnimationTab import RGBDynLDAnimationTab
+from CodeTextEdit import CodeTextEdit
 from LayerAutoSwitchTab import LayerAutoSwitchTab
+from WSServer import WSServer
+from WSKeyboardHandler import WSKeyboardHandler
+from WSSubscriptions import WSSubscriptions
+# rgb matrix sub tabs (cv2, matplotlib, numpy, audio, websockets) are
+# imported when the tab is first shown, see RGBMatrixTab
+startup_timer.mark("import tabs")
 
 if __name__ != "__main__":
     exit()
 
 #-------------------------------------------------------------------------------
 class RGBMatrixTab(QWidget):
+    signal_rgb_show_record = Signal(object)
+    signal_rgb_show_play = Signal(object)
+    signal_tab_loaded = Signal(str, object)
+
+    # sub tabs loaded on first show: (tab name, attribute, module/class name)
+    SUB_TABS = [
+        ('video', 'rgb_video_tab', 'RGBVideoTab'),
+        ('animation', 'rgb_animation_tab', 'RGBAnimationTab'),
+        ('audio', 'rgb_audio_tab', 'RGBAudioTab'),
+        ('dynld animation', 'rgb_dynld_animation_tab', 'RGBDynLDAnimationTab'),
+    ]
+
     def __init__(self, keyboard_model):
         self.keyboard_model = keyboard_model
         try:
@@ -61,19 +80,81 @@ class RGBMatrixTab(QWidget):
         layout = QVBoxLayout()
         self.tab_widget = QTabWidget()
 
-        self.rgb_video_tab = RGBVideoTab((app_width, app_height), self, self.rgb_matrix_size)
-        self.rgb_animation_tab = RGBAnimationTab(self.rgb_matrix_size)
-        self.rgb_audio_tab = RGBAudioTab(self.rgb_matrix_size)
-        self.rgb_dynld_animation_tab = RGBDynLDAnimationTab()
+        # placeholder widgets until the tab is shown
+        for name, attr, _ in self.SUB_TABS:
+            setattr(self, attr, None)
+            self.tab_widget.addTab(QWidget(), name)
+        self.tab_widget.currentChanged.connect(self.load_tab)
 
-        self.tab_widget.addTab(self.rgb_video_tab, 'video')
-        self.tab_widget.addTab(self.rgb_animation_tab, 'animation')
-        self.tab_widget.addTab(self.rgb_audio_tab, 'audio')
-        self.tab_widget.addTab(self.rgb_dynld_animation_tab, 'dynld animation')
+        #---------------------------------------
+        # record rgb show from any source, replay recorded show
+        hlayout = QHBoxLayout()
+        self.show_record_button = QPushButton("record show")
+        self.show_record_button.clicked.connect(self.rgb_show_record)
+        self.show_play_button = QPushButton("play show")
+        self.show_play_button.clicked.connect(self.rgb_show_play)
+        hlayout.addStretch(1)
+        hlayout.addWidget(self.show_record_button)
+        hlayout.addWidget(self.show_play_button)
 
         layout.addWidget(self.tab_widget)
+        layout.addLayout(hlayout)
         self.setLayout(layout)
 
+    def create_tab(self, class_name):
+        tab_class = getattr(importlib.import_module(class_name), class_name)
+        if class_name == 'RGBVideoTab':
+            return tab_class((app_width, app_height), self, self.rgb_matrix_size)
+        if class_name == 'RGBDynLDAnimationTab':
+            return tab_class()
+        return tab_class(self.rgb_matrix_size)
+
+    def load_tab(self, index):
+        name, attr, class_name = self.SUB_TABS[index]
+        if getattr(self, attr):
+            return
+        load_timer = StartupTimer(f"load {name} tab")
+        tab = self.create_tab(class_name)
+        setattr(self, attr, tab)
+        self.tab_widget.blockSignals(True)
+        self.tab_widget.removeTab(index)
+        self.tab_widget.insertTab(index, tab, name)
+        self.tab_widget.setCurrentIndex(index)
+        self.tab_widget.blockSignals(False)
+        load_timer.mark(class_name)
+        load_timer.report()
+        self.signal_tab_loaded.emit(attr, tab)
+
+    def showEvent(self, event):
+        self.load_tab(self.tab_widget.currentIndex())
+        super().showEvent(event)
+
+    def rgb_show_record(self):
+        if self.show_record_button.text() != "record show":
+            self.signal_rgb_show_record.emit(None)
+            self.show_record_button.setText("record show")
+            return
+
+        filename, _ = QFileDialog.getSaveFileName(self, "record show", "", "rgb show (*.qmks)")
+        if filename:
+            self.signal_rgb_show_record.emit(filename)
+            self.show_record_button.setText("stop recording")
+
+    def rgb_show_play(self):
+        if self.show_play_button.text() != "play show":
+            self.signal_rgb_show_play.emit(None)
+            self.show_play_button.setText("play show")
+            return
+
+        filename, _ = QFileDialog.getOpenFileName(self, "play show", "", "rgb show (*.qmks)")
+        if filename:
+            self.signal_rgb_show_play.emit(filename)
+            self.show_play_button.setText("stop show")
+
+    # replay ended by itself (show without loop, error)
+    def on_rgb_show_done(self):
+        self.show_play_button.setText("play show")
+
 #-------------------------------------------------------------------------------
 class TreeviewWidget(QWidget):
 
@@ -331,8 +412,9 @@ class MainWindow(QMainWindow):
         self.setFixedSize(app_width, app_height)
 
         # instantiate qmkata keyboard
-        self.keyboard = QMKataKeyboard(port=None, vid_pid=self.keyboard_vid_pid)
+        self.keyboard = QMKataKeyboardQt(port=None, vid_pid=self.keyboard_vid_pid)
         num_keyb_layers = self.keyboard.num_layers()
+        startup_timer.mark("keyboard open")
 
         #-----------------------------------------------------------
         # add tabs
@@ -352,6 +434,7 @@ class MainWindow(QMainWindow):
         tab_widget.addTab(self.keyb_status_tab, 'keyboard status')
 
         self.setCentralWidget(tab_widget)
+        startup_timer.mark("tabs")
         #-----------------------------------------------------------
         # connect signals
         self.keyboard.signal_console_output.connect(self.console_tab.update_text)
@@ -363,11 +446,10 @@ class MainWindow(QMainWindow):
         self.keyboard.signal_status.connect(self.keyb_status_tab.update_view)
 
         self.console_tab.signal_cli_command.connect(self.keyboard.keyb_set_cli_command)
-        self.rgb_matrix_tab.rgb_video_tab.signal_rgb_image.connect(self.keyboard.keyb_set_rgb_image)
-        self.rgb_matrix_tab.rgb_animation_tab.signal_rgb_image.connect(self.keyboard.keyb_set_rgb_image)
-        self.rgb_matrix_tab.rgb_audio_tab.signal_rgb_image.connect(self.keyboard.keyb_set_rgb_image)
-        self.rgb_matrix_tab.rgb_audio_tab.signal_peak_levels.connect(self.rgb_matrix_tab.rgb_animation_tab.on_audio_peak_levels)
-        self.rgb_matrix_tab.rgb_dynld_animation_tab.signal_dynld_function.connect(self.keyboard.keyb_set_dynld_function)
+        self.rgb_matrix_tab.signal_tab_loaded.connect(self.on_rgb_tab_loaded)
+        self.rgb_matrix_tab.signal_rgb_show_record.connect(self.keyboard.rgb_show_record)
+        self.rgb_matrix_tab.signal_rgb_show_play.connect(self.keyboard.rgb_show_play)
+        self.keyboard.signal_rgb_show_done.connect(self.rgb_matrix_tab.on_rgb_show_done)
         self.layer_switch_tab.signal_keyb_set_layer.connect(self.keyboard.keyb_set_default_layer)
         self.keyb_config_tab.signal_keyb_set_config.connect(self.keyboard.keyb_set_config)
         self.keyb_config_tab.signal_keyb_get_config.connect(self.keyboard.keyb_get_config)
@@ -375,6 +457,13 @@ class MainWindow(QMainWindow):
         self.keyb_script_tab.signal_run_script.connect(self.keyboard.run_script)
         self.keyb_status_tab.signal_keyb_get_status.connect(self.keyboard.keyb_get_status)
 
+        # keyboard config/status/cli and event subscription routes on the shared ws server,
+        # ports are opened by the tabs
+        self.ws_keyboard_handler = WSKeyboardHandler(self.keyboard, WSServer.shared())
+        self.ws_keyboard_handler.add_routes()
+        self.ws_subscriptions = WSSubscriptions(self.keyboard, WSServer.shared())
+        self.ws_subscriptions.add_routes()
+
         #-----------------------------------------------------------
         # window focus listener
         try:
@@ -387,6 +476,25 @@ class MainWindow(QMainWindow):
         #-----------------------------------------------------------
         # start keyboard communication
         self.keyboard.start()
+        startup_timer.mark("keyboard handshake")
+        startup_timer.report()
+
+    # connect rgb matrix sub tab signals when the tab is loaded
+    def on_rgb_tab_loaded(self, attr, tab):
+        if attr == 'rgb_dynld_animation_tab':
+            tab.signal_dynld_function.connect(self.keyboard.keyb_set_dynld_function)
+            return
+        tab.signal_rgb_image.connect(self.keyboard.keyb_set_rgb_image)
+        if attr in ('rgb_video_tab', 'rgb_audio_tab', 'rgb_animation_tab'):
+            tab.signal_rgb_frame.connect(self.keyboard.keyb_set_rgb_array)
+
+        audio_tab = self.rgb_matrix_tab.rgb_audio_tab
+        animation_tab = self.rgb_matrix_tab.rgb_animation_tab
+        if attr in ('rgb_audio_tab', 'rgb_animation_tab') and audio_tab and animation_tab:
+            audio_tab.signal_peak_levels.connect(animation_tab.on_audio_peak_levels)
+            audio_tab.signal_onset.connect(animation_tab.on_audio_onset)
+        if attr == 'rgb_audio_tab':
+            tab.signal_onset.connect(lambda event: self.ws_subscriptions.publish("onset", event))
 
     def closeEvent(self, event):
         try:
@@ -397,6 +505,7 @@ class MainWindow(QMainWindow):
         # close event to child widgets
         for child in self.findChildren(QWidget):
             child.closeEvent(event)
+        WSServer.shutdown()
         event.accept()
 
 class KeyboardSelectionPopup(QMessageBox):
@@ -433,7 +542,7 @@ def main(keyboard_vid_pid):
 
     selected_keyboard = ""
     if keyboard_vid_pid[0] == None:
-        keyboards, keyb_models = QMKataKeyboard.attached_keyboards()
+        keyboards, keyb_models = QMKataKeyboardQt.attached_keyboards()
         if len(keyboards):
             selection_popup = KeyboardSelectionPopup(keyboards)
             if selection_popup.exec():
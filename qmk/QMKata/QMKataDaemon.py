@@ -0,0 +1,358 @@
+import sys, json, argparse, threading, queue, time
+
+from StartupTimer import StartupTimer
+startup_timer = StartupTimer()
+
+from QMKataKeyboard import QMKataKeyboard
+from DebugTracer import DebugTracer
+startup_timer.mark("import keyboard")
+
+#-------------------------------------------------------------------------------
+# headless qmkata: no PySide6, configured from a json file (see qmkata_daemon.json)
+#
+# - layer auto switch on window focus
+# - ws server (one thread for all ports) for layer switch ("layer:<n>"), rgb frames
+#   ("rgb.img:<rgb bytes>"), keyboard config/status/cli and event subscriptions, see WSServer
+# - shared memory frame ring for local rgb producers
+# - audio peak level rgb
+# - video playback
+#
+# heavy modules (numpy, cv2, websockets, audio capture) are only imported when
+# the feature using them is enabled
+#-------------------------------------------------------------------------------
+DEFAULT_CONFIG = {
+    "vid": None,
+    "pid": None,
+    "console": True,
+    "layer_switch": {
+        "enabled": True,
+        "default_layer": 0,
+        # program short name (e.g. "notepad.exe") -> layer
+        "programs": {},
+    },
+    "ws_layer_port": 8765,
+    "ws_rgb_port": 8787,
+    # shared memory frame ring name for local producers, null to disable
+    "shm_ring": "qmkata_rgb",
+    "audio": {
+        "enabled": False,
+        # "loopback" (wasapi), "file:<wav/flac>" (looped) or "signal:<sine|sweep|noise|beats>"
+        "source": "loopback",
+        "freq_bands_colors": "freq_bands_colors.json",
+        # stft analysis window and hop (peak level update interval) in seconds
+        "window_time": 0.046,
+        "hop_time": 0.01,
+        "window": "hann",
+        # "color": all leds one color mixed from the bands, "spectrum": spectrum analyzer
+        "mode": "color",
+        # flash on detected beats
+        "beat_flash": False,
+        "rgb_multiplier": [1.0, 1.0, 1.0],
+    },
+    "video": {
+        "file": None,
+        "ffmpeg": False,
+        "fps": 0, # 0 for video frame rate
+        "rgb_multiplier": [1.0, 1.0, 1.0],
+    },
+}
+
+def load_config(filename):
+    config = json.loads(json.dumps(DEFAULT_CONFIG)) # deep copy
+    if not filename:
+        return config
+    with open(filename, 'r') as file:
+        user_config = json.load(file)
+    for key, val in user_config.items():
+        if isinstance(val, dict) and isinstance(config.get(key), dict):
+            config[key].update(val)
+        else:
+            config[key] = val
+    return config
+
+#-------------------------------------------------------------------------------
+class QMKataDaemon:
+
+    def __init__(self, config):
+        self.dbg = DebugTracer(zones={'D':1, 'WINFOCUS':0, 'WS_MSG':0}, obj=self)
+
+        self.config = config
+        self.keyboard = None
+        self.winfocus_hook = None
+        self.audio_thread = None
+        self.audio_rgb = None
+        self.spectrum = None
+        self.beat_flash = None
+        self.video_thread = None
+        self.video_player = None
+        self.rgb_mixer = None
+        self.shm_ring = None
+        self.ws_server = None
+        self.ws_subscriptions = None
+        self.running = False
+        self.current_layer = None
+
+    def keyboard_vid_pid(self):
+        vid_pid = self.config["vid"], self.config["pid"]
+        if vid_pid[0] is not None and vid_pid[1] is not None:
+            return tuple(int(v, 16) if isinstance(v, str) else v for v in vid_pid)
+
+        keyboards, keyb_models = QMKataKeyboard.attached_keyboards()
+        if not keyboards:
+            raise Exception("no keyboard attached")
+        model = keyb_models[keyboards[0]]
+        return model.VID, model.PID
+
+    #-------------------------------------------------------------------------------
+    def start(self):
+        self.keyboard = QMKataKeyboard(port=None, vid_pid=self.keyboard_vid_pid())
+        self.rgb_matrix_size = self.keyboard.rgb_matrix_size()
+        if self.config["console"]:
+            self.keyboard.signal_console_output.connect(lambda line: print(line, end=""))
+        startup_timer.mark("keyboard open")
+        self.keyboard.start()
+        startup_timer.mark("keyboard handshake")
+        self.running = True
+
+        self.start_layer_switch()
+        startup_timer.mark("layer switch")
+        self.start_audio()
+        self.start_video()
+        startup_timer.mark("audio/video")
+        startup_timer.report()
+
+    def stop(self):
+        self.running = False
+        if self.winfocus_hook:
+            self.winfocus_hook.stop()
+        # only started by listen(), not without ws ports
+        if self.ws_server and self.ws_server.is_alive():
+            self.ws_server.stop()
+            self.ws_server.join()
+        if self.audio_thread:
+            self.audio_thread.stop()
+            self.audio_thread.join()
+        if self.rgb_mixer:
+            self.rgb_mixer.stop()
+            self.rgb_mixer.join()
+        if self.shm_ring:
+            self.shm_ring.close()
+        if self.video_player:
+            self.video_thread.stop()
+            self.video_player.join()
+            self.video_thread.join()
+        if self.keyboard:
+            self.keyboard.stop()
+        self.dbg.tr('D', "stopped")
+
+    #-------------------------------------------------------------------------------
+    def set_layer(self, layer):
+        if layer != self.current_layer:
+            self.dbg.tr('D', "layer set: {}", layer)
+            self.keyboard.keyb_set_default_layer(layer)
+            self.current_layer = layer
+
+    def start_layer_switch(self):
+        if not self.config["layer_switch"]["enabled"]:
+            return
+        try:
+            from WinFocusHook import WinFocusHook
+            self.winfocus_hook = WinFocusHook(self.on_winfocus)
+        except Exception as e:
+            self.dbg.tr('D', "window focus hook not available: {}", e)
+            return
+        threading.Thread(target=self.winfocus_hook.run, name="WinFocusHook", daemon=True).start()
+
+    # line "P:<pid>\t<program short name>\t<window title>"
+    def on_winfocus(self, line):
+        self.dbg.tr('WINFOCUS', "{}", line)
+        focus_win = line.split("\t")
+        layer_switch = self.config["layer_switch"]
+        layer = layer_switch["default_layer"]
+        try:
+            layer = layer_switch["programs"].get(focus_win[1].strip(), layer)
+        except IndexError:
+            pass
+        self.set_layer(int(layer))
+
+    #-------------------------------------------------------------------------------
+    async def ws_layer_handler(self, websocket, path=None):
+        try:
+            async for message in websocket:
+                self.dbg.tr('WS_MSG', "ws_layer_handler: {}", message)
+                if isinstance(message, bytes):
+                    message = message.decode('utf-8', 'ignore')
+                if message.startswith("layer:"):
+                    try:
+                        layer = int(message.split(":")[1])
+                        await self.ws_server.call(self.set_layer, layer)
+                    except Exception as e:
+                        self.dbg.tr('D', "ws_layer_handler: {}", e)
+        except Exception as e:
+            self.dbg.tr('WS_MSG', "ws_layer_handler: {}", e)
+
+    # mixer thread
+    def on_mixer_frame(self, frame):
+        self.keyboard.keyb_set_rgb_frame(frame, (1.0, 1.0, 1.0), "ws")
+
+    def serve(self):
+        from WSServer import WSServer
+        from WSKeyboardHandler import WSKeyboardHandler
+        from WSSubscriptions import WSSubscriptions
+        self.ws_server = WSServer()
+        self.ws_server.add_route("layer", self.ws_layer_handler, ("layer:",))
+        WSKeyboardHandler(self.keyboard, self.ws_server).add_routes()
+        self.ws_subscriptions = WSSubscriptions(self.keyboard, self.ws_server)
+        self.ws_subscriptions.add_routes()
+
+        if self.config["ws_rgb_port"] or self.config["shm_ring"]:
+            # ws clients and shared memory frames mixed at keyboard refresh rate, latest frame wins
+            from RGBStreamMixer import RGBStreamMixer
+            self.rgb_mixer = RGBStreamMixer(self.rgb_matrix_size, self.on_mixer_frame, self.keyboard.rgb_max_refresh())
+            self.rgb_mixer.start()
+        if self.config["ws_rgb_port"]:
+            from RGBFrameProtocol import RGBFrameProtocol
+            self.ws_server.add_route("rgb", self.rgb_mixer.ws_client_handler, RGBFrameProtocol.PREFIXES)
+        if self.config["shm_ring"]:
+            try:
+                from SharedFrameRing import SharedFrameRing
+                self.shm_ring = SharedFrameRing.create(self.config["shm_ring"], self.rgb_matrix_size)
+                self.rgb_mixer.add_ring(self.shm_ring)
+                self.dbg.tr('D', "shared memory ring {}", self.config["shm_ring"])
+            except Exception as e:
+                self.dbg.tr('D', "shared memory ring: {}", e)
+        # all routes on every port, legacy clients without path/prefix get the port's route
+        for port, route in ((self.config["ws_layer_port"], "layer"), (self.config["ws_rgb_port"], "rgb")):
+            if port:
+                self.ws_server.listen(port, route)
+        while self.running:
+            time.sleep(0.5)
+
+    #-------------------------------------------------------------------------------
+    def start_audio(self):
+        audio = self.config["audio"]
+        if not audio["enabled"]:
+            return
+        from AudioCapture import AudioCaptureThread, AudioPeakRGB
+        from AudioSource import create_audio_source
+        if audio["source"] == "loopback" and not AudioCaptureThread.available():
+            return
+
+        self.audio_rgb = AudioPeakRGB(audio["hop_time"])
+        self.audio_rgb.load_freq_bands_colors(audio["freq_bands_colors"])
+        if audio["mode"] == "spectrum":
+            from SpectrumRenderer import SpectrumRenderer
+            self.spectrum = SpectrumRenderer(self.rgb_matrix_size, self.audio_rgb.freq_rgb)
+        self.audio_thread = AudioCaptureThread(self.audio_rgb.freq_bands, audio["hop_time"],
+                                               audio["window_time"], audio["window"],
+                                               create_audio_source(audio["source"]))
+        if audio["beat_flash"]:
+            from SpectrumRenderer import BeatFlash
+            self.beat_flash = BeatFlash()
+        self.audio_thread.connect_callback(self.on_audio_peak_levels)
+        self.audio_thread.connect_onset_callback(self.on_audio_onset)
+        self.audio_thread.start()
+
+    # audio thread, onset/beat events to ws subscribers (topic "onset")
+    def on_audio_onset(self, event):
+        if self.beat_flash:
+            self.beat_flash.trigger(event)
+        if self.ws_subscriptions:
+            self.ws_subscriptions.publish("onset", event)
+
+    def on_audio_peak_levels(self, peak_levels):
+        import numpy as np
+        rgb_multiplier = self.config["audio"]["rgb_multiplier"]
+        if peak_levels is None:
+            self.keyboard.keyb_set_rgb_frame(None, rgb_multiplier, "audio")
+            return
+
+        rgb, _ = self.audio_rgb.process(peak_levels)
+        if self.spectrum:
+            frame = self.spectrum.render(self.audio_rgb.band_levels(peak_levels))
+            if self.beat_flash:
+                frame = self.beat_flash.apply(frame).astype(np.uint8)
+            self.keyboard.keyb_set_rgb_frame(frame, rgb_multiplier, "audio")
+            return
+        if rgb is None:
+            return
+        if self.beat_flash:
+            rgb = self.beat_flash.apply(rgb)
+        w, h = self.rgb_matrix_size
+        frame = np.full((h, w, 3), [int(c) for c in rgb], dtype=np.uint8)
+        self.keyboard.keyb_set_rgb_frame(frame, rgb_multiplier, "audio")
+
+    #-------------------------------------------------------------------------------
+    def start_video(self):
+        video = self.config["video"]
+        if not video["file"]:
+            return
+        from VideoSource import VideoDecodeThread, FFmpegVideoSource
+        from VideoCache import VideoCache
+
+        use_ffmpeg = video["ffmpeg"] and FFmpegVideoSource.available()
+        self.video_thread = VideoDecodeThread(video["file"], VideoCache(), self.keyboard.name,
+                                              self.rgb_matrix_size, None, use_ffmpeg,
+                                              on_video_info=self.on_video_info)
+        self.video_player = threading.Thread(target=self.play_video, name="play_video", daemon=True)
+        self.video_thread.start()
+        self.video_player.start()
+
+    def on_video_info(self, fps):
+        if self.config["video"]["fps"] > 0:
+            fps = self.config["video"]["fps"]
+            self.video_thread.set_framerate(fps)
+        self.dbg.tr('D', "video frame rate: {}", fps)
+
+    # send newest due frame at each pacer deadline
+    def play_video(self):
+        rgb_multiplier = self.config["video"]["rgb_multiplier"]
+        pacer = self.video_thread.pacer
+        pending_frame = None
+        while self.running and self.video_thread.is_alive():
+            pacer.wait()
+            due = pacer.due_index()
+            frame = None
+            while True:
+                if pending_frame is None:
+                    try:
+                        pending_frame = self.video_thread.frame_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if pending_frame[0] > due:
+                    break
+                frame = pending_frame
+                pending_frame = None
+
+            if frame is not None:
+                self.keyboard.keyb_set_rgb_frame(frame[1], rgb_multiplier, "video")
+        self.dbg.tr('D', "video: {}", pacer.stats_text())
+        self.keyboard.keyb_set_rgb_frame(None, rgb_multiplier, "video")
+
+#-------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="qmkata headless daemon")
+    parser.add_argument('--config', required=False, help='config json file')
+    parser.add_argument('--vid', required=False, type=lambda x: int(x, 16),
+                        help='keyboard vid in hex')
+    parser.add_argument('--pid', required=False, type=lambda x: int(x, 16),
+                        help='keyboard pid in hex')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    if args.vid is not None and args.pid is not None:
+        config["vid"], config["pid"] = args.vid, args.pid
+
+    daemon = QMKataDaemon(config)
+    try:
+        daemon.start()
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"E: {e}")
+    finally:
+        daemon.stop()
+
+if __name__ == "__main__":
+    sys.exit(main())
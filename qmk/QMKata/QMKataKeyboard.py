@@ -15,15 +15,13 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA.
 
-from PySide6 import QtCore
-from PySide6.QtCore import Signal
-from PySide6.QtGui import QImage, QColor, QPainter
-
-import pyfirmata2, serial, time, numpy as np
-import glob, inspect, os, importlib.util, struct
+import pyfirmata2, serial, time
+import glob, inspect, os, importlib.util, struct, threading
 from pathlib import Path
 
 from SerialRawHID import SerialRawHID
+from CallbackSignal import CallbackSignal
+from FramePacer import FramePacer
 from DebugTracer import DebugTracer
 
 
@@ -43,39 +41,16 @@ def find_com_port(vid, pid):
 #endregion
 
 #region combine images
-def combine_qimages(img1, img2):
-    # Ensure the images are the same size
-    if img1.size() != img2.size():
-        print("Images are not the same size!")
-        return img1
-
-    for x in range(img1.width()):
-        for y in range(img1.height()):
-            pixel1 = img1.pixel(x, y)
-            pixel2 = img2.pixel(x, y)
-            # Extract RGB values
-            r1, g1, b1, _ = QColor(pixel1).getRgb()
-            r2, g2, b2, _ = QColor(pixel2).getRgb()
-            # Add the RGB values
-            r = min(r1 + r2, QMKataKeyboard.MAX_RGB_VAL)
-            g = min(g1 + g2, QMKataKeyboard.MAX_RGB_VAL)
-            b = min(b1 + b2, QMKataKeyboard.MAX_RGB_VAL)
-            # Set the new pixel value
-            img1.setPixel(x, y, QColor(r, g, b).rgb())
-
-    return img1
-
-def combine_qimages_painter(img1, img2):
-    # Ensure the images are the same size
-    if img1.size() != img2.size():
-        print("Images are not the same size!")
-        return img1
-
-    # Combine the images
-    painter = QPainter(img1)
-    painter.drawImage(0, 0, img2)  # Adjust coordinates as needed
-    painter.end()
-    return img1
+# add rgb frames (h, w, 3) with saturation, frames with other size are ignored
+# (numpy array methods only, numpy is not imported until a frame is sent)
+def combine_rgb_frames(frame, others):
+    combined = frame.astype('uint16')
+    for other in others:
+        if other.shape == frame.shape:
+            combined += other
+        else:
+            print("Images are not the same size!")
+    return combined.clip(0, QMKataKeyboard.MAX_RGB_VAL).astype('uint8')
 #endregion
 
 def bits_mask(len):
@@ -136,39 +111,47 @@ class QMKataKeybCmd_v0_3(QMKataKeybCmd_v0_2):
 # use always latest, no plan for backward compatibility support for now
 QMKataKeybCmd = QMKataKeybCmd_v0_3
 
-class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
+class QMKataKeyboard(pyfirmata2.Board):
     """
     A keyboard which "talks" qmkata.
+
+    Plain callback signals, no qt needed (headless). The gui uses
+    QMKataKeyboardQt which redefines the signals as qt signals.
     """
     #-------------------------------------------------------------------------------
     # signal received qmk keyboard data
-    signal_console_output = Signal(str)
-    signal_macwin_mode = Signal(str)
-    signal_default_layer = Signal(int)
-    signal_config_model = Signal(object)
-    signal_status_model = Signal(object)
-    #signal_control_model = Signal(object) # todo
-    #signal_event_model = Signal(object) # todo
-    signal_config = Signal(object)
-    signal_status = Signal(object)
+    signal_console_output = CallbackSignal(str)
+    signal_macwin_mode = CallbackSignal(str)
+    signal_default_layer = CallbackSignal(int)
+    signal_config_model = CallbackSignal(object)
+    signal_status_model = CallbackSignal(object)
+    #signal_control_model = CallbackSignal(object) # todo
+    #signal_event_model = CallbackSignal(object) # todo
+    signal_config = CallbackSignal(object)
+    signal_status = CallbackSignal(object)
+    # key press pub event (row, col, time, type, pressed), called on the reader
+    # thread also in the gui (not a qt signal), see WSSubscriptions
+    signal_key_event = CallbackSignal(object)
+    # rgb show replay ended (end of a show without loop, error), not sent on stop
+    signal_rgb_show_done = CallbackSignal()
+
+    # config/status struct "treeview models" need qt, only built by gui
+    STRUCT_MODELS = False
 
     #-------------------------------------------------------------------------------
     MAX_RGB_VAL = 255
-    # format: QImage.Format_RGB888 or QImage.Format_BGR888
+    # pixel: (r, g, b)
     @staticmethod
-    def convert_to_keyb_rgb(pixel, format, index, duration, brightness=(1.0,1.0,1.0)):
+    def convert_to_keyb_rgb(pixel, index, duration, brightness=(1.0,1.0,1.0)):
         if index < 0:
             return None
-        ri = 0; gi = 1; bi = 2
-        if format == QImage.Format_BGR888:
-            ri = 2; bi = 0
         #print(brightness)
         data = bytearray()
         data.append(index)
         data.append(duration)
-        data.append(min(int(pixel[ri]*brightness[ri]), QMKataKeyboard.MAX_RGB_VAL))
-        data.append(min(int(pixel[gi]*brightness[gi]), QMKataKeyboard.MAX_RGB_VAL))
-        data.append(min(int(pixel[bi]*brightness[bi]), QMKataKeyboard.MAX_RGB_VAL))
+        data.append(min(int(pixel[0]*brightness[0]), QMKataKeyboard.MAX_RGB_VAL))
+        data.append(min(int(pixel[1]*brightness[1]), QMKataKeyboard.MAX_RGB_VAL))
+        data.append(min(int(pixel[2]*brightness[2]), QMKataKeyboard.MAX_RGB_VAL))
         return data
 
     @staticmethod
@@ -250,21 +233,40 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             self.e = self.DictOnReadWrite(self.on_eeprom_read, self.on_eeprom_write) # eeprom access
             self.rgb = self.DictOnReadWrite(self.on_rgb_read, self.on_rgb_write) # rgb matrix buffer access
 
-            try:
-                import GccMapfile
-                self.mapfile = GccMapfile.GccMapfile()
-                self.fun = self.mapfile.functions
-                self.var = self.mapfile.variables
-            except Exception as e:
-                self.dbg.tr('D', "mapfile: {}", e)
-                self.mapfile = None
+            # mapfile and toolchain are loaded on first access from a script
+            self._mapfile = None
+            self._toolchain = None
+            self._loaded = set()
 
-            try:
-                import GccToolchain
-                self.toolchain = GccToolchain.GccToolchain(self.keyboard.keyboardModel.TOOLCHAIN)
-            except Exception as e:
-                self.dbg.tr('D', "toolchain: {}", e)
-                self.toolchain = None
+        @property
+        def mapfile(self):
+            if 'mapfile' not in self._loaded:
+                self._loaded.add('mapfile')
+                try:
+                    import GccMapfile
+                    self._mapfile = GccMapfile.GccMapfile()
+                except Exception as e:
+                    self.dbg.tr('D', "mapfile: {}", e)
+            return self._mapfile
+
+        @property
+        def fun(self):
+            return self.mapfile.functions if self.mapfile else None
+
+        @property
+        def var(self):
+            return self.mapfile.variables if self.mapfile else None
+
+        @property
+        def toolchain(self):
+            if 'toolchain' not in self._loaded:
+                self._loaded.add('toolchain')
+                try:
+                    import GccToolchain
+                    self._toolchain = GccToolchain.GccToolchain(self.keyboard.keyboardModel.TOOLCHAIN)
+                except Exception as e:
+                    self.dbg.tr('D', "toolchain: {}", e)
+            return self._toolchain
 
         def on_mem_read(self, key):
             try:
@@ -386,7 +388,6 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             self.dbg.tr('E', "todo")
 
     def __init__(self, *args, **kwargs):
-        QtCore.QObject.__init__(self)
         #----------------------------------------------------
         #region debug tracers
         self.dbg_rgb_buf = 0
@@ -403,8 +404,13 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
         #----------------------------------------------------
         self.samplerThread = None
 
-        self.img = {}   # sender -> rgb QImage
-        self.img_ts_prev = 0 # previous image timestamp
+        self.sysex_lock = threading.Lock()
+        self.rgb_frames = {}   # sender -> rgb frame
+        self.rgb_lock = threading.Lock()
+        self.status_timer = None
+
+        self.rgb_show_recorder = None
+        self.rgb_show_player = None
 
         self.name = None
         self.port = None
@@ -429,6 +435,8 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
 
         self.keyb_poll_time = 1/1000
 
+        # rgb frames from all senders are sent at device refresh rate slots
+        self.rgb_pacer = FramePacer(DefaultKeyboardModel.RGB_MAX_REFRESH, "rgb")
         if self.port == None and self.vid_pid:
             self.keyboardModel = self.keyboardModelVidPid[(self.vid_pid[0], self.vid_pid[1])]
             try:
@@ -439,7 +447,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             self.port = find_com_port(self.vid_pid[0], self.vid_pid[1])
             self.dbg.tr('D', "using keyboard: {} on port {}", self.keyboardModel, self.port)
             self.name = self.keyboardModel.name()
-            self._rgb_max_refresh = self.rgb_max_refresh()
+            self.rgb_pacer.set_fps(self.rgb_max_refresh())
         self.kb_script_env = self.KeybScriptEnv(self)
 
         self.samplerThread = pyfirmata2.util.Iterator(self)
@@ -534,6 +542,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
         self.add_cmd_handler(QMKataKeybCmd.RESPONSE, self.sysex_response_handler)
         self.add_cmd_handler(QMKataKeybCmd.PUB, self.sysex_pub_handler)
 
+        self.handshake_done = threading.Event()
         self.samplingOn()
         self.send_sysex(pyfirmata2.REPORT_FIRMWARE, [])
         self.send_sysex(QMKataKeybCmd.GET, [QMKataKeybCmd.ID_STRUCT_LAYOUT, QMKataKeybCmd.ID_CONFIG])
@@ -542,12 +551,18 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
         self.send_sysex(QMKataKeybCmd.GET, [QMKataKeybCmd.ID_STRUCT_LAYOUT, QMKataKeybCmd.ID_EVENT])
         self.send_sysex(QMKataKeybCmd.GET, [QMKataKeybCmd.ID_MACWIN_MODE])
 
-        time.sleep(0.5)
+        # macwin mode is requested last, struct layouts are received when it arrives
+        if not self.handshake_done.wait(0.5):
+            self.dbg.tr('D', "handshake timeout")
         print("-"*80)
         print(f"{self}")
         print(f"qmkata version:{self.firmware} {self.firmware_version}, firmata={self.get_firmata_version()}")
         print(f"mcu:{self.keyboardModel.MCU} {self.pack_endian}")
         print("-"*80)
+        # get config/status on a thread, start returns after handshake
+        threading.Thread(target=self.get_config_status, name="get_config_status", daemon=True).start()
+
+    def get_config_status(self):
         # signal config structs/values model
         try:
             self.signal_config_model.emit(self.struct_model[QMKataKeybCmd.ID_CONFIG])
@@ -575,6 +590,10 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
 
 
     def stop(self):
+        self.rgb_show_record(None)
+        self.rgb_show_play(None)
+        if self.status_timer:
+            self.status_timer.cancel()
         try:
             self.sp.close()
         except Exception as e:
@@ -599,16 +618,18 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             super().send_sysex(sysex_cmd, encoded_data)
             return
 
-        seqnum = self.sysex_seqnum
-        msg = bytearray([pyfirmata2.START_SYSEX+1, sysex_cmd, seqnum])
-        msg.extend(encoded_data)
-        msg.append(pyfirmata2.END_SYSEX) # todo: remove, not needed when processing directly from rawhid buffer on device, only needed when putting first in "serial buffer" and process it later
-        try:
-            n_written = self.sp.write(msg)
-        except Exception as e:
-            self.dbg.tr('E', "send_sysex: {}", e)
-            return 0
-        self.sysex_seqnum = (self.sysex_seqnum + 1) % 256
+        # sent from gui, script, rgb show, status timer, ... threads
+        with self.sysex_lock:
+            seqnum = self.sysex_seqnum
+            msg = bytearray([pyfirmata2.START_SYSEX+1, sysex_cmd, seqnum])
+            msg.extend(encoded_data)
+            msg.append(pyfirmata2.END_SYSEX) # todo: remove, not needed when processing directly from rawhid buffer on device, only needed when putting first in "serial buffer" and process it later
+            try:
+                n_written = self.sp.write(msg)
+            except Exception as e:
+                self.dbg.tr('E', "send_sysex: {}", e)
+                return 0
+            self.sysex_seqnum = (self.sysex_seqnum + 1) % 256
         return n_written, seqnum
 
     def _sysex_data_to_bytearray(self, data):
@@ -640,6 +661,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             #dbg.tr('KEYPRESS_EVENT', f"key press event: row={row}, col={col}, time={time}, type={type}, pressed={pressed}")
             if self.key_machine:
                 self.key_machine.key_event(row, col, time, pressed)
+            self.signal_key_event.emit((row, col, time, type, pressed))
 
     #-------------------------------------------------------------------------------
     def sysex_response_handler(self, *data):
@@ -680,6 +702,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
                 dbg("macwin mode: {}", macwin_mode)
                 self.signal_macwin_mode.emit(macwin_mode)
                 self.signal_default_layer.emit(self.default_layer(macwin_mode))
+                self.handshake_done.set()
                 return
             if buf[0] == QMKataKeybCmd.ID_STRUCT_LAYOUT:
                 layout_id = buf[1]
@@ -714,11 +737,13 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
                 if layout_id == QMKataKeybCmd.ID_CONFIG:
                     if dbg_print:
                         self.keyboardModel.keyb_config().print_struct(struct_id, struct_fields)
-                    self.struct_model[layout_id] = self.keyboardModel.keyb_config().struct_model(struct_model, struct_id, struct_fields)
+                    if self.STRUCT_MODELS:
+                        self.struct_model[layout_id] = self.keyboardModel.keyb_config().struct_model(struct_model, struct_id, struct_fields)
                 if layout_id == QMKataKeybCmd.ID_STATUS:
                     if dbg_print:
                         self.keyboardModel.keyb_status().print_struct(struct_id, struct_fields)
-                    self.struct_model[layout_id] = self.keyboardModel.keyb_status().struct_model(struct_model, struct_id, struct_fields)
+                    if self.STRUCT_MODELS:
+                        self.struct_model[layout_id] = self.keyboardModel.keyb_status().struct_model(struct_model, struct_id, struct_fields)
 
                 return
             if buf[0] == QMKataKeybCmd.ID_STATUS or buf[0] == QMKataKeybCmd.ID_CONFIG:
@@ -979,54 +1004,45 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
             except:
                 pass
 
-            rgb_pixel = self.convert_to_keyb_rgb(pixel, QImage.Format_RGB888, rgb_index[i], pixel_duration)
+            rgb_pixel = self.convert_to_keyb_rgb(pixel, rgb_index[i], pixel_duration)
             if rgb_pixel:
                 #self.dbg.tr('RGB_BUF', "pixel: {}", rgb_pixel.hex(' '))
                 data.extend(rgb_pixel)
 
         #self.dbg.tr('RGB_BUF', "rgb data: {}", data.hex(' '))
-        self.send_sysex(QMKataKeybCmd.SET, data)
+        self.send_rgb_buf(data)
+
+    # frame: (h, w, 3) uint8 rgb array, None when sender stopped
+    def keyb_set_rgb_frame(self, frame, rgb_multiplier, sender=None):
+        with self.rgb_lock:
+            self._keyb_set_rgb_frame(frame, rgb_multiplier, sender)
 
-    def keyb_set_rgb_image(self, img, rgb_multiplier):
+    def _keyb_set_rgb_frame(self, frame, rgb_multiplier, sender):
         dbg_zone = 'RGB_BUF'
         if self.dbg_rgb_buf:
             self.dbg.tr(dbg_zone, "-"*120)
             self.dbg.tr(dbg_zone, "rgb mult {}", rgb_multiplier)
 
-        #self.dbg.tr('D', "rgb img from sender {} {}", self.sender(), img)
-        if not img:
-            self.dbg.tr('D', "rgb sender {} stopped", self.sender())
-            if self.sender() in self.img:
-                self.img.pop(self.sender())
+        if frame is None:
+            self.dbg.tr('D', "rgb sender {} stopped", sender)
+            self.rgb_frames.pop(sender, None)
             return
 
-        # multiple images senders -> combine images
-        combined_img = img
-        #prev_img = self.img[self.sender()]
-        if len(self.img) > 1:
-            combined_img = img.copy()
-            for key in self.img:
-                if key != self.sender():
-                    #self.dbg.tr('D', "combine image from {}", key)
-                    combined_img = combine_qimages(combined_img, self.img[key])
-
-        #if not self.sender() in self.img:
-            #self.dbg.tr('D', "new sender {} {}", self.sender(), img)
-        self.img[self.sender()] = img
-        img = combined_img
+        # multiple frame senders -> combine frames
+        arr = frame
+        others = [f for key, f in self.rgb_frames.items() if key != sender]
+        if others:
+            arr = combine_rgb_frames(frame, others)
+        self.rgb_frames[sender] = frame
+
         # max refresh
-        if time.monotonic() - self.img_ts_prev < 1/self._rgb_max_refresh:
+        if not self.rgb_pacer.ready():
             if self.dbg_rgb_buf: self.dbg.tr(dbg_zone, "skip")
             return
-        self.img_ts_prev = time.monotonic()
 
         #-------------------------------------------------------------------------------
-        # iterate through the qimage pixels and convert to "keyboard rgb pixels" and send to keyboard
-        height = img.height()
-        width = img.width()
-        arr = np.ndarray((height, width, 3), buffer=img.constBits(), strides=[img.bytesPerLine(), 3, 1], dtype=np.uint8)
-
-        img_format = img.format()
+        # iterate through the frame pixels and convert to "keyboard rgb pixels" and send to keyboard
+        height, width, _ = arr.shape
         RGB_PIXEL_SIZE = 5
         num_sends = 0
         data = bytearray()
@@ -1034,7 +1050,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
         for y in range(height):
             for x in range(width):
                 pixel = arr[y, x]
-                rgb_pixel = self.convert_to_keyb_rgb(pixel, img_format, self.xy_to_rgb_index(x, y), 50, rgb_multiplier)
+                rgb_pixel = self.convert_to_keyb_rgb(pixel, self.xy_to_rgb_index(x, y), 50, rgb_multiplier)
                 if rgb_pixel:
                     data.extend(rgb_pixel)
 
@@ -1043,7 +1059,7 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
                     self.dbg.tr(dbg_zone, rgb_pixel.hex(' '))
 
                 if len(data) + RGB_PIXEL_SIZE > self.MAX_LEN_SYSEX_DATA:
-                    self.send_sysex(QMKataKeybCmd.SET, data)
+                    self.send_rgb_buf(data)
                     num_sends += 1
                     # todo sync with keyboard to avoid buffer overflow
                     # depends on keyboard, put parameter in "keyboard model" class
@@ -1058,9 +1074,51 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
                     data.append(QMKataKeybCmd.ID_RGB_MATRIX_BUF)
 
         if len(data) > RGB_PIXEL_SIZE:
-            self.send_sysex(QMKataKeybCmd.SET, data)
+            self.send_rgb_buf(data)
             num_sends += 1
 
+    # send encoded rgb matrix buffer packet, record it if rgb show recording
+    def send_rgb_buf(self, data):
+        if self.rgb_show_recorder:
+            self.rgb_show_recorder.record(QMKataKeybCmd.SET, data)
+        return self.send_sysex(QMKataKeybCmd.SET, data)
+
+    #-------------------------------------------------------------------------------
+    # record/replay rgb show, filename None to stop
+    def rgb_show_record(self, filename):
+        from RGBShow import RGBShowRecorder
+        if self.rgb_show_recorder:
+            self.rgb_show_recorder.close()
+            self.rgb_show_recorder = None
+        if not filename:
+            return
+        try:
+            self.rgb_show_recorder = RGBShowRecorder(filename, self.vid_pid or (0,0))
+        except Exception as e:
+            self.dbg.tr('E', "rgb_show_record: {}", e)
+
+    def rgb_show_play(self, filename, loop=True):
+        from RGBShow import RGBShowPlayer
+        player, self.rgb_show_player = self.rgb_show_player, None
+        if player:
+            player.stop()
+            player.join()
+        if not filename:
+            return
+        try:
+            self.rgb_show_player = RGBShowPlayer(filename, self.send_sysex, self.vid_pid, loop, self.on_rgb_show_done)
+            self.rgb_show_player.start()
+        except Exception as e:
+            self.rgb_show_player = None
+            self.dbg.tr('E', "rgb_show_play: {}", e)
+            self.signal_rgb_show_done.emit()
+
+    # player thread, a stopped player isn't the current one anymore
+    def on_rgb_show_done(self, player):
+        if self.rgb_show_player is player:
+            self.rgb_show_player = None
+            self.signal_rgb_show_done.emit()
+
     def keyb_set_default_layer(self, layer):
         self.dbg.tr('SYSEX_COMMAND', "keyb_set_default_layer: {}", layer)
         data = bytearray()
@@ -1091,9 +1149,17 @@ class QMKataKeyboard(pyfirmata2.Board, QtCore.QObject):
         else:
             self.get_status_every_ms = repeat_every_ms
 
+        if self.status_timer and not from_timer:
+            self.status_timer.cancel()
         if repeat_every_ms > 0:
-            QtCore.QTimer.singleShot(repeat_every_ms, lambda: self.keyb_get_status(repeat_every_ms, status_id, True))
+            self.status_timer = threading.Timer(repeat_every_ms/1000, lambda: self.keyb_get_status(repeat_every_ms, status_id, True))
+            self.status_timer.daemon = True
+            self.status_timer.start()
+
+        self.keyb_request_status(status_id)
 
+    # one status request (0: all), doesn't touch the status timer (remote clients poll on their own)
+    def keyb_request_status(self, status_id):
         if status_id > 0:
             self.send_sysex(QMKataKeybCmd.GET, [QMKataKeybCmd.ID_STATUS, status_id])
         else:
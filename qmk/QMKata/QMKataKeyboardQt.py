@@ -0,0 +1,44 @@
+from PySide6 import QtCore
+from PySide6.QtCore import Signal
+from PySide6.QtGui import QImage
+
+from QMKataKeyboard import QMKataKeyboard
+
+#-------------------------------------------------------------------------------
+# QMKataKeyboard for the gui: qt signals (queued to gui thread), QImage slots
+#
+class QMKataKeyboardQt(QMKataKeyboard, QtCore.QObject):
+    signal_console_output = Signal(str)
+    signal_macwin_mode = Signal(str)
+    signal_default_layer = Signal(int)
+    signal_config_model = Signal(object)
+    signal_status_model = Signal(object)
+    signal_config = Signal(object)
+    signal_status = Signal(object)
+    signal_rgb_show_done = Signal()
+
+    STRUCT_MODELS = True
+
+    def __init__(self, *args, **kwargs):
+        QtCore.QObject.__init__(self)
+        QMKataKeyboard.__init__(self, *args, **kwargs)
+
+    # rgb QImage (Format_RGB888 or Format_BGR888), None when sender stopped
+    def keyb_set_rgb_image(self, img, rgb_multiplier):
+        import numpy as np
+        sender = self.sender()
+        if not img:
+            self.keyb_set_rgb_frame(None, rgb_multiplier, sender)
+            return
+
+        if img.format() != QImage.Format_RGB888:
+            img = img.convertToFormat(QImage.Format_RGB888)
+        height = img.height()
+        width = img.width()
+        arr = np.ndarray((height, width, 3), buffer=img.constBits(), strides=[img.bytesPerLine(), 3, 1], dtype=np.uint8)
+        # copy, frame is kept for combining with frames from other senders
+        self.keyb_set_rgb_frame(arr.copy(), rgb_multiplier, sender)
+
+    # rgb (h, w, 3) uint8 array, None when sender stopped
+    def keyb_set_rgb_array(self, frame, rgb_multiplier):
+        self.keyb_set_rgb_frame(frame, rgb_multiplier, self.sender())
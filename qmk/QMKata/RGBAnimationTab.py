@@ -1,60 +1,43 @@
-import numpy as np, random
-from matplotlib.figure import Figure
+import numpy as np, random, math, time
 from matplotlib.patches import Rectangle
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QTextEdit
-from PySide6.QtGui import QFont, QImage, QKeyEvent
-from PySide6.QtCore import Qt, QTimer, Signal
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QComboBox, QCheckBox, QLabel
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtCore import QTimer, Signal
 
+from CodeTextEdit import CodeTextEdit
+from CodeCache import CodeCache
+from LEDAnimation import NumpyAnimation, ShaderAnimation, AggAnimation, LoopBuffer, AnimationThread, hue_to_rgb, hsv_to_rgb
+from ThrottledChannel import ThrottledChannel
 from DebugTracer import DebugTracer
 
-def add_method_to_class(class_def, method):
+code_cache = CodeCache()
+
+def add_method_to_class(class_def, method, filename="<animation>"):
     method_definition = method
-    # Execute the method definition and retrieve the method from the local scope
-    local_scope = {}
-    exec(method_definition, globals(), local_scope)
+    # Execute the (cached) compiled method definition and retrieve the methods from the local scope
+    local_scope = code_cache.exec(method_definition, globals(), filename)
     for method in list(local_scope.values()):
+        if not callable(method):
+            continue
         #print(f"{method.__name__} added to class {class_def.__name__}")
         # Add the method to the class
         setattr(class_def, method.__name__, method)
-
-#-------------------------------------------------------------------------------
-class CodeTextEdit(QTextEdit):
-    def __init__(self, filepath=None, parent=None):
-        super().__init__(parent)
-        self.setFont(QFont("Courier New", 9))
-        if filepath:
-            self.load_text_file(filepath)
-
-    def insertFromMimeData(self, source):
-        if source.hasText():
-            # only plain text
-            plain_text = source.text()
-            self.insertPlainText(plain_text)
-        else:
-            super().insertFromMimeData(source)
-
-    def load_text_file(self, filepath):
-        try:
-            with open(filepath, "r", encoding="utf-8") as file:
-                content = file.read()
-                self.setPlainText(content)
-        except Exception as e:
-            print(f"Error opening {filepath}: {e}")
-
-    def keyPressEvent(self, event: QKeyEvent):
-        if event.key() == Qt.Key_Tab:
-            # four spaces instead of a tab
-            self.insertPlainText("    ")
-        else:
-            super().keyPressEvent(event)
+    return local_scope
 
 #-------------------------------------------------------------------------------
 class RGBAnimationTab(QWidget):
     signal_rgb_image = Signal(QImage, object)
+    signal_rgb_frame = Signal(object, object)
+
+    # "matplotlib" (default): figure animation (animation.py) rendered off-screen at led
+    # resolution * supersample, "numpy": led resolution numpy frames (led_animation.py),
+    # "shader": per led shader on precomputed led geometry (led_shader.py)
+    ENGINES = { "matplotlib": "animation.py", "numpy": "led_animation.py", "shader": "led_shader.py" }
+    SUPERSAMPLE = [1, 2, 4, 8]
+    PREVIEW_SCALE = 20
+    HOT_RELOAD_DELAY = 500 # ms after the last edit
 
     def __init__(self, rgb_matrix_size):
         self.dbg = DebugTracer(zones={'D': 0}, obj=self)
@@ -63,49 +46,64 @@ class RGBAnimationTab(QWidget):
         self.init_gui()
 
     def init_gui(self):
-        DPI = 100
-        width = 800
-        height = int((self.rgb_matrix_size[1]/self.rgb_matrix_size[0]) * width)
-        w_inch = width/DPI
-        h_inch = height/DPI
-
-        # matplotlib figure for plotting
-        self.figure = Figure(facecolor='black')
-        self.figure.set_size_inches((w_inch, h_inch))
-        self.figure.set_dpi(DPI)
-        self.figure.subplots_adjust(left=0, right=1, top=1, bottom=0)
-
-        self.ax = self.figure.add_subplot(111) # 1 1x1 subplot
-        self.ax.set_facecolor('black')
-        plt.axes().set_aspect('equal', 'datalim')
-        # todo: aspect ratio
-
-        if self.dbg.enabled('D'):
-            _w, _h = self.figure.get_size_inches() * self.figure.get_dpi()
-            self.dbg.tr('D', f"figure size:{_w}x{_h} dpi:{self.figure.get_dpi()}")
-
+        #-------------------------------------------------------
+        # engine selection, preview
+        self.engine_selector = QComboBox()
+        self.engine_selector.addItems(list(self.ENGINES))
+        self.engine_selector.currentTextChanged.connect(self.update_engine)
+        self.supersample_selector = QComboBox()
+        self.supersample_selector.addItems([ f"x{n}" for n in self.SUPERSAMPLE ])
+        self.supersample_selector.setCurrentIndex(self.SUPERSAMPLE.index(4))
+        self.supersample_selector.setToolTip("matplotlib supersampling")
+        self.preview_enabled = True
+        self.preview_checkbox = QCheckBox("preview")
+        self.preview_checkbox.setChecked(self.preview_enabled)
+        self.preview_checkbox.stateChanged.connect(lambda state: setattr(self, 'preview_enabled', bool(state)))
+        self.hot_reload_checkbox = QCheckBox("hot reload")
+        self.hot_reload_checkbox.setChecked(True)
+        self.hot_reload_checkbox.setToolTip("apply edits to the running animation, state is kept")
+        self.loop_buffer_checkbox = QCheckBox("loop buffer")
+        self.loop_buffer_checkbox.setChecked(True)
+        self.loop_buffer_checkbox.setToolTip("render animations listed in loop_frames() once, then play them from a buffer")
+        hlayout = QHBoxLayout()
+        hlayout.addWidget(self.engine_selector)
+        hlayout.addWidget(self.supersample_selector)
+        hlayout.addWidget(self.preview_checkbox)
+        hlayout.addWidget(self.hot_reload_checkbox)
+        hlayout.addWidget(self.loop_buffer_checkbox)
+        hlayout.addStretch(1)
+        self.preview_label = QLabel()
+        self.preview_channel = ThrottledChannel(30, self)
+        self.preview_channel.signal_value.connect(self.on_preview_frame)
         #-------------------------------------------------------
         # text editor
-        self.code_editor = CodeTextEdit("animation.py")
+        self.code_editor = CodeTextEdit(self.ENGINES[self.engine_selector.currentText()])
+        self.code_editor.textChanged.connect(self.on_code_changed)
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.timeout.connect(self.hot_reload)
         # start animation button
         self.start_button = QPushButton("start")
         self.start_button.clicked.connect(self.start_animation)
-        # canvas
-        self.canvas = FigureCanvas(self.figure)
         #-------------------------------------------------------
         # add widgets to layout
         layout = QVBoxLayout()
+        layout.addLayout(hlayout)
         layout.addWidget(self.code_editor)
-        layout.addWidget(self.canvas)
+        layout.addWidget(self.preview_label)
         layout.addWidget(self.start_button)
         self.setLayout(layout)
+        self.supersample_selector.setVisible(self.engine() == "matplotlib")
 
-        # func animation parameters
+        # animation parameters
         self.n_frames = 1000
         self.interval = 40
-        self.ani = None
+        self.animation_thread = None
+        self.animation_names = None # (init, animate) of the running animation
+        self.loop_frames = 0 # frames per loop of a deterministic animation, 0: not deterministic
 
         self._audio_peak_levels = None
+        self._audio_onset = None
 
     def on_keypress(self, keypress_event):
         print("on_keypress: {} todo", keypress_event)
@@ -116,59 +114,114 @@ class RGBAnimationTab(QWidget):
     def audio_peak_levels(self):
         return self._audio_peak_levels
 
+    # last onset/beat event (time, kind, strength, bpm) of the audio tab
+    def on_audio_onset(self, event):
+        self._audio_onset = event
+
+    def audio_onset(self):
+        return self._audio_onset
+
+    def engine(self):
+        return self.engine_selector.currentText()
+
+    def update_engine(self, engine):
+        if self.animation_thread:
+            self.start_animation() # stop
+        self.code_editor.load_text_file(self.ENGINES[engine])
+        self.supersample_selector.setVisible(engine == "matplotlib")
+
+    # deterministic animations are listed in loop_frames() of the code: { animate method: frames per loop }
+    def animation_functions(self):
+        local_scope = add_method_to_class(RGBAnimationTab, self.code_editor.toPlainText(), self.ENGINES[self.engine()])
+        init_fn_name, animate_fn_name = self.animate_methods()
+        self.animation_names = (init_fn_name, animate_fn_name)
+        loop_frames_fn = local_scope.get("loop_frames")
+        self.loop_frames = loop_frames_fn(self).get(animate_fn_name, 0) if loop_frames_fn else 0
+        return getattr(RGBAnimationTab, init_fn_name), getattr(RGBAnimationTab, animate_fn_name)
+
+    #-------------------------------------------------------------------------------
+    # hot reload: edited code is compiled (cached by source hash) and the
+    # animate function swapped in the running renderer, state is kept. compile
+    # or exec errors leave the running animation untouched, another init/animate
+    # pair restarts the animation.
+    def on_code_changed(self):
+        if self.animation_thread and self.hot_reload_checkbox.isChecked():
+            self.reload_timer.start(self.HOT_RELOAD_DELAY)
+
+    def hot_reload(self):
+        if not self.animation_thread:
+            return
+        running_names, running_loop_frames = self.animation_names, self.loop_frames
+        try:
+            init_fn, animate_fn = self.animation_functions()
+        except Exception as e:
+            print(f"hot reload: {e}")
+            self.animation_names, self.loop_frames = running_names, running_loop_frames
+            return
+        if self.animation_names != running_names or self.loop_frames != running_loop_frames:
+            self.dbg.tr('D', "hot reload: {} restart", self.animation_names)
+            self.start_animation() # stop
+            self.start_animation()
+            return
+        self.animation_thread.renderer.swap(animate_fn)
+        self.dbg.tr('D', "hot reload: {} swapped, {} compiled", animate_fn.__name__, code_cache.num_compiled)
+
+    def create_renderer(self):
+        init_fn, animate_fn = self.animation_functions()
+        if self.engine() == "numpy":
+            renderer = NumpyAnimation(self, self.rgb_matrix_size, init_fn, animate_fn)
+        elif self.engine() == "shader":
+            renderer = ShaderAnimation(self, self.rgb_matrix_size, init_fn, animate_fn)
+        else:
+            # sets self.figure, self.ax used by animation.py
+            supersample = self.SUPERSAMPLE[self.supersample_selector.currentIndex()]
+            renderer = AggAnimation(self, self.rgb_matrix_size, init_fn, animate_fn, supersample)
+            self.dbg.tr('D', "figure size: {} dpi: {}", renderer.canvas.get_width_height(), self.figure.get_dpi())
+        if self.loop_frames and self.loop_buffer_checkbox.isChecked():
+            self.dbg.tr('D', "loop buffer: {} frames", self.loop_frames)
+            renderer = LoopBuffer(renderer, self.loop_frames, 1000 / self.interval, self.rgb_matrix_size)
+        return renderer
+
+    # frame index wraps at the loop length of buffered animations
+    def animation_n_frames(self, renderer):
+        if isinstance(renderer, LoopBuffer):
+            return len(renderer.frames)
+        return self.n_frames
+
+    #-------------------------------------------------------------------------------
+    # frames rendered on the animation thread, preview throttled to the gui
     def start_animation(self):
-        if self.ani is None:  # Prevent multiple instances if already running
-            add_method_to_class(RGBAnimationTab, self.code_editor.toPlainText())
+        if self.animation_thread is None:
             try:
-                init_fn_name, animate_fn_name = self.animate_methods()
-                animate_init_method = getattr(RGBAnimationTab, init_fn_name)
-                animate_method = getattr(RGBAnimationTab, animate_fn_name)
-                setattr(RGBAnimationTab, "_animate_init", animate_init_method)
-                setattr(RGBAnimationTab, "_animate", animate_method)
-                self._animate_init()
-                self.ani = animation.FuncAnimation(self.figure, self.animate, frames=self.n_frames, #init_func=self.init,
-                                                blit=True, interval=self.interval, repeat=True)
+                renderer = self.create_renderer()
             except Exception as e:
                 print(e)
-
-            if self.ani:
-                self.start_button.setText("stop")
+                return
+            self.animation_thread = AnimationThread(renderer, 1000 / self.interval, self.on_animation_frame,
+                                                    self.animation_n_frames(renderer))
+            self.animation_thread.start()
+            self.start_button.setText("stop")
         else:
-            self.ani.event_source.stop()
-            self.ani = None
-            self.signal_rgb_image.emit(None, (0,0,0))
+            self.animation_thread.stop()
+            self.animation_thread.join()
+            self.animation_thread = None
             self.start_button.setText("start")
 
-    def capture_animation_frame(self):
-        if self.ani == None:
-            return
+    # animation thread, no qt widgets here
+    def on_animation_frame(self, frame):
+        self.signal_rgb_frame.emit(frame, (1.0,1.0,1.0))
+        if frame is not None and self.preview_enabled:
+            self.preview_channel.post(frame)
 
-        self.ani.pause()
-        try:
-            # capture the current frame from the canvas
-            rgba_buffer = np.frombuffer(self.figure.canvas.buffer_rgba(), dtype=np.uint8)
-            width, height = self.figure.get_size_inches() * self.figure.get_dpi()
-            #if rgba_buffer.nbytes != width * height * 4:
-                #self.dbg.tr('D', f"buffer size mismatch: {rgba_buffer.nbytes} != {width}x{height}x4")
-            rgba_array = rgba_buffer.reshape(int(height), int(width), 4, order='C')
-            rgba_qimg = QImage(rgba_array.data, width, height, QImage.Format_RGBA8888)
-            keyb_rgb = rgba_qimg.scaled(self.rgb_matrix_size[0], self.rgb_matrix_size[1], Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.FastTransformation)
-            keyb_rgb = keyb_rgb.convertToFormat(QImage.Format_RGB888)
-            self.signal_rgb_image.emit(keyb_rgb, (1.0,1.0,1.0))
-        except Exception as e:
-            self.dbg.tr('E', f"capture_animation_frame: {e}")
-
-        self.ani.resume()
-
-    def animate(self, i):
-        ret = self._animate(i)
-        if i == self.n_frames:
-            self.figure.clear()
-
-        QTimer.singleShot(0, self.capture_animation_frame)
-        return ret
+    def on_preview_frame(self, frame):
+        if not self.animation_thread:
+            return
+        h, w, _ = frame.shape
+        img = QImage(frame.tobytes(), w, h, w * 3, QImage.Format_RGB888)
+        self.preview_label.setPixmap(QPixmap.fromImage(img.scaled(w * self.PREVIEW_SCALE, h * self.PREVIEW_SCALE)))
 
     def closeEvent(self, event):
-        if self.ani:
-            self.ani.event_source.stop()
-            self.ani = None
+        if self.animation_thread:
+            self.animation_thread.stop()
+            self.animation_thread.join()
+            self.animation_thread = None
@@ -1,117 +1,22 @@
 import numpy as np
-import time, json
 
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QLineEdit, QFrame, QFileDialog
-from PySide6.QtCore import Signal, QThread, QTimer
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QLineEdit, QFrame, QFileDialog, QComboBox, QCheckBox
+from PySide6.QtCore import Signal
 from PySide6.QtGui import QImage, QColor, QIntValidator, QDoubleValidator
 
+from AudioCapture import AudioCaptureThread, AudioPeakRGB
+from ThrottledChannel import ThrottledChannel
+from SpectrumRenderer import SpectrumRenderer, BeatFlash
 from DebugTracer import DebugTracer
-try:
-    import pyaudiowpatch as pyaudio
-except:
-    print("pyaudiowpatch not installed")
-
-#-------------------------------------------------------------------------------
-class AudioCaptureThread(QThread):
-
-    def __init__(self, freq_bands, interval):
-        self.dbg = DebugTracer(zones={'D':0}, obj=self)
-
-        super().__init__()
-        self.running = False
-        self.freq_bands = freq_bands
-        self.interval = interval
-        self.paudio = pyaudio.PyAudio()
-
-    def connect_callback(self, callback):
-        self.callback = callback
-
-    def set_freq_bands(self, freq_bands):
-        self.freq_bands = freq_bands
-
-    def run(self):
-        self.paudio = pyaudio.PyAudio()
-        default_speakers = None
-        try:
-            # see https://github.com/s0d3s/PyAudioWPatch/blob/master/examples/pawp_record_wasapi_loopback.py
-            wasapi_info = self.paudio.get_host_api_info_by_type(pyaudio.paWASAPI)
-            self.dbg.tr('D', "wasapi: {}", wasapi_info)
-            default_speakers = self.paudio.get_device_info_by_index(wasapi_info["defaultOutputDevice"])
-            if not default_speakers["isLoopbackDevice"]:
-                for loopback in self.paudio.get_loopback_device_info_generator():
-                    if default_speakers["name"] in loopback["name"]:
-                        default_speakers = loopback
-                        break
-
-            self.dbg.tr('D', "loopback device: {}", default_speakers)
-        except Exception as e:
-            self.dbg.tr('D', "wasapi not supported: {}", e)
-            return
-
-        #-------------------------------------------------------------------------------
-        FORMAT = pyaudio.paFloat32
-        CHANNELS = default_speakers["maxInputChannels"]
-        RATE = int(default_speakers["defaultSampleRate"])
-        INPUT_INDEX = default_speakers["index"]
-        CHUNK = int(RATE * self.interval)
-
-        self.stream = self.paudio.open(format=FORMAT,
-                        channels=CHANNELS,
-                        rate=RATE,
-                        input=True,
-                        frames_per_buffer=CHUNK,
-                        input_device_index=INPUT_INDEX)
-        self.dbg.tr('D', "audio stream opened: rate={RATE}, chunk size={CHUNK}, channels={CHANNELS}, input device={INPUT_INDEX}", RATE=RATE, CHUNK=CHUNK, CHANNELS=CHANNELS, INPUT_INDEX=INPUT_INDEX)
-
-        self.running = True
-        while self.running:
-            frames = None
-            try:
-                data = self.stream.read(CHUNK)
-                frames = np.frombuffer(data, dtype=np.float32)
-                if CHANNELS > 1:
-                    frames = frames.reshape(-1, CHANNELS)
-                    frames = np.mean(frames, axis=1)
-            except Exception as e:
-                self.dbg.tr('E', "audio stream read error: {}", e)
-                self.running = False
-                break
-
-            audio_data = np.hstack(frames)
-            freq_data = np.fft.rfft(audio_data)
-            freq_magnitude = np.abs(freq_data)
-
-            # Calculate frequency bins
-            freq_bins = np.fft.rfftfreq(len(audio_data), d=1./RATE)
-            #print(f"freq bins: {len(freq_bins)}, {len(audio_data)}")
-            peak_levels = []
-            for f_min, f_max in self.freq_bands:
-                # Find the bin indices corresponding to the frequency range
-                idx = np.where((freq_bins >= f_min) & (freq_bins <= f_max))
-                peak_level = 0
-                if len(freq_magnitude[idx]) > 0:
-                    peak_level = np.max(freq_magnitude[idx])
-                peak_levels.append(peak_level)
-
-            self.callback(peak_levels)
-
-        self.stream.stop_stream()
-        self.stream.close()
-        self.dbg.tr('D', "audio stream closed")
-        self.paudio.terminate()
-        self.callback(None)
-
-    def stop(self):
-        try:
-            self.stream.stop_stream()
-        except Exception as e:
-            pass
-        self.running = False
 
 #-------------------------------------------------------------------------------
 class RGBAudioTab(QWidget):
     signal_rgb_image = Signal(QImage, object)
+    signal_rgb_frame = Signal(object, object)
     signal_peak_levels = Signal(object)
+    signal_onset = Signal(object) # (time, kind, strength, bpm), emitted on the audio worker thread
+
+    MODES = ["color", "spectrum"] # all leds one color mixed from the bands, spectrum analyzer
 
     @staticmethod
     def freq_bands_linear(f_min, f_max, k):
@@ -139,30 +44,32 @@ class RGBAudioTab(QWidget):
 
     def __init__(self, rgb_matrix_size):
         #-----------------------------------------------------------
-        self.dbg = DebugTracer(zones={'D':0, "FREQ_BAND":0, "PEAK_LEVEL":0, "MAX_PEAK":0}, obj=self)
+        self.dbg = DebugTracer(zones={'D':0, "FREQ_BAND":0}, obj=self)
         #-----------------------------------------------------------
-        self.freq_bands = []
+        self.audio_rgb = AudioPeakRGB()
+        self.running = False
         super().__init__()
         self.init_gui()
 
         #-----------------------------------------------------------
         self.rgb_matrix_size = rgb_matrix_size
         self.keyb_rgb = QImage(self.rgb_matrix_size[0], self.rgb_matrix_size[1], QImage.Format_RGB888)
-        self.keyb_rgb_mask = QImage(self.keyb_rgb.size(), QImage.Format_Grayscale8)
-        self.keyb_rgb_mask_mode = 0
         self.rgb_multiplier = (1.0,1.0,1.0)
+        self.spectrum = None # renderer when in spectrum mode
+        self.beat_flash = BeatFlash()
 
-        self.sample_count = 0
-        try:
-            self.audio_thread = AudioCaptureThread(self.freq_bands, 0.04)
-        except:
-            self.audio_thread = None
+        self.audio_thread = None
+        # audio worker thread results to gui thread, latest wins
+        self.max_level_running = None
+        self.audio_channel = ThrottledChannel(60, self)
+        self.audio_channel.signal_value.connect(self.on_audio_result)
 
     def load_freqbands_jsonfile(self):
         filename, _ = QFileDialog.getOpenFileName(self, "open file", "", "json (*.json)")
-        self.load_freq_bands_colors(filename)
+        self.audio_rgb.load_freq_bands_colors(filename)
         # update freq bands rgb ui
-        for i, (band, color) in enumerate(zip(self.freq_bands, self.freq_rgb)):
+        min_max_level = self.audio_rgb.min_max_level
+        for i, (band, color) in enumerate(zip(self.audio_rgb.freq_bands, self.audio_rgb.freq_rgb)):
             self.dbg.tr('FREQ_BAND', "settext:[{i}]{band} {color}", i=i, band=band, color=color)
             self.freqbands_input[i][0].blockSignals(True)
             self.freqbands_input[i][1].blockSignals(True)
@@ -178,10 +85,12 @@ class RGBAudioTab(QWidget):
 
             self.minmax_level_input[i][0].blockSignals(True)
             self.minmax_level_input[i][1].blockSignals(True)
-            self.minmax_level_input[i][0].setText(str(self.min_max_level[i][0]))
-            self.minmax_level_input[i][1].setText(str(self.min_max_level[i][1]))
+            self.minmax_level_input[i][0].setText(str(min_max_level[i][0]))
+            self.minmax_level_input[i][1].setText(str(min_max_level[i][1]))
             self.minmax_level_input[i][0].blockSignals(False)
             self.minmax_level_input[i][1].blockSignals(False)
+        if self.spectrum:
+            self.update_mode()
 
     def init_gui(self):
         layout = QVBoxLayout()
@@ -202,20 +111,26 @@ class RGBAudioTab(QWidget):
         hlayout.addWidget(label)
         hlayout.addWidget(self.peak_level)
 
+        self.mode_selector = QComboBox()
+        self.mode_selector.addItems(self.MODES)
+        self.mode_selector.currentTextChanged.connect(self.update_mode)
+        hlayout.addWidget(self.mode_selector)
+
+        self.beat_flash_enabled = False
+        self.beat_flash_checkbox = QCheckBox("beat flash")
+        self.beat_flash_checkbox.stateChanged.connect(lambda state: setattr(self, 'beat_flash_enabled', bool(state)))
+        hlayout.addWidget(self.beat_flash_checkbox)
+
         layout.addLayout(hlayout)
         #-----------------------------------------------------------
         # load freq bands colors and add widgets
-        self.load_freq_bands_colors()
+        self.audio_rgb.load_freq_bands_colors()
         self.freqbands_input = []
         self.freqbands_rgb_input = []
         self.minmax_level_input = []
-        self.db_min = []
-        self.max_level = [] # max level used for rgb intensity
-        self.max_level_running = []  # max level updated every sample
-        for i, (band, color) in enumerate(zip(self.freq_bands, self.freq_rgb)):
+        min_max_level = self.audio_rgb.min_max_level
+        for i, (band, color) in enumerate(zip(self.audio_rgb.freq_bands, self.audio_rgb.freq_rgb)):
             self.dbg.tr('FREQ_BAND', "band, color:{band}, {color}", band=band, color=color)
-            self.max_level.append(15)
-            self.max_level_running.append(0)
             low = QLineEdit()
             high = QLineEdit()
             low.setFixedWidth(60)
@@ -248,17 +163,16 @@ class RGBAudioTab(QWidget):
             min_level = QLineEdit()
             min_level.setValidator(QIntValidator(0,1000))
             min_level.setFixedWidth(50)
-            min_level.setText(str(self.min_max_level[i][0]))
+            min_level.setText(str(min_max_level[i][0]))
             min_level.textChanged.connect(self.update_min_max_level)
             max_level = QLineEdit()
             max_level.setValidator(QIntValidator(0,1000))
             max_level.setFixedWidth(50)
-            max_level.setText(str(self.min_max_level[i][1]))
+            max_level.setText(str(min_max_level[i][1]))
             max_level.textChanged.connect(self.update_min_max_level)
             hlayout.addWidget(min_level)
             hlayout.addWidget(max_level)
             self.minmax_level_input.append((min_level, max_level))
-            self.db_min.append(-27)
 
             hlayout.addStretch(1)
             layout.addLayout(hlayout)
@@ -270,214 +184,110 @@ class RGBAudioTab(QWidget):
         layout.addWidget(self.start_button)
         self.setLayout(layout)
 
-    def load_freq_bands_colors(self, file_name='freq_bands_colors.json'):
-        try:
-            with open(file_name, 'r') as file:
-                freq_bands_colors = json.load(file)
-                self.freq_bands = freq_bands_colors['freq_bands']
-                self.freq_rgb = freq_bands_colors['colors']
-                self.min_max_level = freq_bands_colors['min_max_level']
-                if len(self.freq_bands) > 31:
-                    raise Exception("too many freq bands")
-                if len(self.freq_bands) != len(self.freq_rgb):
-                    raise Exception("freq_bands and colors have different lengths")
-                self.dbg.tr('FREQ_BAND', "freq_bands:{}", self.freq_bands)
-                self.dbg.tr('FREQ_BAND', "freq_rgb:{}", self.freq_rgb)
-                self.dbg.tr('FREQ_BAND', "min_max_level:{}", self.min_max_level)
-                if self.min_max_level is None or len(self.min_max_level) != len(self.freq_bands):
-                    self.min_max_level = [(0,0) for _ in range(len(self.freq_bands))]
-        except Exception as e:
-            self.dbg.tr('D', "error loading file: {}", e)
-            self.freq_bands = []
-            self.freq_rgb = []
-            self.min_max_level = []
-
-    def save_freq_bands_colors(self):
-        freq_bands_colors = {
-            'freq_bands': self.freq_bands,
-            'colors': self.freq_rgb,
-            'min_max_level':self.min_max_level
-        }
-        with open('freq_bands_colors.json', 'w') as file:
-            json.dump(freq_bands_colors, file, indent=4)
+    def update_mode(self, mode=None):
+        if self.mode_selector.currentText() == "spectrum":
+            self.spectrum = SpectrumRenderer(self.rgb_matrix_size, self.audio_rgb.freq_rgb)
+        else:
+            self.spectrum = None
 
     def update_freq_rgb(self):
-        n_ranges = len(self.freq_bands)
-        self.freq_rgb = []
+        n_ranges = len(self.audio_rgb.freq_bands)
+        freq_rgb = []
         for i in range(n_ranges):
-            self.freq_rgb.append([float(self.freqbands_rgb_input[i][0].text()), float(self.freqbands_rgb_input[i][1].text()), float(self.freqbands_rgb_input[i][2].text())])
+            freq_rgb.append([float(self.freqbands_rgb_input[i][0].text()), float(self.freqbands_rgb_input[i][1].text()), float(self.freqbands_rgb_input[i][2].text())])
+        self.audio_rgb.freq_rgb = freq_rgb
+        if self.spectrum:
+            self.update_mode() # new renderer, the worker may be rendering with the old one
 
-        self.dbg.tr('FREQ_BAND', "freq band colors {}", self.freq_rgb)
+        self.dbg.tr('FREQ_BAND', "freq band colors {}", freq_rgb)
 
     def update_freq_bands(self):
-        n_ranges = len(self.freq_bands)
-        for i in range(n_ranges):
-            self.freq_bands[i] = (float(self.freqbands_input[i][0].text()), float(self.freqbands_input[i][1].text()))
+        freq_bands = self.audio_rgb.freq_bands
+        for i in range(len(freq_bands)):
+            freq_bands[i] = (float(self.freqbands_input[i][0].text()), float(self.freqbands_input[i][1].text()))
 
-        self.dbg.tr('FREQ_BAND', "freq bands {}", self.freq_bands)
+        self.dbg.tr('FREQ_BAND', "freq bands {}", freq_bands)
         if self.audio_thread:
-            self.audio_thread.set_freq_bands(self.freq_bands)
+            self.audio_thread.set_freq_bands(freq_bands)
 
     def update_min_max_level(self):
-        n_ranges = len(self.freq_bands)
+        n_ranges = len(self.audio_rgb.freq_bands)
         min_max_level = []
         for i in range(n_ranges):
             min_max_level.append((int(self.minmax_level_input[i][0].text()), int(self.minmax_level_input[i][1].text())))
-        self.min_max_level = min_max_level
+        self.audio_rgb.min_max_level = min_max_level
 
     #-------------------------------------------------------------------------------
-    def db_to_255(self, dB_value, dB_min=-60, dB_max=0):
-        # Normalize dB value from [dB_min, dB_max] to [0, 1]
-        normalized = (dB_value - dB_min) / (dB_max - dB_min)
-        # Clip the normalized value to be within the range [0, 1]
-        normalized = max(0, min(1, normalized))
-        # Convert normalized value to an integer in the range [0, 255]
-        mapped_value = int(round(255 * normalized))
-        return mapped_value
-
-    def peak_level_to_rgb(self, peak_levels, db_min, max_level, log_scale = True):
-        r = g = b = 0
-        MAX_RGB = 255
-        for i in range(len(peak_levels)):
-            try:
-                if peak_levels[i]/max_level[i] == 0:
-                    continue
-                peak_db = 20 * np.log10(peak_levels[i]/max_level[i])
-                peak_db_rgb = self.db_to_255(peak_db, db_min[i], 0)
-                #print(f"peak {i}: {peak_levels[i]} {peak_db} {peak_db_rgb}")
-                if log_scale:
-                    r += peak_db_rgb * self.freq_rgb[i][0]
-                    g += peak_db_rgb * self.freq_rgb[i][1]
-                    b += peak_db_rgb * self.freq_rgb[i][2]
-                else:
-                    r += peak_levels[i]/max_level[i] * self.freq_rgb[i][0] * MAX_RGB
-                    g += peak_levels[i]/max_level[i] * self.freq_rgb[i][1] * MAX_RGB
-                    b += peak_levels[i]/max_level[i] * self.freq_rgb[i][2] * MAX_RGB
-            except Exception as e:
-                self.dbg.tr('D', "peak_level_to_rgb:{}", e)
-                pass # #bands updated in ui
-
-        # rgb values are added for all bands, normalize with a factor
-        r /= 6
-        g /= 6
-        b /= 6
-        r = min(r, MAX_RGB)
-        g = min(g, MAX_RGB)
-        b = min(b, MAX_RGB)
-        return r,g,b
+    # audio worker thread, no qt widgets here
+    def on_onset_event(self, event):
+        self.beat_flash.trigger(event)
+        self.signal_onset.emit(event)
 
-    #-------------------------------------------------------------------------------
     def process_audiopeak_levels(self, peak_levels):
         if peak_levels is None:
+            self.audio_channel.post(None)
+            return
+
+        rgb, max_level_running = self.audio_rgb.process(peak_levels)
+        if max_level_running is not None:
+            self.max_level_running = max_level_running
+        frame = None
+        spectrum = self.spectrum
+        if spectrum:
+            frame = spectrum.render(self.audio_rgb.band_levels(peak_levels))
+        if self.beat_flash_enabled:
+            if frame is not None:
+                frame = self.beat_flash.apply(frame).astype(np.uint8)
+            elif rgb is not None:
+                rgb = self.beat_flash.apply(rgb).tolist()
+        self.audio_channel.post((peak_levels, rgb, frame))
+
+    # gui thread
+    def on_audio_result(self, result):
+        if result is None:
             self.signal_rgb_image.emit(None, self.rgb_multiplier)
+            if self.running and self.audio_thread and self.audio_thread.finished:
+                # capture ended by itself (source failed to open, ...)
+                self.start()
             return
 
+        peak_levels, rgb, frame = result
         self.signal_peak_levels.emit(peak_levels)
-
-        self.sample_count += 1
-        if self.dbg.enabled('PEAK_LEVEL'):
-            self.dbg.tr('PEAK_LEVEL', "peak {}: {}", self.sample_count, peak_levels)
-
-        # update "running max level", after N samples "max level" is adjusted with this
-        peak_level = 0 # current sample peak level
-        for i, lvl in enumerate(peak_levels):
-            if lvl > self.max_level_running[i]:
-                self.max_level_running[i] = lvl
-            if lvl > peak_level:
-                peak_level = lvl
-
-        # update "max level" every N samples, brightness is based on current peak levels and "max level"
-        if self.sample_count == 20:
-            self.sample_count = 0
-            max_level_running = 0
-            max_level_running_band = 0
-            for i in range(len(peak_levels)):
-                try:
-                    if self.max_level_running[i] > max_level_running:
-                        max_level_running = self.max_level_running[i]
-                        max_level_running_band = i
-
-                    if self.min_max_level[i][0] == 0:
-                        self.db_min[i] = -27
-                    else: # user defined min level
-                        self.db_min[i] = 20 * np.log10(self.min_max_level[i][0]/self.max_level[i])
-
-                    if self.min_max_level[i][1] > 0: # user defined max level
-                        self.max_level[i] = self.min_max_level[i][1]
-                    else:
-                        self.max_level[i] += (self.max_level_running[i] - self.max_level[i])/2
-                except Exception as e:
-                    self.dbg.tr('D', "process_audiopeak_levels:{}", e)
-                    pass
-
-            if self.dbg.enabled('MAX_PEAK'):
-                try:
-                    self.dbg.tr('MAX_PEAK', "{}:max level[{}] {}", time.monotonic(), max_level_running_band, max_level_running)
-                except:
-                    pass
-
-            self.peak_level.setText(f"{max_level_running:.2f}")
-            self.max_level_running = [0] * len(self.freq_bands)
-
-        if all(level < 0.05 for (level) in peak_levels):
+        if self.max_level_running is not None:
+            self.peak_level.setText(f"{self.max_level_running:.2f}")
+        if frame is not None:
+            if self.running:
+                self.signal_rgb_frame.emit(frame, self.rgb_multiplier)
+            return
+        if rgb is None:
             # no audio
             return
 
-        r,g,b = self.peak_level_to_rgb(peak_levels, self.db_min, self.max_level)
+        r,g,b = rgb
         self.keyb_rgb.fill(QColor(r,g,b))
         #-----------------------------------------------------------
         if self.running:
             self.signal_rgb_image.emit(self.keyb_rgb, self.rgb_multiplier)
 
-    # todo: apply effects
-    # - mask leds per freq band/peak level
-    # - trigger wave animation on freq band/peak level
-    # - ...
-    def apply_effect(self, img, peak_level):
-        # mask image to disable leds depending on peak level
-        if self.keyb_rgb_mask_mode != 0:
-            img = self.keyb_rgb.convertToFormat(QImage.Format_ARGB32)
-            self.keyb_rgb_mask.fill(0)
-            mask_bits = self.keyb_rgb_mask.bits()
-            bytes_per_line = self.keyb_rgb_mask.bytesPerLine()
-
-            # max num leds to light up to left and right of center
-            peak_max_num_leds = int(img.width()//2)
-            center_led = int(img.width()//2)
-            num_leds = int(min(1.0, peak_level / self.max_level) * peak_max_num_leds)
-            x_range = (max(0, center_led - num_leds), min(img.width(), center_led + num_leds)+1)
-
-            if self.keyb_rgb_mask_mode == 1:
-                for x in range(x_range[0], x_range[1]):
-                    # lines 1,2
-                    mask_bits[1 * bytes_per_line + x] = 255
-                    mask_bits[2 * bytes_per_line + x] = 255
-
-            if self.keyb_rgb_mask_mode == 2:
-                for x in range(x_range[0], x_range[1]):
-                    # all lines
-                    for i in range(img.height()):
-                        mask_bits[i * bytes_per_line + x] = 255
-
-            img.setAlphaChannel(self.keyb_rgb_mask)
-            img = img.convertedTo(QImage.Format_RGB888)
-            self.keyb_rgb = img
-
     def start(self):
-        if not self.audio_thread:
+        if not AudioCaptureThread.available():
             return
 
-        if not self.audio_thread.isRunning():
+        if not self.running:
             self.update_freq_rgb()
             self.update_freq_bands()
             self.update_min_max_level()
+            self.audio_rgb.reset_levels()
+            self.audio_thread = AudioCaptureThread(self.audio_rgb.freq_bands)
             self.audio_thread.connect_callback(self.process_audiopeak_levels)
+            self.audio_thread.connect_onset_callback(self.on_onset_event)
             self.audio_thread.start()
             self.start_button.setText("stop")
             self.running = True
         else:
             self.audio_thread.stop()
-            self.audio_thread.wait()
+            self.audio_thread.join()
+            self.audio_thread = None
             self.start_button.setText("start")
             self.running = False
 
@@ -485,6 +295,6 @@ class RGBAudioTab(QWidget):
         if not self.audio_thread:
             return
 
-        if self.audio_thread.isRunning():
+        if self.audio_thread.is_alive():
             self.audio_thread.stop()
-            self.audio_thread.wait()
+            self.audio_thread.join()
@@ -0,0 +1,121 @@
+import struct, functools, json
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# binary rgb frame websocket message
+#
+# header:   magic "QRGB", width, height, pixel format, reserved, sequence number
+# payload:  width * height pixels, row major, no padding
+#
+# legacy message "rgb.img:" + rgb bytes at rgb matrix size is still accepted.
+# frames are numpy views on the message buffer (no copy, read only), frames
+# with other size than the rgb matrix are resampled.
+#
+# client config (text): "rgb.client:" + json {"priority": int, "opacity": float, "ack": bool}
+# ack (server to client, if enabled): magic "QACK", sequence number of the
+# consumed frame, frames dropped (replaced by newer) since last ack
+#
+class RGBFrameProtocol:
+    MAGIC       = b"QRGB"
+    HEADER      = struct.Struct("<4sHHBBI")
+    LEGACY_IMG  = b"rgb.img:"
+    CLIENT      = b"rgb.client:"
+    ACK_MAGIC   = b"QACK"
+    ACK         = struct.Struct("<4sII")
+    PREFIXES    = (MAGIC, LEGACY_IMG, CLIENT) # first message of a rgb stream client
+
+    FMT_RGB888      = 0
+    FMT_BGR888      = 1
+    FMT_RGBA8888    = 2
+    FMT_GRAY8       = 3
+    BYTES_PER_PIXEL = { FMT_RGB888: 3, FMT_BGR888: 3, FMT_RGBA8888: 4, FMT_GRAY8: 1 }
+
+    @classmethod
+    def encode(cls, frame, seq, fmt=FMT_RGB888):
+        h, w = frame.shape[:2]
+        return cls.HEADER.pack(cls.MAGIC, w, h, fmt, 0, seq & 0xffffffff) + np.ascontiguousarray(frame).tobytes()
+
+    @classmethod
+    def encode_ack(cls, seq, dropped):
+        return cls.ACK.pack(cls.ACK_MAGIC, seq & 0xffffffff, dropped)
+
+    # returns (seq, dropped), None if not an ack
+    @classmethod
+    def decode_ack(cls, message):
+        if isinstance(message, bytes) and message.startswith(cls.ACK_MAGIC):
+            _, seq, dropped = cls.ACK.unpack_from(message)
+            return seq, dropped
+        return None
+
+    @classmethod
+    def encode_client_config(cls, **config):
+        return cls.CLIENT.decode() + json.dumps(config)
+
+    # returns config dict, None if not a client config message
+    @classmethod
+    def decode_client_config(cls, message):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if message.startswith(cls.CLIENT):
+            return json.loads(message[len(cls.CLIENT):])
+        return None
+
+    # returns (seq, (h, w, 3) rgb frame), (None, None) if not a frame message,
+    # raises ValueError on an invalid frame header
+    @classmethod
+    def decode(cls, message, matrix_size):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        if message.startswith(cls.MAGIC):
+            magic, w, h, fmt, _, seq = cls.HEADER.unpack_from(message)
+            if w == 0 or h == 0:
+                raise ValueError(f"invalid frame size {w}x{h}")
+            bpp = cls.BYTES_PER_PIXEL.get(fmt)
+            if bpp is None:
+                raise ValueError(f"unknown pixel format {fmt}")
+            frame = np.frombuffer(message, dtype=np.uint8, count=w * h * bpp, offset=cls.HEADER.size)
+            frame = frame.reshape(h, w, bpp)
+            if fmt == cls.FMT_BGR888:
+                frame = frame[:, :, ::-1]
+            elif fmt == cls.FMT_RGBA8888:
+                frame = frame[:, :, :3]
+            elif fmt == cls.FMT_GRAY8:
+                frame = np.broadcast_to(frame, (h, w, 3))
+            return seq, frame
+        if message.startswith(cls.LEGACY_IMG):
+            w, h = matrix_size
+            data = memoryview(message)[len(cls.LEGACY_IMG):]
+            size = w * h * 3
+            if len(data) < size:
+                # missing pixels are black
+                frame = np.zeros(size, dtype=np.uint8)
+                frame[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+            else:
+                frame = np.frombuffer(data, dtype=np.uint8, count=size)
+            return None, frame.reshape(h, w, 3)
+        return None, None
+
+#-------------------------------------------------------------------------------
+# resample indices for (src size, dst size): box filter (reduceat) when
+# downscaling, nearest pixel when upscaling
+@functools.lru_cache(maxsize=16)
+def _resample_index(src, dst):
+    if src >= dst:
+        starts = (np.arange(dst) * src) // dst
+        counts = np.diff(np.append(starts, src))
+        return starts, counts
+    return (np.arange(dst) * src) // dst, None
+
+def resample_frame(frame, size):
+    w, h = size
+    src_h, src_w = frame.shape[:2]
+    if (src_w, src_h) == (w, h):
+        return frame
+    ys, y_counts = _resample_index(src_h, h)
+    xs, x_counts = _resample_index(src_w, w)
+    if y_counts is None or x_counts is None:
+        return frame[ys[:, None], xs[None, :]]
+    acc = np.add.reduceat(frame, ys, axis=0, dtype=np.uint32)
+    acc = np.add.reduceat(acc, xs, axis=1)
+    acc //= (y_counts[:, None, None] * x_counts[None, :, None]).astype(np.uint32)
+    return acc.astype(np.uint8)
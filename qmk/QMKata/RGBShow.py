@@ -0,0 +1,118 @@
+import mmap, struct, threading, time
+
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# recorded rgb show file: already encoded rgb sysex packets with timestamps
+#
+# header:   magic "QMKS", version, reserved, vid, pid, duration (us)
+# record:   timestamp (us since record start), sysex cmd, data len, data
+#
+class RGBShow:
+    MAGIC       = b"QMKS"
+    VERSION     = 1
+    HEADER      = struct.Struct("<4sBBHHQ")
+    RECORD      = struct.Struct("<QBH")
+
+#-------------------------------------------------------------------------------
+class RGBShowRecorder:
+
+    def __init__(self, filename, vid_pid=(0,0)):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        self.filename = filename
+        self.vid_pid = vid_pid
+        self.lock = threading.Lock()
+        self.file = open(filename, "wb")
+        self.file.write(RGBShow.HEADER.pack(RGBShow.MAGIC, RGBShow.VERSION, 0, vid_pid[0], vid_pid[1], 0))
+        self.start_time = None
+        self.num_records = 0
+
+    def record(self, sysex_cmd, data):
+        with self.lock:
+            if not self.file:
+                return
+            now = time.monotonic()
+            if self.start_time is None:
+                self.start_time = now
+            ts = int((now - self.start_time) * 1000000)
+            self.file.write(RGBShow.RECORD.pack(ts, sysex_cmd, len(data)))
+            self.file.write(data)
+            self.num_records += 1
+
+    def close(self):
+        with self.lock:
+            if not self.file:
+                return
+            duration = 0
+            if self.start_time is not None:
+                duration = int((time.monotonic() - self.start_time) * 1000000)
+            # duration in header, used as loop period on replay
+            self.file.seek(0)
+            self.file.write(RGBShow.HEADER.pack(RGBShow.MAGIC, RGBShow.VERSION, 0, self.vid_pid[0], self.vid_pid[1], duration))
+            self.file.close()
+            self.file = None
+        self.dbg.tr('D', "recorded {} packets, {} us to {}", self.num_records, duration, self.filename)
+
+#-------------------------------------------------------------------------------
+class RGBShowPlayer(threading.Thread):
+
+    def __init__(self, filename, send_packet, vid_pid=None, loop=True, on_done=None):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        self.filename = filename
+        self.send_packet = send_packet # send_packet(sysex_cmd, data)
+        self.on_done = on_done # on_done(player) on this thread when replay ended or was stopped
+        self.loop = loop
+        self.stop_ev = threading.Event()
+
+        self.file = open(filename, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, vid, pid, self.duration = RGBShow.HEADER.unpack_from(self.buf, 0)
+        if magic != RGBShow.MAGIC or version != RGBShow.VERSION:
+            self.close()
+            raise Exception(f"not a rgb show file: {filename}")
+        if vid_pid and (vid, pid) != tuple(vid_pid):
+            self.dbg.tr('W', "show recorded for {:04x}:{:04x}", vid, pid)
+        super().__init__(name="RGBShowPlayer", daemon=True)
+
+    def run(self):
+        buf = self.buf
+        mv = memoryview(buf)
+        end = len(buf)
+        record_size = RGBShow.RECORD.size
+        unpack_record = RGBShow.RECORD.unpack_from
+        t0 = time.monotonic()
+        try:
+            while not self.stop_ev.is_set():
+                off = RGBShow.HEADER.size
+                while off + record_size <= end:
+                    ts, sysex_cmd, size = unpack_record(buf, off)
+                    off += record_size
+                    delay = t0 + ts / 1000000 - time.monotonic()
+                    if delay > 0 and self.stop_ev.wait(delay):
+                        return
+                    self.send_packet(sysex_cmd, mv[off:off+size])
+                    off += size
+
+                if not self.loop or self.duration == 0:
+                    break
+                t0 += self.duration / 1000000
+        except Exception as e:
+            self.dbg.tr('E', "rgb show replay: {}", e)
+        finally:
+            mv.release()
+            self.close()
+        self.dbg.tr('D', "rgb show replay done")
+        if self.on_done:
+            self.on_done(self)
+
+    def stop(self):
+        self.stop_ev.set()
+
+    def close(self):
+        try:
+            self.buf.close()
+            self.file.close()
+        except Exception:
+            pass
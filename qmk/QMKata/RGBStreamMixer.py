@@ -0,0 +1,193 @@
+import threading, time, asyncio
+import numpy as np
+
+from RGBFrameProtocol import RGBFrameProtocol, resample_frame
+from FramePacer import FramePacer
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# rgb stream client: latest frame mailbox, a new frame replaces a frame not yet
+# consumed (counted as dropped). frame stays as client layer until removed.
+class RGBStreamClient:
+
+    def __init__(self, name, priority=0, opacity=1.0, on_ack=None):
+        self.name = name
+        self.priority = priority
+        self.opacity = opacity
+        self.on_ack = on_ack # on_ack(seq, dropped) called on mixer thread
+        self.frame = None
+        self.seq = None
+        self.pending = False
+        self.num_received = 0
+        self.num_dropped = 0
+        self.num_dropped_ack = 0 # dropped since last ack
+
+#-------------------------------------------------------------------------------
+# mix rgb streams from several clients (websocket, shared memory ring): at most
+# one output per device refresh slot, client layers composited by priority
+# (low first) with opacity.
+# output(frame) is called on the mixer thread, output(None) when no client left.
+#
+class RGBStreamMixer(threading.Thread):
+    UNCHANGED = object() # configure() on_ack default, None/False disables acks
+
+    def __init__(self, matrix_size, output, fps=25):
+        self.dbg = DebugTracer(zones={'D':0, 'MIX':0}, obj=self)
+
+        super().__init__(name="RGBStreamMixer", daemon=True)
+        self.matrix_size = matrix_size
+        self.output = output
+        self.pacer = FramePacer(fps, "mixer")
+        self.clients = []
+        self.rings = [] # (client, shared frame ring) polled every output slot
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.running = False
+
+    def add_client(self, name, priority=0, opacity=1.0, on_ack=None):
+        client = RGBStreamClient(name, priority, opacity, on_ack)
+        with self.lock:
+            self.clients.append(client)
+        self.dbg.tr('D', "client {} added", name)
+        return client
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        self.dbg.tr('D', "client {} removed, {} frames, {} dropped", client.name, client.num_received, client.num_dropped)
+        self.event.set()
+
+    def add_ring(self, ring, name="shm", priority=0, opacity=1.0):
+        client = self.add_client(name, priority, opacity)
+        with self.lock:
+            self.rings.append((client, ring))
+        self.event.set()
+        return client
+
+    def remove_ring(self, ring):
+        for client, _ring in list(self.rings):
+            if _ring == ring:
+                with self.lock:
+                    self.rings.remove((client, _ring))
+                self.remove_client(client)
+
+    # newest complete frame of each ring (copied out of shared memory), a ring
+    # removed and closed while polled is skipped
+    def poll_rings(self):
+        for client, ring in list(self.rings):
+            try:
+                latest = ring.latest()
+            except Exception:
+                continue
+            if latest and latest[0] != client.seq:
+                self.post(client, latest[0], latest[1])
+
+    def configure(self, client, priority=None, opacity=None, on_ack=UNCHANGED):
+        with self.lock:
+            if priority is not None:
+                client.priority = int(priority)
+            if opacity is not None:
+                client.opacity = min(1.0, max(0.0, float(opacity)))
+            if on_ack is not self.UNCHANGED:
+                client.on_ack = on_ack or None
+        self.event.set()
+
+    # frame at matrix size, kept until consumed or replaced
+    def post(self, client, seq, frame):
+        with self.lock:
+            if client.pending:
+                client.num_dropped += 1
+                client.num_dropped_ack += 1
+            client.frame = frame
+            client.seq = seq
+            client.pending = True
+            client.num_received += 1
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    def compose(self, layers):
+        # opaque top layer: its frame as is (no copy)
+        if layers[-1].opacity >= 1.0:
+            return layers[-1].frame
+        w, h = self.matrix_size
+        out = np.zeros((h, w, 3), dtype=np.float32)
+        for layer in layers:
+            out += (layer.frame - out) * layer.opacity
+        return out.astype(np.uint8)
+
+    def run(self):
+        self.running = True
+        was_active = False
+        while self.running:
+            self.event.wait(self.pacer.time_to_next() if self.rings else 0.5)
+            if not self.running:
+                break
+            self.poll_rings()
+            if not self.event.is_set():
+                continue
+            # newer frames replace older until the next output slot
+            if not self.pacer.ready():
+                time.sleep(self.pacer.time_to_next())
+                continue
+            self.event.clear()
+
+            acks = []
+            with self.lock:
+                layers = sorted((c for c in self.clients if c.frame is not None), key=lambda c: c.priority)
+                for client in layers:
+                    if client.pending:
+                        client.pending = False
+                        if client.on_ack and client.seq is not None:
+                            acks.append((client.on_ack, client.seq, client.num_dropped_ack))
+                            client.num_dropped_ack = 0
+
+            if layers:
+                frame = self.compose(layers)
+                self.dbg.tr('MIX', "{} layers", len(layers))
+                self.output(frame)
+                was_active = True
+            elif was_active:
+                self.output(None)
+                was_active = False
+
+            for on_ack, seq, dropped in acks:
+                try:
+                    on_ack(seq, dropped)
+                except Exception as e:
+                    self.dbg.tr('D', "ack: {}", e)
+
+        if was_active:
+            self.output(None)
+        self.dbg.tr('D', "mixer stopped, {}", self.pacer.stats_text())
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+
+    #-------------------------------------------------------------------------------
+    # websocket handler, one mixer client per connection
+    async def ws_client_handler(self, websocket, path=None):
+        loop = asyncio.get_running_loop()
+        def send_ack(seq, dropped):
+            asyncio.run_coroutine_threadsafe(websocket.send(RGBFrameProtocol.encode_ack(seq, dropped)), loop)
+
+        client = self.add_client(str(getattr(websocket, 'remote_address', "ws")))
+        try:
+            async for message in websocket:
+                try:
+                    config = RGBFrameProtocol.decode_client_config(message)
+                    if config is not None:
+                        on_ack = self.UNCHANGED
+                        if 'ack' in config:
+                            on_ack = send_ack if config['ack'] else None
+                        self.configure(client, config.get('priority'), config.get('opacity'), on_ack)
+                        continue
+                    seq, frame = RGBFrameProtocol.decode(message, self.matrix_size)
+                    if frame is not None:
+                        self.post(client, seq, resample_frame(frame, self.matrix_size))
+                except Exception as e:
+                    self.dbg.tr('D', "invalid message: {}", e)
+        except Exception as e:
+            self.dbg.tr('D', "ws_client_handler: {}", e)
+        self.remove_client(client)
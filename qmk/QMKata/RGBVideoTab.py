@@ -1,16 +1,27 @@
-import cv2, numpy as np, time
-import asyncio, websockets
+import time, queue, math
 
 from PySide6 import QtCore
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QSlider, QHBoxLayout, QLineEdit, QCheckBox
 from PySide6.QtCore import Qt, Signal, QTimer
-from PySide6.QtGui import QImage, QPixmap, QColor, QIntValidator
+from PySide6.QtGui import QImage, QPixmap, QIntValidator
 
 from WSServer import WSServer
+from VideoCache import VideoCache
+from VideoSource import VideoDecodeThread, FFmpegVideoSource
+from RGBStreamMixer import RGBStreamMixer
+from RGBFrameProtocol import RGBFrameProtocol
 from DebugTracer import DebugTracer
 
+# (h, w, 3) uint8 rgb array to QImage (copy, the array can be a memory mapped file)
+def rgb_array_to_qimage(arr):
+    h, w, _ = arr.shape
+    return QImage(arr.tobytes(), w, h, w * 3, QImage.Format_RGB888).copy()
+
+#-------------------------------------------------------------------------------
 class RGBVideoTab(QWidget):
     signal_rgb_image = Signal(QImage, object)
+    signal_video_info = Signal(float)
+    signal_rgb_frame = Signal(object, object)
 
     def __init__(self, size, rgb_matrix_tab, rgb_matrix_size):
         self.dbg = DebugTracer(zones={'D':0, 'WS_MSG':0}, obj=self)
@@ -18,64 +29,87 @@ class RGBVideoTab(QWidget):
 
         self.size_w, self.size_h = size
         self.rgb_matrix_tab = rgb_matrix_tab
-        self.cap = None
         self.framerate = 25
         self.rgb_matrix_size = rgb_matrix_size
+        try:
+            self.keyboard_name = rgb_matrix_tab.keyboard_model.name()
+            self.rgb_max_refresh = rgb_matrix_tab.keyboard_model.rgb_max_refresh()
+        except:
+            self.keyboard_name = "default"
+            self.rgb_max_refresh = 25
+        self.ws_port = None
+        self.shm_ring = None
+        self.rgb_mixer = None
+        self.video_cache = VideoCache()
+        self.video_thread = None
+        self.video_timer = QTimer(self)
+        self.video_timer.setTimerType(Qt.PreciseTimer)
+        self.video_timer.setSingleShot(True)
+        self.video_timer.timeout.connect(self.display_video_frame)
+        self.signal_video_info.connect(self.on_video_info)
         self.rgb_multiplier = (1.0,1.0,1.0)
         self.init_gui()
 
-    async def ws_handler(self, websocket, path):
-        try:
-            async for message in websocket:
-                try:
-                    message = bytearray(message, 'utf-8')
-                except:
-                    pass # already bytearray
-                self.dbg.tr('WS_MSG', "ws_handler: {}", message)
-                sub = b"rgb."
-                if message.startswith(sub):
-                    message = message[len(sub):]
-                    subs = [ b"mode:", b"img:" ]
-                    for sub in subs:
-                        if message.startswith(sub):
-                            if sub == b"img:":
-                                data = message[len(sub):]
-                                w = self.rgb_matrix_size[0]
-                                h = self.rgb_matrix_size[1]
-                                img = QImage(w, h, QImage.Format_RGB888)
-                                img.fill(QColor('black'))
-                                for y in range(h):
-                                    for x in range(w):
-                                        index = (y * w + x) * 3
-                                        try:
-                                            r, g, b = data[index], data[index + 1], data[index + 2]
-                                            img.setPixelColor(x, y, QColor(r, g, b))
-                                        except Exception as e:
-                                            #self.dbg.tr('WS_MSG', "ws_handler: {}" ,e)
-                                            pass
-
-                                self.signal_rgb_image.emit(img, self.rgb_multiplier)
-                                #self.dbg.tr('WS_MSG', "ws_handler:emit(img) done")
-                self.dbg.tr('WS_MSG', "ws_handler: message handled")
-                await asyncio.sleep(0)  # Ensures control is yielded back to the event loop
-
-        except Exception as e:
-            self.dbg.tr('WS_MSG', "ws_handler: {}", e)
-        self.dbg.tr('WS_MSG', "ws_handler: done")
-        self.signal_rgb_image.emit(None, self.rgb_multiplier)
-
     def ws_server_startstop(self, state):
         #self.dbg.tr('D', "state:{}", state)
+        server = WSServer.shared()
         if Qt.CheckState(state) == Qt.CheckState.Checked:
-            self.ws_server = WSServer(self.ws_handler, int(self.ws_server_port.text()))
-            self.ws_server.start()
+            self.start_mixer()
+            server.add_route("rgb", self.rgb_mixer.ws_client_handler, RGBFrameProtocol.PREFIXES)
+            try:
+                self.ws_port = int(self.ws_server_port.text())
+                server.listen(self.ws_port, "rgb")
+            except Exception as e:
+                # port in use, ...: route not served, checkbox back to off
+                self.dbg.tr('E', "ws server: {}", e)
+                server.remove_route("rgb")
+                self.ws_port = None
+                self.stop_mixer()
+                self.ws_server_checkbox.blockSignals(True)
+                self.ws_server_checkbox.setChecked(False)
+                self.ws_server_checkbox.blockSignals(False)
         else:
             try:
-                self.ws_server.stop()
-                self.ws_server.wait()
-                self.ws_server = None
+                server.unlisten(self.ws_port)
+                server.remove_route("rgb")
+                self.ws_port = None
             except Exception as e:
                 self.dbg.tr('D', "{}", e)
+            self.stop_mixer()
+
+    # local producers write frames to shared memory ring, see SharedFrameRing
+    def shm_ring_startstop(self, state):
+        if Qt.CheckState(state) == Qt.CheckState.Checked:
+            try:
+                from SharedFrameRing import SharedFrameRing
+                self.shm_ring = SharedFrameRing.create(SharedFrameRing.DEFAULT_NAME, self.rgb_matrix_size)
+            except Exception as e:
+                self.dbg.tr('E', "shared memory: {}", e)
+                self.shm_ring_checkbox.setChecked(False)
+                return
+            self.start_mixer()
+            self.rgb_mixer.add_ring(self.shm_ring)
+        elif self.shm_ring:
+            self.rgb_mixer.remove_ring(self.shm_ring)
+            self.shm_ring.close()
+            self.shm_ring = None
+            self.stop_mixer()
+
+    # ws clients and shared memory frames mixed at keyboard refresh rate, latest frame wins
+    def start_mixer(self):
+        if not self.rgb_mixer:
+            self.rgb_mixer = RGBStreamMixer(self.rgb_matrix_size, self.on_mixer_frame, self.rgb_max_refresh)
+            self.rgb_mixer.start()
+
+    def stop_mixer(self):
+        if self.rgb_mixer and not self.ws_port and not self.shm_ring:
+            self.rgb_mixer.stop()
+            self.rgb_mixer.join()
+            self.rgb_mixer = None
+
+    # mixer thread
+    def on_mixer_frame(self, frame):
+        self.signal_rgb_frame.emit(frame, self.rgb_multiplier)
 
     def init_gui(self):
         layout = QVBoxLayout()
@@ -96,7 +130,14 @@ class RGBVideoTab(QWidget):
         self.ws_server_port.setFixedWidth(50)
         self.ws_server_checkbox.stateChanged.connect(self.ws_server_startstop)
         hlayout = QHBoxLayout()
+        # decode with ffmpeg subprocess scaling to matrix size
+        self.ffmpeg_checkbox = QCheckBox("ffmpeg decoder", self)
+        self.ffmpeg_checkbox.setEnabled(FFmpegVideoSource.available())
+        hlayout.addWidget(self.ffmpeg_checkbox)
         hlayout.addStretch(1)
+        self.shm_ring_checkbox = QCheckBox("enable shared memory", self)
+        self.shm_ring_checkbox.stateChanged.connect(self.shm_ring_startstop)
+        hlayout.addWidget(self.shm_ring_checkbox)
         hlayout.addWidget(self.ws_server_checkbox)
         hlayout.addWidget(self.ws_server_port)
         #endregion
@@ -142,8 +183,12 @@ class RGBVideoTab(QWidget):
         self.rgb_b_slider.setToolTip("blue multiplier")
         self.rgb_b_slider.valueChanged.connect(self.adjust_rgb_multiplier)
 
+        self.achieved_fps_label = QLabel("")
+        self.achieved_fps_label.setFixedWidth(280)
+
         controls_layout.addWidget(self.framerate_label)
         controls_layout.addWidget(self.framerate_slider)
+        controls_layout.addWidget(self.achieved_fps_label)
         rgb_multiply_layout.addWidget(self.rgb_r_label)
         rgb_multiply_layout.addWidget(self.rgb_r_slider)
         rgb_multiply_layout.addWidget(self.rgb_g_label)
@@ -159,18 +204,14 @@ class RGBVideoTab(QWidget):
         layout.addLayout(rgb_multiply_layout)
         self.setLayout(layout)
 
-    def timer_interval(self):
-        try:
-            process_time = self.process_time
-        except:
-            process_time = 10
-
-        interval = 1000 / self.framerate - process_time
-        return interval if interval > 0 else 1
+    # timer armed for next frame deadline (rounded up, not before frame is due)
+    def start_frame_timer(self):
+        self.video_timer.start(math.ceil(self.video_thread.pacer.time_to_next() * 1000))
 
     def adjust_framerate(self, value):
         self.framerate = value
-        self._timer_interval = self.timer_interval()
+        if self.video_thread:
+            self.video_thread.set_framerate(value)
 
     def adjust_rgb_multiplier(self, value):
         if self.sender() == self.rgb_r_slider:
@@ -181,52 +222,107 @@ class RGBVideoTab(QWidget):
             self.rgb_multiplier = (self.rgb_multiplier[0], self.rgb_multiplier[1], value/100)
         #print(self.RGB_multiplier)
 
+    def video_playing(self):
+        return self.video_thread is not None
+
+    def stop_video(self):
+        self.video_timer.stop()
+        if self.video_thread:
+            self.video_thread.stop()
+            self.video_thread.join()
+            self.video_thread = None
+        self.achieved_fps_label.setText("")
+        self.signal_rgb_image.emit(None, self.rgb_multiplier)
+        self.open_button.setText("open file")
+
     def open_file(self):
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
-            self.cap = None
-            self.signal_rgb_image.emit(None, self.rgb_multiplier)
-            self.open_button.setText("open file")
+        if self.video_playing():
+            self.stop_video()
             return
 
         filename, _ = QFileDialog.getOpenFileName(self, "open file", "", "Video Files (*.mp4 *.avi *.mov *.webm *.gif)")
         if filename:
-            self.cap = cv2.VideoCapture(filename)
-            fps = self.cap.get(cv2.CAP_PROP_FPS)  # Get the video's frame rate
-            self.framerate = fps if fps > 0 else 25
-            self.framerate_slider.setValue(int(self.framerate))
-            self.adjust_framerate(self.framerate)
-            QTimer.singleShot(self.timer_interval(), self.display_video_frame)
-
-            self.dbg.tr('D', "frame rate:{}", self.framerate)
+            self.video_thread = VideoDecodeThread(filename, self.video_cache, self.keyboard_name,
+                                                  self.rgb_matrix_size, (self.size_w, self.size_h),
+                                                  self.ffmpeg_checkbox.isChecked(),
+                                                  on_video_info=self.signal_video_info.emit)
+            self.pending_frame = None
+            self.shown_index = -1
+            self.fps_count = 0
+            self.fps_count_start = time.monotonic()
+            self.video_thread.start()
             self.open_button.setText("stop")
 
+    # queued from the decode thread, can arrive after stop
+    def on_video_info(self, fps):
+        if not self.video_thread:
+            return
+        self.dbg.tr('D', "frame rate:{}", fps)
+        self.framerate_slider.blockSignals(True)
+        self.framerate_slider.setValue(int(fps))
+        self.framerate_slider.blockSignals(False)
+        self.framerate = fps
+        self.start_frame_timer()
+
     def display_video_frame(self):
-        if not self.cap:
+        if not self.video_thread:
             return
+        self.video_thread.pacer.tick()
+        self.start_frame_timer()
+
+        # newest decoded frame which is due
+        due = self.video_thread.due_index()
+        frame = None
+        while True:
+            if self.pending_frame is None:
+                try:
+                    self.pending_frame = self.video_thread.frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+            if self.pending_frame[0] > due:
+                break
+            frame = self.pending_frame
+            self.pending_frame = None
 
-        QTimer.singleShot(self._timer_interval, self.display_video_frame)
-        #self.dbg.tr('D', "capture image:")
-        #start = cv2.getTickCount()
-        ret, frame = self.cap.read()
-        if ret:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_frame.shape
-            bytes_per_line = ch * w
-            rgb_img = QImage(rgb_frame.data, w, h, bytes_per_line, QImage.Format_RGB888)
-            scaled_img = rgb_img.scaled(self.size_w, self.size_h, aspectMode=QtCore.Qt.AspectRatioMode.KeepAspectRatio)
-            self.video_label.setPixmap(QPixmap.fromImage(scaled_img))
-
-            keyb_rgb = scaled_img.scaled(self.rgb_matrix_size[0], self.rgb_matrix_size[1])
-            self.signal_rgb_image.emit(keyb_rgb, self.rgb_multiplier)
-            #self.process_time = cv2.getTickCount() - start
-            #self.dbg.tr('D', "image emitted {}", self.process_time)
+        self.update_achieved_fps()
+        if frame is None or frame[0] == self.shown_index:
+            return
+        index, led_frame, preview_frame = frame
+        self.shown_index = index
+        self.fps_count += 1
+
+        keyb_rgb = rgb_array_to_qimage(led_frame)
+        if preview_frame is not None:
+            preview_img = rgb_array_to_qimage(preview_frame)
         else:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # restart
+            # led resolution frame from cache, preview is the upscaled led frame
+            preview_img = keyb_rgb
+        if preview_img.width() < self.size_w and preview_img.height() < self.size_h:
+            preview_img = preview_img.scaled(self.size_w, self.size_h, aspectMode=QtCore.Qt.AspectRatioMode.KeepAspectRatio)
+        self.video_label.setPixmap(QPixmap.fromImage(preview_img))
+        self.signal_rgb_image.emit(keyb_rgb, self.rgb_multiplier)
+
+    def update_achieved_fps(self):
+        now = time.monotonic()
+        if now - self.fps_count_start >= 1.0:
+            fps = self.fps_count / (now - self.fps_count_start)
+            stats = self.video_thread.pacer.stats()
+            self.achieved_fps_label.setText(f"{fps:.1f}/{self.framerate:.1f} fps, skip {self.video_thread.num_skipped}, "
+                                            f"jitter {stats['jitter_mean']:.1f}/{stats['jitter_max']:.1f} ms")
+            self.video_thread.pacer.reset_stats()
+            self.fps_count = 0
+            self.fps_count_start = now
 
     def print_rgb_data(self, frame):
         print(frame[0,0])
 
     def closeEvent(self, event):
-        if self.cap is not None and self.cap.isOpened():
-            self.cap.release()
+        self.video_timer.stop()
+        if self.video_thread:
+            self.video_thread.stop()
+            self.video_thread.join()
+            self.video_thread = None
+        if self.ws_port:
+            self.ws_server_startstop(Qt.CheckState.Unchecked)
+        if self.shm_ring:
+            self.shm_ring_startstop(Qt.CheckState.Unchecked)
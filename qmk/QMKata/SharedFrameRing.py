@@ -0,0 +1,218 @@
+import os, struct, sys
+import numpy as np
+from multiprocessing import shared_memory
+
+#-------------------------------------------------------------------------------
+# rgb frame ring in a named shared memory segment, for producers on the same
+# machine (no websocket framing, no decode)
+#
+# header:   magic "QSHM", version, width, height, number of slots, owner pid,
+#           sequence number of last complete frame (0: none), producer pid
+# slot:     sequence begin, sequence end, width * height * 3 rgb bytes
+#
+# frame n is written to slot n % slots: begin = n, pixels, end = n, then the
+# header sequence = n. a reader takes the header sequence, copies the slot if
+# its end sequence matches and checks begin is still n after the copy (not
+# overwritten meanwhile). the copy is a few hundred bytes at rgb matrix size
+# and stays valid after the segment is closed, views are only used by producers.
+#
+# single producer: the next sequence is taken from the header, two writers
+# would claim the same slot. SharedFrameProducer claims the ring with its pid
+# on attach and fails if another live producer holds it (a producer that
+# exited without close is replaced).
+#
+# qmkata creates the segment at rgb matrix size, producers attach by name. a
+# segment of a running owner isn't taken over (create() fails), also not one
+# of this process (e.g. daemon and tab) unless reopen=True, only stale ones
+# (owner exited without unlink) or invalid ones are replaced.
+#
+class SharedFrameRing:
+    MAGIC           = b"QSHM"
+    VERSION         = 1
+    HEADER          = struct.Struct("<4sHHHHIQ")
+    HEADER_SIZE     = 32
+    SLOT_HEADER     = struct.Struct("<QQ")
+    SEQ_OFFSET      = 16
+    PRODUCER_OFFSET = 24
+    DEFAULT_NAME    = "qmkata_rgb"
+    DEFAULT_SLOTS   = 4
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, version, self.width, self.height, self.num_slots, self.owner_pid, _ = self.HEADER.unpack_from(shm.buf)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise Exception(f"{shm.name}: not a frame ring")
+        self.frame_size = self.width * self.height * 3
+        self.slot_size = (self.SLOT_HEADER.size + self.frame_size + 15) & ~15
+        self.frames = [ np.ndarray((self.height, self.width, 3), dtype=np.uint8, buffer=shm.buf,
+                                   offset=self.slot_offset(i) + self.SLOT_HEADER.size)
+                        for i in range(self.num_slots) ]
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, size=(17, 6), num_slots=DEFAULT_SLOTS, reopen=False):
+        w, h = size
+        slot_size = (cls.SLOT_HEADER.size + w * h * 3 + 15) & ~15
+        cls.remove_stale(name, reopen)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.HEADER_SIZE + num_slots * slot_size)
+        shm.buf[:cls.HEADER_SIZE + num_slots * slot_size] = bytes(cls.HEADER_SIZE + num_slots * slot_size)
+        cls.HEADER.pack_into(shm.buf, 0, cls.MAGIC, cls.VERSION, w, h, num_slots, os.getpid(), 0)
+        return cls(shm, True)
+
+    # unlink a segment left by an owner that exited, raise if its owner still
+    # runs (reopen: unless it is this process)
+    @classmethod
+    def remove_stale(cls, name, reopen=False):
+        try:
+            old = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        try:
+            magic, version, _, _, _, owner_pid, _ = cls.HEADER.unpack_from(old.buf)
+            valid = magic == cls.MAGIC and version == cls.VERSION
+        except struct.error:
+            valid = False
+        old.close()
+        if valid and process_alive(owner_pid) and not (reopen and owner_pid == os.getpid()):
+            untrack(old)
+            raise Exception(f"shared memory ring {name} in use by process {owner_pid}")
+        try:
+            old.unlink()
+        except Exception:
+            pass
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME):
+        shm = shared_memory.SharedMemory(name=name)
+        untrack(shm)
+        return cls(shm, False)
+
+    def slot_offset(self, slot):
+        return self.HEADER_SIZE + slot * self.slot_size
+
+    def sequence(self):
+        return struct.unpack_from("<Q", self.shm.buf, self.SEQ_OFFSET)[0]
+
+    def slot_sequence(self, slot):
+        return self.SLOT_HEADER.unpack_from(self.shm.buf, self.slot_offset(slot))
+
+    #-------------------------------------------------------------------------------
+    # one producer per ring, see above
+    def producer_pid(self):
+        return struct.unpack_from("<I", self.shm.buf, self.PRODUCER_OFFSET)[0]
+
+    def claim_producer(self):
+        pid = self.producer_pid()
+        if pid and process_alive(pid):
+            raise Exception(f"shared memory ring {self.shm.name} already has a producer (process {pid})")
+        struct.pack_into("<I", self.shm.buf, self.PRODUCER_OFFSET, os.getpid())
+
+    def release_producer(self):
+        if self.producer_pid() == os.getpid():
+            struct.pack_into("<I", self.shm.buf, self.PRODUCER_OFFSET, 0)
+
+    # producer: render into next_frame() view in place and commit(), or write(frame)
+    def next_frame(self):
+        seq = self.sequence() + 1
+        slot = seq % self.num_slots
+        struct.pack_into("<Q", self.shm.buf, self.slot_offset(slot), seq)
+        return seq, self.frames[slot]
+
+    def commit(self, seq):
+        slot = seq % self.num_slots
+        struct.pack_into("<Q", self.shm.buf, self.slot_offset(slot) + 8, seq)
+        struct.pack_into("<Q", self.shm.buf, self.SEQ_OFFSET, seq)
+
+    def write(self, frame):
+        seq, slot_frame = self.next_frame()
+        np.copyto(slot_frame, frame)
+        self.commit(seq)
+        return seq
+
+    #-------------------------------------------------------------------------------
+    # consumer: (seq, frame copy) of newest complete frame, None if none
+    def latest(self):
+        seq = self.sequence()
+        if seq == 0:
+            return None
+        slot = seq % self.num_slots
+        begin, end = self.slot_sequence(slot)
+        if begin != seq or end != seq:
+            return None
+        frame = self.frames[slot].copy()
+        if self.slot_sequence(slot)[0] != seq:
+            return None # producer wrapped around while copying
+        return seq, frame
+
+    def close(self):
+        self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a consumer still holds a frame view, mapping released with it
+            pass
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except Exception:
+                pass
+
+#-------------------------------------------------------------------------------
+# attached (not created) segment: don't let the resource tracker unlink it on exit
+def untrack(shm):
+    if sys.platform != "win32":
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+
+def process_alive(pid):
+    if pid <= 0:
+        return False
+    if sys.platform == "win32":
+        import ctypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return kernel32.GetLastError() == 5 # access denied: exists
+        try:
+            exit_code = ctypes.c_ulong()
+            return not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)) or exit_code.value == STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+#-------------------------------------------------------------------------------
+# producer library for local apps: attach to qmkata's ring, send frames of any
+# size (resampled to rgb matrix size)
+#
+class SharedFrameProducer:
+
+    def __init__(self, name=SharedFrameRing.DEFAULT_NAME):
+        self.ring = SharedFrameRing.attach(name)
+        try:
+            self.ring.claim_producer()
+        except Exception:
+            self.ring.close()
+            raise
+
+    @property
+    def size(self):
+        return self.ring.width, self.ring.height
+
+    def send(self, frame):
+        from RGBFrameProtocol import resample_frame
+        return self.ring.write(resample_frame(frame, self.size))
+
+    def close(self):
+        self.ring.release_producer()
+        self.ring.close()
@@ -0,0 +1,114 @@
+import time
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# spectrum analyzer at led resolution: frequency bands mapped to matrix columns
+# (low to high, left to right), bars rising from the bottom row with a
+# fractional top led, falloff and peak hold. column colors are the band colors
+# of freq_bands_colors*.json.
+#
+# more bands than columns: a column shows the max of its band group, fewer
+# bands than columns: a band spans several columns. all numpy, per frame cost
+# doesn't depend on the number of bands.
+#
+class SpectrumRenderer:
+    FALLOFF         = 2.0 # bar fall speed, matrix heights per second
+    PEAK_HOLD       = 0.4 # seconds
+    PEAK_FALLOFF    = 1.0 # matrix heights per second
+
+    def __init__(self, matrix_size, colors, falloff=FALLOFF, peak_hold=PEAK_HOLD, peak_falloff=PEAK_FALLOFF):
+        self.w, self.h = matrix_size
+        self.falloff = falloff
+        self.peak_hold = peak_hold
+        self.peak_falloff = peak_falloff
+        # height of each row above the bottom row
+        self.row_height = np.arange(self.h - 1, -1, -1, dtype=np.float32)[:, None]
+        self.columns = np.arange(self.w)
+        self.set_colors(colors)
+        self.reset()
+
+    def reset(self):
+        self.bars = np.zeros(self.w, dtype=np.float32)
+        self.peaks = np.zeros(self.w, dtype=np.float32)
+        self.peak_time = np.zeros(self.w)
+        self.last_time = None
+
+    def set_colors(self, colors):
+        colors = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+        self.num_bands = len(colors)
+        # first band of each column
+        self.column_band = (self.columns * max(1, self.num_bands)) // self.w
+        self.group_reduce = self.num_bands > self.w
+        self.column_colors = np.clip(colors[self.column_band] * 255, 0, 255) if self.num_bands else \
+                             np.zeros((self.w, 3), dtype=np.float32)
+
+    def column_levels(self, levels):
+        levels = np.asarray(levels, dtype=np.float32)
+        if len(levels) != self.num_bands or not self.num_bands:
+            return np.zeros(self.w, dtype=np.float32)
+        if self.group_reduce:
+            return np.maximum.reduceat(levels, self.column_band)
+        return levels[self.column_band]
+
+    #-------------------------------------------------------------------------------
+    # levels: per band 0..1, returns new (h, w, 3) uint8 frame
+    def render(self, levels, now=None):
+        now = time.monotonic() if now is None else now
+        dt = 0.0 if self.last_time is None else now - self.last_time
+        self.last_time = now
+
+        levels = np.clip(self.column_levels(levels), 0.0, 1.0)
+        self.bars = np.maximum(levels, self.bars - self.falloff * dt)
+
+        falling = np.where(now - self.peak_time > self.peak_hold, self.peaks - self.peak_falloff * dt, self.peaks)
+        new_peak = levels >= falling
+        self.peaks = np.where(new_peak, levels, np.maximum(falling, 0.0))
+        self.peak_time = np.where(new_peak, now, self.peak_time)
+
+        # lit fraction per led: full below the bar top, partial at the top led
+        fill = np.clip(self.bars * self.h - self.row_height, 0.0, 1.0)
+        frame = fill[:, :, None] * self.column_colors[None, :, :]
+
+        # peak led at full brightness
+        peak_row = self.h - np.ceil(self.peaks * self.h).astype(np.intp)
+        visible = self.peaks > 0.0
+        frame[peak_row[visible], self.columns[visible]] = self.column_colors[visible]
+        return frame.astype(np.uint8)
+
+#-------------------------------------------------------------------------------
+# flash on onset events (OnsetDetector): trigger() from the audio worker keeps
+# the last event of kind, level() decays exponentially from the event strength.
+# a flash costs one multiply per frame, no spectrum processing.
+#
+class BeatFlash:
+    DECAY_TIME = 0.12 # seconds
+    INTENSITY  = 0.6  # flash of a full strength event, 1 is white
+
+    def __init__(self, kind="beat", decay_time=DECAY_TIME, intensity=INTENSITY):
+        self.kind = kind
+        self.decay_time = decay_time
+        self.intensity = intensity
+        self.last = None # (time, strength)
+
+    def trigger(self, event):
+        t, kind, strength, _ = event
+        if kind == self.kind:
+            self.last = (t, self.intensity * (0.5 + 0.5 * strength))
+
+    def level(self, now=None):
+        last = self.last
+        if last is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        age = max(0.0, now - last[0])
+        if age > 8 * self.decay_time:
+            return 0.0
+        return last[1] * np.exp(-age / self.decay_time)
+
+    # rgb (color or frame) brightened towards white, float
+    def apply(self, rgb, now=None):
+        level = self.level(now)
+        rgb = np.asarray(rgb, dtype=np.float32)
+        if not level:
+            return rgb
+        return rgb + (255.0 - rgb) * level
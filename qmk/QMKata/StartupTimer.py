@@ -0,0 +1,23 @@
+import time
+
+#-------------------------------------------------------------------------------
+# startup time report: mark(step) after each startup step (imports, keyboard
+# open, handshake, ...), report() prints time per step and total
+#
+class StartupTimer:
+
+    def __init__(self, name="startup"):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.t_prev = self.t0
+        self.steps = []
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.t_prev))
+        self.t_prev = now
+
+    def report(self):
+        print(f"{self.name}: {(self.t_prev - self.t0)*1000:.0f} ms")
+        for step, t in self.steps:
+            print(f"  {step:<24}{t*1000:8.1f} ms")
@@ -0,0 +1,44 @@
+import time
+
+from PySide6.QtCore import QObject, QTimer, Signal, Qt
+
+#-------------------------------------------------------------------------------
+# latest value from a worker thread to the gui thread, at most max_rate per
+# second: post() from any thread keeps only the newest value (older not yet
+# delivered values are replaced), signal_value(value) is emitted on the gui
+# thread. one queued signal per delivery, not per posted value.
+#
+class ThrottledChannel(QObject):
+    signal_value = Signal(object)
+    _signal_posted = Signal()
+
+    def __init__(self, max_rate=30, parent=None):
+        super().__init__(parent)
+        self.min_interval = 1 / max_rate
+        self.value = None
+        self.pending = False
+        self.last_delivery = 0.0
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.deliver)
+        self._signal_posted.connect(self.on_posted, Qt.QueuedConnection)
+
+    # any thread
+    def post(self, value):
+        self.value = value
+        if not self.pending:
+            self.pending = True
+            self._signal_posted.emit()
+
+    # gui thread
+    def on_posted(self):
+        delay = self.last_delivery + self.min_interval - time.monotonic()
+        if delay > 0:
+            self.timer.start(int(delay * 1000) + 1)
+        else:
+            self.deliver()
+
+    def deliver(self):
+        self.pending = False
+        self.last_delivery = time.monotonic()
+        self.signal_value.emit(self.value)
@@ -0,0 +1,64 @@
+import hashlib, json, os, re
+import numpy as np
+
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# video frames transcoded to led resolution, keyed by file content hash and
+# keyboard model, stored as .npy (memory mapped on load) plus .json (frame rate)
+#
+class VideoCache:
+
+    def __init__(self, cache_dir="video_cache"):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def file_hash(filename, chunk_size=1<<20):
+        h = hashlib.sha1()
+        with open(filename, "rb") as file:
+            while chunk := file.read(chunk_size):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def key(self, filename, keyb_name, size):
+        try:
+            file_hash = self.file_hash(filename)
+        except Exception as e:
+            self.dbg.tr('E', "file hash: {}", e)
+            return None
+        keyb_name = re.sub(r'\W+', '_', str(keyb_name))
+        return f"{file_hash}_{keyb_name}_{size[0]}x{size[1]}"
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    # return (frames, fps), frames is (n, h, w, 3) uint8 memory mapped array
+    def load(self, key):
+        if not key:
+            return None
+        try:
+            with open(self._path(key, ".json"), "r") as file:
+                info = json.load(file)
+            frames = np.load(self._path(key, ".npy"), mmap_mode='r')
+            self.dbg.tr('D', "cache hit: {} {} frames, {} fps", key, len(frames), info['fps'])
+            return frames, info['fps']
+        except Exception:
+            return None
+
+    def store(self, key, frames, fps):
+        frames = np.ascontiguousarray(np.stack(frames), dtype=np.uint8)
+        if not key:
+            return frames
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            npy_tmp = self._path(key, ".tmp.npy")
+            np.save(npy_tmp, frames)
+            os.replace(npy_tmp, self._path(key, ".npy"))
+            with open(self._path(key, ".json"), "w") as file:
+                json.dump({ 'fps': fps, 'frames': len(frames), 'shape': frames.shape[1:] }, file)
+            self.dbg.tr('D', "cache store: {} {} frames", key, len(frames))
+            return np.load(self._path(key, ".npy"), mmap_mode='r')
+        except Exception as e:
+            self.dbg.tr('E', "cache store: {}", e)
+        return frames
@@ -0,0 +1,252 @@
+import cv2, numpy as np, subprocess, shutil, json
+import threading, queue
+
+from FramePacer import FramePacer
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# video sources for the decode thread
+#
+# read() returns (led frame, preview frame) as rgb uint8 arrays, led frame is
+# at rgb matrix size, preview frame fits in preview size (None if not available)
+# or None at end of video. grab() skips a frame without decoding it.
+#-------------------------------------------------------------------------------
+def fit_size(size, bound):
+    scale = min(bound[0] / size[0], bound[1] / size[1])
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+class CvVideoSource:
+
+    def __init__(self, filename, led_size, preview_size):
+        self.cap = cv2.VideoCapture(filename)
+        if not self.cap.isOpened():
+            raise Exception(f"cannot open {filename}")
+        self.led_size = tuple(led_size)
+        self.preview_size = tuple(preview_size) if preview_size else None
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+
+    def read(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        led_frame = cv2.resize(rgb_frame, self.led_size, interpolation=cv2.INTER_AREA)
+        preview_frame = None
+        if self.preview_size:
+            h, w, _ = rgb_frame.shape
+            preview_frame = cv2.resize(rgb_frame, fit_size((w, h), self.preview_size), interpolation=cv2.INTER_AREA)
+        return led_frame, preview_frame
+
+    def grab(self):
+        return self.cap.grab()
+
+    def rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        self.cap.release()
+
+# ffmpeg subprocess scales inside the decoder to led (and preview) size and
+# writes raw rgb24 frames to the pipe, python never sees a full size frame.
+# with preview, led frame is padded to preview width and stacked below it.
+class FFmpegVideoSource:
+    FFMPEG  = "ffmpeg"
+    FFPROBE = "ffprobe"
+    PREVIEW_MAX = (320, 240) # small preview, upscaled for display
+
+    @classmethod
+    def available(cls):
+        return shutil.which(cls.FFMPEG) is not None and shutil.which(cls.FFPROBE) is not None
+
+    @classmethod
+    def probe(cls, filename):
+        cmd = [ cls.FFPROBE, "-v", "error", "-select_streams", "v:0",
+                "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate", "-of", "json", filename ]
+        stream = json.loads(subprocess.check_output(cmd))['streams'][0]
+        fps = 0
+        for rate in (stream.get('avg_frame_rate'), stream.get('r_frame_rate')):
+            try:
+                num, den = rate.split('/')
+                fps = int(num) / int(den)
+                break
+            except:
+                pass
+        return (int(stream['width']), int(stream['height'])), fps
+
+    def __init__(self, filename, led_size, preview_size):
+        self.filename = filename
+        self.led_size = tuple(led_size)
+        self.video_size, self.fps = self.probe(filename)
+        self.preview_size = None
+        if preview_size:
+            preview_size = min(preview_size[0], self.PREVIEW_MAX[0]), min(preview_size[1], self.PREVIEW_MAX[1])
+            pw, ph = fit_size(self.video_size, preview_size)
+            # even size for the scaler, at least led width for the padding
+            self.preview_size = max(pw - pw % 2, self.led_size[0]), max(ph - ph % 2, 2)
+        self.proc = None
+        self.start()
+
+    def filter_args(self):
+        w, h = self.led_size
+        if not self.preview_size:
+            return [ "-vf", f"scale={w}:{h}:flags=area" ]
+        pw, ph = self.preview_size
+        return [ "-filter_complex",
+                 f"[0:v]split=2[p][l];[p]scale={pw}:{ph}:flags=fast_bilinear[pv];"
+                 f"[l]scale={w}:{h}:flags=area,pad={pw}:{h}[led];[pv][led]vstack" ]
+
+    def frame_shape(self):
+        w, h = self.led_size
+        if not self.preview_size:
+            return h, w, 3
+        pw, ph = self.preview_size
+        return ph + h, pw, 3
+
+    def start(self):
+        cmd = [ self.FFMPEG, "-v", "error", "-nostdin", "-i", self.filename ]
+        cmd += self.filter_args()
+        cmd += [ "-f", "rawvideo", "-pix_fmt", "rgb24", "-" ]
+        self.frame_size = int(np.prod(self.frame_shape()))
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=self.frame_size * 2)
+
+    def read(self):
+        data = self.proc.stdout.read(self.frame_size)
+        if len(data) < self.frame_size:
+            return None
+        frame = np.frombuffer(data, dtype=np.uint8).reshape(self.frame_shape())
+        if not self.preview_size:
+            return frame, None
+        ph = self.preview_size[1]
+        return frame[ph:, :self.led_size[0]], frame[:ph]
+
+    def grab(self):
+        return len(self.proc.stdout.read(self.frame_size)) == self.frame_size
+
+    def rewind(self):
+        self.release()
+        self.start()
+
+    def release(self):
+        if self.proc:
+            self.proc.kill()
+            self.proc.stdout.close()
+            self.proc.wait()
+            self.proc = None
+
+# led resolution frames from VideoCache
+class ArrayVideoSource:
+
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+        self.index = 0
+
+    def read(self):
+        if self.index >= len(self.frames):
+            return None
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame, None
+
+    def grab(self):
+        self.index += 1
+        return self.index <= len(self.frames)
+
+    def rewind(self):
+        self.index = 0
+
+    def release(self):
+        self.frames = None
+
+#-------------------------------------------------------------------------------
+# decode video frames ahead into a bounded queue, frame n is due at pacer
+# deadline, frames already late are skipped with grab() without decoding
+# on_video_info(fps) is called from the decode thread when the video is opened
+class VideoDecodeThread(threading.Thread):
+
+    def __init__(self, filename, video_cache, keyboard_name, led_size, preview_size, use_ffmpeg=False, queue_size=8, on_video_info=None):
+        self.dbg = DebugTracer(zones={'D':0, 'SKIP':0}, obj=self)
+
+        super().__init__(name="VideoDecodeThread", daemon=True)
+        self.filename = filename
+        self.video_cache = video_cache
+        self.keyboard_name = keyboard_name
+        self.cache_key = None
+        self.led_size = led_size
+        self.preview_size = preview_size
+        self.use_ffmpeg = use_ffmpeg
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.pacer = FramePacer(25, "video")
+        self.num_skipped = 0
+        self.on_video_info = on_video_info
+        self.running = False
+
+    def set_framerate(self, fps):
+        self.pacer.set_fps(fps)
+
+    def due_index(self):
+        return self.pacer.due_index()
+
+    def open_source(self):
+        # file hash on this thread, can take a while for large files
+        self.cache_key = self.video_cache.key(self.filename, self.keyboard_name, self.led_size)
+        cached = self.video_cache.load(self.cache_key)
+        if cached:
+            return ArrayVideoSource(*cached)
+        if self.use_ffmpeg:
+            return FFmpegVideoSource(self.filename, self.led_size, self.preview_size)
+        return CvVideoSource(self.filename, self.led_size, self.preview_size)
+
+    def run(self):
+        try:
+            source = self.open_source()
+        except Exception as e:
+            self.dbg.tr('E', "open video: {}", e)
+            return
+        fps = source.fps if source.fps > 0 else 25
+        self.pacer.reset(fps)
+        if self.on_video_info:
+            self.on_video_info(fps)
+
+        # collect led frames on first playback for the cache, if no frame skipped
+        cache_frames = [] if not isinstance(source, ArrayVideoSource) else None
+        index = 0
+        self.running = True
+        while self.running:
+            if index < self.due_index() - 1:
+                if not source.grab():
+                    source.rewind()
+                    cache_frames = None
+                    continue
+                index += 1
+                self.num_skipped += 1
+                cache_frames = None
+                self.dbg.tr('SKIP', "skip frame {}", index)
+                continue
+
+            frames = source.read()
+            if frames is None:
+                if cache_frames:
+                    # end of video, loop from led resolution frames
+                    source.release()
+                    source = ArrayVideoSource(self.video_cache.store(self.cache_key, cache_frames, fps), fps)
+                    cache_frames = None
+                else:
+                    source.rewind()
+                continue
+            if cache_frames is not None:
+                cache_frames.append(frames[0])
+
+            while self.running:
+                try:
+                    self.frame_queue.put((index, frames[0], frames[1]), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            index += 1
+
+        source.release()
+        self.dbg.tr('D', "video decode stopped")
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,110 @@
+import asyncio, json
+
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# websocket routes for keyboard config, status and cli on the shared WSServer
+#
+# config:   "config.get:<config id, 0 all>"
+#           "config.set:" + json [config id, {field id: value}]
+# status:   "status.get:<status id, 0 all>[:<repeat every ms>]"
+# cli:      "cli:<command>" (as in console tab), reply json {"cli": command, "response": hex bytes}
+#
+# config/status values from the keyboard are sent to the connection as json
+# {"config": id, "values": {field id: value}} or {"status": ...} while connected
+#
+# a repeated status request is polled per connection (not with the keyboard's
+# status timer of the gui) and ends with the connection or the next request.
+#
+class WSKeyboardHandler:
+
+    def __init__(self, keyboard, server):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        self.keyboard = keyboard
+        self.server = server
+
+    def add_routes(self):
+        self.server.add_route("config", self.ws_config_handler, ("config.",))
+        self.server.add_route("status", self.ws_status_handler, ("status.",))
+        self.server.add_route("cli", self.ws_cli_handler, ("cli:",))
+
+    def remove_routes(self):
+        for name in ("config", "status", "cli"):
+            self.server.remove_route(name)
+
+    @staticmethod
+    def values_json(kind, values):
+        struct_id, field_values = values
+        return json.dumps({kind: struct_id, "values": field_values}, default=list)
+
+    # forward keyboard signal values to the connection until it is closed
+    async def forward_values(self, websocket, signal, kind, on_message):
+        def on_values(values):
+            self.server.send_threadsafe(websocket, self.values_json(kind, values))
+        signal.connect(on_values)
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    message = message.decode('utf-8', 'ignore')
+                try:
+                    await on_message(message)
+                except Exception as e:
+                    self.dbg.tr('D', "{}: {}", kind, e)
+        finally:
+            signal.disconnect(on_values)
+
+    #-------------------------------------------------------------------------------
+    async def ws_config_handler(self, websocket, path=None):
+        async def on_message(message):
+            if message.startswith("config.get:"):
+                await self.server.call(self.keyboard.keyb_get_config, int(message.split(":")[1] or 0))
+            elif message.startswith("config.set:"):
+                config_id, field_values = json.loads(message[len("config.set:"):])
+                field_values = { int(field_id): value for field_id, value in field_values.items() }
+                await self.server.call(self.keyboard.keyb_set_config, (int(config_id), field_values))
+        await self.forward_values(websocket, self.keyboard.signal_config, "config", on_message)
+
+    async def ws_status_handler(self, websocket, path=None):
+        poll = None
+        async def on_message(message):
+            nonlocal poll
+            if message.startswith("status.get:"):
+                args = message.split(":")
+                repeat_every_ms = int(args[2]) if len(args) > 2 else 0
+                if poll:
+                    poll.cancel()
+                    poll = None
+                if repeat_every_ms > 0:
+                    poll = asyncio.create_task(poll_status(self.server, self.keyboard, int(args[1] or 0), repeat_every_ms))
+                else:
+                    await self.server.call(self.keyboard.keyb_request_status, int(args[1] or 0))
+        try:
+            await self.forward_values(websocket, self.keyboard.signal_status, "status", on_message)
+        finally:
+            if poll:
+                poll.cancel()
+
+    async def ws_cli_handler(self, websocket, path=None):
+        async for message in websocket:
+            if isinstance(message, bytes):
+                message = message.decode('utf-8', 'ignore')
+            if not message.startswith("cli:"):
+                continue
+            cmd = message[len("cli:"):]
+            try:
+                response = await self.server.call(self.keyboard.keyb_set_cli_command, cmd)
+            except Exception as e:
+                self.dbg.tr('D', "cli: {}", e)
+                response = None
+            await websocket.send(json.dumps({"cli": cmd, "response": response.hex(' ') if response else None}))
+
+#-------------------------------------------------------------------------------
+# status request every_ms on the server loop until cancelled
+async def poll_status(server, keyboard, status_id, every_ms):
+    while True:
+        try:
+            await server.call(keyboard.keyb_request_status, status_id)
+        except Exception as e:
+            print(f"poll_status: {e}")
+        await asyncio.sleep(every_ms / 1000)
@@ -1,40 +1,192 @@
-from PySide6.QtCore import QThread
-import asyncio, websockets
+import threading, asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
 
 from DebugTracer import DebugTracer
 
-class WSServer(QThread):
+#-------------------------------------------------------------------------------
+# one asyncio websocket server thread for all qmkata endpoints (layer, rgb,
+# config, status, cli, ...), one event loop for all ports and connections
+#
+# a connection is routed to a handler by request path ("ws://localhost:<port>/rgb"),
+# for path "/" by the prefix of its first message ("layer:", "QRGB", ...), else
+# to the default route of the port (legacy clients: 8765 layer, 8787 rgb).
+#
+# handler(websocket, path) coroutine as for websockets.serve
+#
+# keyboard calls from handlers go through call(): run on the keyboard worker
+# thread one at a time, the event loop is not blocked by serial io.
+# stop() closes the servers on the loop, no dummy connect to itself.
+#
+class WSServer(threading.Thread):
+    _shared = None
+    _shared_lock = threading.Lock()
 
-    def __init__(self, msg_handler, port = 8765):
-        self.dbg = DebugTracer(zones={'D':1}, obj=self)
+    # server shared by all tabs, thread started on first listen()
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if not cls._shared:
+                cls._shared = cls()
+            return cls._shared
 
-        self.port = port
+    @classmethod
+    def shutdown(cls):
+        with cls._shared_lock:
+            server = cls._shared
+            cls._shared = None
+        if server and server.is_alive():
+            server.stop()
+            server.join()
+
+    def __init__(self, host="localhost"):
+        self.dbg = DebugTracer(zones={'D':1, 'ROUTE':0}, obj=self)
+
+        super().__init__(name="WSServer", daemon=True)
+        self.host = host
+        self.routes = {}    # name -> (handler, first message prefixes)
+        self.servers = {}   # port -> (ws server, default route)
+        self.lock = threading.Lock()
         self.loop = None
-        self.msg_handler = msg_handler
-        super().__init__()
+        self.stop_event = None
+        self.started = threading.Event()
+        self.keyboard_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ws_keyboard")
 
-    def run(self):
-        self.dbg.tr('D', f"ws server start on port: {self.port}")
-        asyncio.run(self.ws_main())
+    #-------------------------------------------------------------------------------
+    def add_route(self, name, handler, prefixes=()):
+        prefixes = tuple(p.encode('utf-8') if isinstance(p, str) else p for p in prefixes)
+        with self.lock:
+            self.routes[name] = (handler, prefixes)
+        self.dbg.tr('D', "route /{} added", name)
 
-    async def ws_main(self):
-        self.loop = asyncio.get_running_loop()
-        self.stop_ev = self.loop.create_future()
-        async with websockets.serve(self.msg_handler, "localhost", self.port):
-            await self.stop_ev
-        self.dbg.tr('D', "ws server stopped")
+    def remove_route(self, name):
+        with self.lock:
+            self.routes.pop(name, None)
+
+    def route_by_prefix(self, message):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self.lock:
+            for name, (handler, prefixes) in self.routes.items():
+                if message.startswith(prefixes):
+                    return name
+        return None
+
+    #-------------------------------------------------------------------------------
+    # open port (thread started if needed), errors (port in use, ...) are raised
+    def listen(self, port, default_route=None):
+        if not self.is_alive():
+            self.start()
+        self.started.wait()
+        asyncio.run_coroutine_threadsafe(self._listen(port, default_route), self.loop).result(timeout=5)
 
-    async def ws_close(self):
-        # dummy connect to exit ws_main
+    def unlisten(self, port):
+        if self.loop and self.is_alive():
+            asyncio.run_coroutine_threadsafe(self._unlisten(port), self.loop).result(timeout=5)
+
+    async def _listen(self, port, default_route):
+        if port in self.servers:
+            # port already open (e.g. shared by tabs), only default route changes
+            self.servers[port] = (self.servers[port][0], default_route)
+            return
+        import websockets
+        async def port_handler(websocket, path=None):
+            await self.dispatch(websocket, path, port)
+        server = await websockets.serve(port_handler, self.host, port)
+        self.servers[port] = (server, default_route)
+        self.dbg.tr('D', "listen on port {}, default route {}", port, default_route)
+
+    async def _unlisten(self, port):
+        server = self.servers.pop(port, (None, None))[0]
+        if server:
+            server.close()
+            await server.wait_closed()
+            self.dbg.tr('D', "port {} closed", port)
+
+    #-------------------------------------------------------------------------------
+    async def dispatch(self, websocket, path, port):
+        path = request_path(websocket, path)
+        name = path.strip("/").split("?")[0].split("/")[0]
+        if name not in self.routes:
+            try:
+                first = await websocket.recv()
+            except Exception:
+                return
+            name = self.route_by_prefix(first) or self.servers.get(port, (None, None))[1]
+            websocket = FirstMessageWebSocket(websocket, first)
+        with self.lock:
+            handler = self.routes.get(name, (None, None))[0]
+        self.dbg.tr('ROUTE', "port {} path {}: route {}", port, path, name)
+        if not handler:
+            self.dbg.tr('D', "port {} path {}: no route", port, path)
+            return
         try:
-            async with websockets.connect(f"ws://localhost:{self.port}") as websocket:
-                await websocket.send("")
+            await handler(websocket, path)
         except Exception as e:
-            pass
+            self.dbg.tr('D', "route {}: {}", name, e)
 
-    def stop(self):
-        #self.dbg.tr('D', "ws server stop")
+    #-------------------------------------------------------------------------------
+    # run fn(*args) on the keyboard worker thread, await the result on the loop
+    async def call(self, fn, *args):
+        return await self.loop.run_in_executor(self.keyboard_executor, functools.partial(fn, *args))
+
+    # send from any thread (keyboard signals, mixer acks)
+    def send_threadsafe(self, websocket, message):
         if self.loop:
-            self.stop_ev.set_result(None)
-            asyncio.run(self.ws_close())
+            asyncio.run_coroutine_threadsafe(websocket.send(message), self.loop)
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except Exception as e:
+            self.dbg.tr('D', "ws server: {}", e)
+        self.started.set() # don't leave listen() waiting
+        self.keyboard_executor.shutdown(wait=False)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.started.set()
+        await self.stop_event.wait()
+        for port in list(self.servers):
+            await self._unlisten(port)
+        self.dbg.tr('D', "ws server stopped")
+
+    def stop(self):
+        if self.loop and self.stop_event:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+#-------------------------------------------------------------------------------
+# request path of a connection: legacy websockets handler (websocket, path),
+# websocket.path or connection.request.path (websockets >= 13)
+def request_path(websocket, path=None):
+    if path:
+        return path
+    request = getattr(websocket, 'request', None)
+    if request is not None:
+        return request.path
+    return getattr(websocket, 'path', "/") or "/"
+
+# connection with its first message (read for routing) given back to the handler
+class FirstMessageWebSocket:
+
+    def __init__(self, websocket, first):
+        self.websocket = websocket
+        self.first = [first]
+
+    def __getattr__(self, name):
+        return getattr(self.websocket, name)
+
+    async def recv(self):
+        if self.first:
+            return self.first.pop()
+        return await self.websocket.recv()
+
+    def __aiter__(self):
+        return self.messages()
 
+    async def messages(self):
+        if self.first:
+            yield self.first.pop()
+        async for message in self.websocket:
+            yield message
@@ -0,0 +1,214 @@
+import asyncio, collections, json, struct, time
+
+from WSKeyboardHandler import poll_status
+from DebugTracer import DebugTracer
+
+#-------------------------------------------------------------------------------
+# websocket subscription streams of keyboard and audio events (route "events" on WSServer)
+#
+# subscribe (text): "subscribe:" + json {"topics": ["key", "status", "console", "onset"],
+#                   "format": "json" | "binary", "interval": 0.01, "queue": 1024,
+#                   "status_poll_ms": 0}
+# sending "subscribe:" again changes the subscription.
+#
+# events are batched per interval (first event of a batch wakes the sender),
+# one websocket message per batch:
+#
+# json:     text, one json object per line
+#           {"t": unix time, "topic": "key", "row", "col", "time", "type", "pressed"}
+#           {"t": unix time, "topic": "status", "id": status id, "values": {field id: value}}
+#           {"t": unix time, "topic": "console", "line": text}
+#           {"t": unix time, "topic": "onset", "time": monotonic time of the audio hop,
+#            "kind": "onset" | "beat", "strength": 0..1, "bpm": tempo or null}
+#           {"topic": "dropped", "count": events dropped since last batch} (if any)
+# binary:   header "QEVT", number of events (u16), dropped since last batch (u32),
+#           per event: topic (u8, 1 key 2 status 3 console 4 onset), time (f64, unix),
+#           payload length (u16), payload (key: row u8, col u8, time u16, type u8,
+#           pressed u8, status: json, console: utf-8, onset: time f64, kind u8
+#           (1 onset 2 beat), strength f32, bpm f32 (0 unknown)), little endian
+#
+# status_poll_ms: one status poll shared by all subscribers that ask for it, at
+# the shortest interval asked, stopped when the last of them disconnects (the
+# keyboard's status timer of the gui isn't touched).
+#
+# onset events come from the audio capture thread (OnsetDetector), published
+# by whoever runs the audio capture.
+#
+# every subscriber has its own bounded queue, filled on the keyboard reader
+# (or audio) thread without blocking: when a subscriber can't keep up its oldest events
+# are dropped (and counted), the reader thread and other subscribers go on.
+#
+class EventSubscriber:
+    TOPICS = { "key": 1, "status": 2, "console": 3, "onset": 4 }
+    ONSET_KINDS = { "onset": 1, "beat": 2 }
+
+    MAGIC       = b"QEVT"
+    HEADER      = struct.Struct("<4sHI")
+    EVENT       = struct.Struct("<BdH")
+    KEY_EVENT   = struct.Struct("<BBHBB")
+    ONSET_EVENT = struct.Struct("<dBff")
+
+    def __init__(self, websocket, loop):
+        self.websocket = websocket
+        self.loop = loop
+        self.topics = set()
+        self.binary = False
+        self.interval = 0.01
+        self.queue = collections.deque(maxlen=1024)
+        self.num_dropped = 0
+        self.wakeup = asyncio.Event()
+        self.wakeup_pending = False
+
+    def configure(self, config):
+        self.topics = set(t for t in config.get("topics", self.TOPICS) if t in self.TOPICS)
+        self.binary = config.get("format", "json") == "binary"
+        self.interval = max(0.0, float(config.get("interval", self.interval)))
+        size = int(config.get("queue", self.queue.maxlen))
+        if size != self.queue.maxlen:
+            self.queue = collections.deque(self.queue, maxlen=max(1, size))
+
+    # keyboard reader thread, never blocks
+    def push(self, event):
+        queue = self.queue
+        if len(queue) == queue.maxlen:
+            self.num_dropped += 1
+        queue.append(event)
+        if not self.wakeup_pending:
+            self.wakeup_pending = True
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def take_batch(self):
+        self.wakeup.clear()
+        self.wakeup_pending = False
+        queue = self.queue
+        batch = []
+        while queue:
+            batch.append(queue.popleft())
+        dropped, self.num_dropped = self.num_dropped, 0
+        return batch, dropped
+
+    #-------------------------------------------------------------------------------
+    def encode(self, batch, dropped):
+        if self.binary:
+            return self.encode_binary(batch, dropped)
+        lines = [ json.dumps(self.event_json(*event), default=list) for event in batch ]
+        if dropped:
+            lines.append(json.dumps({"topic": "dropped", "count": dropped}))
+        return "\n".join(lines)
+
+    @staticmethod
+    def event_json(t, topic, data):
+        if topic == "key":
+            row, col, key_time, key_type, pressed = data
+            return {"t": t, "topic": topic, "row": row, "col": col, "time": key_time, "type": key_type, "pressed": pressed}
+        if topic == "status":
+            return {"t": t, "topic": topic, "id": data[0], "values": data[1]}
+        if topic == "onset":
+            onset_time, kind, strength, bpm = data
+            return {"t": t, "topic": topic, "time": onset_time, "kind": kind, "strength": strength, "bpm": bpm}
+        return {"t": t, "topic": topic, "line": data}
+
+    def encode_binary(self, batch, dropped):
+        parts = [ self.HEADER.pack(self.MAGIC, len(batch), dropped) ]
+        for t, topic, data in batch:
+            if topic == "key":
+                payload = self.KEY_EVENT.pack(*data)
+            elif topic == "status":
+                payload = json.dumps({"id": data[0], "values": data[1]}, default=list).encode('utf-8')
+            elif topic == "onset":
+                onset_time, kind, strength, bpm = data
+                payload = self.ONSET_EVENT.pack(onset_time, self.ONSET_KINDS.get(kind, 0), strength, bpm or 0.0)
+            else:
+                payload = data.encode('utf-8')
+            parts.append(self.EVENT.pack(self.TOPICS[topic], t, len(payload)))
+            parts.append(payload)
+        return b"".join(parts)
+
+    async def send_batches(self):
+        while True:
+            await self.wakeup.wait()
+            # collect events for the rest of the interval
+            if self.interval:
+                await asyncio.sleep(self.interval)
+            batch, dropped = self.take_batch()
+            if batch or dropped:
+                try:
+                    await self.websocket.send(self.encode(batch, dropped))
+                except Exception:
+                    return # connection closed
+
+#-------------------------------------------------------------------------------
+class WSSubscriptions:
+
+    def __init__(self, keyboard, server):
+        self.dbg = DebugTracer(zones={'D':0}, obj=self)
+
+        self.keyboard = keyboard
+        self.server = server
+        self.subscribers = {} # topic -> tuple of subscribers, replaced on change (lock free publish)
+        self.status_polls = {} # subscriber -> status_poll_ms, server loop only
+        self.status_poll_ms = 0
+        self.status_poll = None
+        keyboard.signal_key_event.connect(lambda event: self.publish("key", event))
+        keyboard.signal_status.connect(lambda status: self.publish("status", status))
+        keyboard.signal_console_output.connect(lambda line: self.publish("console", line))
+
+    def add_routes(self):
+        self.server.add_route("events", self.ws_subscribe_handler, ("subscribe:",))
+
+    # any thread
+    def publish(self, topic, data):
+        subscribers = self.subscribers.get(topic)
+        if subscribers:
+            event = (time.time(), topic, data)
+            for subscriber in subscribers:
+                subscriber.push(event)
+
+    def update_topics(self, subscriber, topics):
+        for topic in EventSubscriber.TOPICS:
+            subscribers = tuple(s for s in self.subscribers.get(topic, ()) if s is not subscriber)
+            if topic in topics:
+                subscribers += (subscriber,)
+            self.subscribers[topic] = subscribers
+
+    # server loop: poll at the shortest interval of all subscribers, none left: stop
+    def update_status_poll(self, subscriber, status_poll_ms):
+        if status_poll_ms > 0:
+            self.status_polls[subscriber] = status_poll_ms
+        else:
+            self.status_polls.pop(subscriber, None)
+        every_ms = min(self.status_polls.values(), default=0)
+        if every_ms == self.status_poll_ms:
+            return
+        if self.status_poll:
+            self.status_poll.cancel()
+            self.status_poll = None
+        self.status_poll_ms = every_ms
+        if every_ms:
+            self.status_poll = asyncio.create_task(poll_status(self.server, self.keyboard, 0, every_ms))
+        self.dbg.tr('D', "status poll every {} ms, {} subscribers", every_ms, len(self.status_polls))
+
+    #-------------------------------------------------------------------------------
+    async def ws_subscribe_handler(self, websocket, path=None):
+        subscriber = EventSubscriber(websocket, asyncio.get_running_loop())
+        sender = asyncio.create_task(subscriber.send_batches())
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    message = message.decode('utf-8', 'ignore')
+                if not message.startswith("subscribe:"):
+                    continue
+                try:
+                    config = json.loads(message[len("subscribe:"):] or "{}")
+                    subscriber.configure(config)
+                    self.update_topics(subscriber, subscriber.topics)
+                    self.update_status_poll(subscriber, int(config.get("status_poll_ms", 0)))
+                    self.dbg.tr('D', "subscribed: {}", subscriber.topics)
+                except Exception as e:
+                    self.dbg.tr('D', "subscribe: {}", e)
+        except Exception as e:
+            self.dbg.tr('D', "ws_subscribe_handler: {}", e)
+        finally:
+            self.update_topics(subscriber, ())
+            self.update_status_poll(subscriber, 0)
+            sender.cancel()
@@ -1,11 +1,11 @@
 # import necessary libraries in RGBAnimationTab.py
 
 #-------------------------------------------------------------------------------
-# matplotlib animation examples
-# return the "init" and "animate" methods to be used with "matplotlib animation"
-# in animate_methods() here below
+# matplotlib animation examples (engine "matplotlib" in the animation tab)
+# return the "init" and "animate" methods in animate_methods() here below
 #
-# self.figure, self.ax are already defined
+# self.figure, self.ax are already defined, the figure is rendered off-screen
+# (Agg) at rgb matrix size * supersample on the animation thread
 #-------------------------------------------------------------------------------
 
 # return the init, animate methods pair
@@ -18,6 +18,11 @@ def animate_methods(self):
     #methods = "init_circle_wave","animate_circle_wave"
     return methods
 
+# deterministic animations (frame only depends on i): frames per loop, rendered
+# once and then played from a buffer ("loop buffer" in the animation tab)
+def loop_frames(self):
+    return { "animate_wave": self.n_frames }
+
 #-------------------------------------------------------------------------------
 # self.figure, self.ax are already defined
 def init_random_colors(self):
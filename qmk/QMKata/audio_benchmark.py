@@ -0,0 +1,111 @@
+import sys, argparse, time
+
+from AudioSource import SignalAudioSource, FileAudioSource
+from AudioSpectrum import FreqBandTable, STFTAnalyzer, OnsetDetector
+from AudioCapture import AudioCaptureThread, AudioPeakRGB
+from SpectrumRenderer import SpectrumRenderer
+
+#-------------------------------------------------------------------------------
+# offline audio to rgb benchmark, no audio device or keyboard needed: the
+# source (test signal or wav/flac file) is analysed as fast as possible, cost
+# per hop of each stage and the speed of the whole AudioCaptureThread pipeline
+# vs real time.
+#
+#   python audio_benchmark.py --signal beats --duration 30
+#   python audio_benchmark.py --file music.flac
+#-------------------------------------------------------------------------------
+def parse_args():
+    parser = argparse.ArgumentParser(description="offline audio analysis/rgb benchmark")
+    parser.add_argument("--signal", default="sweep", choices=SignalAudioSource.SIGNALS, help="test signal")
+    parser.add_argument("--file", default=None, help="wav/flac file instead of test signal")
+    parser.add_argument("--duration", type=float, default=20.0, help="test signal seconds")
+    parser.add_argument("--rate", type=int, default=48000, help="test signal sample rate")
+    parser.add_argument("--freq-bands", default="freq_bands_colors.json", help="freq bands colors json")
+    parser.add_argument("--hop", type=float, default=AudioCaptureThread.HOP_TIME, help="hop time")
+    parser.add_argument("--window-time", type=float, default=AudioCaptureThread.WINDOW_TIME, help="stft window time")
+    parser.add_argument("--matrix", default="17x6", help="rgb matrix size for the spectrum renderer")
+    return parser.parse_args()
+
+def create_source(args):
+    if args.file:
+        return FileAudioSource(args.file)
+    return SignalAudioSource(args.signal, rate=args.rate, duration=args.duration)
+
+class StageTimer:
+
+    def __init__(self):
+        self.total = {}
+
+    def run(self, stage, fn, *args):
+        t = time.perf_counter()
+        result = fn(*args)
+        self.total[stage] = self.total.get(stage, 0.0) + time.perf_counter() - t
+        return result
+
+    def report(self, num_hops):
+        for stage, total in self.total.items():
+            print(f"  {stage:<16} {total * 1e6 / max(1, num_hops):8.1f} us/hop")
+
+#-------------------------------------------------------------------------------
+# stages one by one, same order as AudioCaptureThread/RGBAudioTab
+def benchmark_stages(args, audio_rgb, matrix_size):
+    source = create_source(args)
+    source.open(args.hop)
+    stft = STFTAnalyzer(source.rate, args.window_time, args.hop)
+    band_table = FreqBandTable(audio_rgb.freq_bands, source.rate, stft.fft_size)
+    onsets = OnsetDetector(source.rate, stft.fft_size, args.hop)
+    spectrum_renderer = SpectrumRenderer(matrix_size, audio_rgb.freq_rgb)
+    timer = StageTimer()
+    num_hops = num_events = 0
+    while True:
+        samples = timer.run("read", source.read)
+        if samples is None:
+            break
+        samples = timer.run("downmix", lambda: samples.reshape(-1, source.channels).mean(axis=1))
+        spectra = stft.spectra(samples)
+        while True:
+            spectrum = timer.run("fft", next, spectra, None)
+            if spectrum is None:
+                break
+            num_hops += 1
+            num_events += len(timer.run("onset", onsets.process, spectrum, stft.num_samples / source.rate))
+            peak_levels = timer.run("band peaks", lambda: band_table.peaks(spectrum).tolist())
+            timer.run("agc/color", audio_rgb.process, peak_levels)
+            timer.run("spectrum render", lambda: spectrum_renderer.render(audio_rgb.band_levels(peak_levels), num_hops * args.hop))
+    source.close()
+
+    print(f"stages: {num_hops} hops, fft size {stft.fft_size}, {len(audio_rgb.freq_bands)} bands, {num_events} onset events")
+    timer.report(num_hops)
+    total = sum(timer.total.values())
+    print(f"  {'total':<16} {total * 1e6 / max(1, num_hops):8.1f} us/hop, {num_hops * args.hop / max(total, 1e-9):.0f}x real time")
+
+# whole capture thread (offline source), callbacks only count
+def benchmark_pipeline(args, audio_rgb):
+    num_hops = 0
+    def on_peak_levels(peak_levels):
+        nonlocal num_hops
+        if peak_levels is not None:
+            num_hops += 1
+            audio_rgb.process(peak_levels)
+    thread = AudioCaptureThread(audio_rgb.freq_bands, args.hop, args.window_time,
+                                source=create_source(args), realtime=False)
+    thread.connect_callback(on_peak_levels)
+    thread.connect_onset_callback(lambda event: None)
+    t = time.perf_counter()
+    thread.start()
+    thread.join()
+    elapsed = time.perf_counter() - t
+    print(f"pipeline: {num_hops} hops in {elapsed:.2f} s, {elapsed * 1e6 / max(1, num_hops):.1f} us/hop, "
+          f"{num_hops * args.hop / max(elapsed, 1e-9):.0f}x real time")
+
+if __name__ == "__main__":
+    args = parse_args()
+    audio_rgb = AudioPeakRGB(args.hop)
+    audio_rgb.load_freq_bands_colors(args.freq_bands)
+    if not audio_rgb.freq_bands:
+        print(f"no freq bands in {args.freq_bands}")
+        sys.exit(1)
+    w, h = (int(n) for n in args.matrix.split("x"))
+    benchmark_stages(args, audio_rgb, (w, h))
+    audio_rgb.reset_levels()
+    benchmark_pipeline(args, audio_rgb)
@@ -0,0 +1,115 @@
+# import necessary libraries in RGBAnimationTab.py
+
+#-------------------------------------------------------------------------------
+# numpy animation examples at led resolution (engine "numpy" in the animation tab)
+# return the "init" and "animate" methods in animate_methods() here below
+#
+# init(self, frame), animate(self, frame, i, t): frame is a (h, w, 3) float32
+# rgb 0..1 array at rgb matrix size, modify it in place or return a new one,
+# i frame index, t seconds since start.
+#
+# self.led_x, self.led_y: column/row of every led (h, w), self.led_size: (w, h)
+# self.audio_peak_levels(), self.audio_onset(): audio tab peak levels, last
+# onset/beat event (time, kind, strength, bpm)
+# hue_to_rgb(hue): rgb of hue 0..1 arrays
+#
+# loop_frames(): deterministic animations (frame only depends on i, t) and
+# their frames per loop, rendered once with t = i / fps and then played from
+# a buffer ("loop buffer" in the animation tab)
+#-------------------------------------------------------------------------------
+
+# return the init, animate methods pair
+def animate_methods(self):
+    methods = "init_rainbow","animate_rainbow"
+    #methods = "init_plasma","animate_plasma"
+    #methods = "init_wave","animate_wave"
+    #methods = "init_twinkle","animate_twinkle"
+    #methods = "init_audio_bars","animate_audio_bars"
+    #methods = "init_beat_ripple","animate_beat_ripple"
+    return methods
+
+def loop_frames(self):
+    return { "animate_rainbow": round(5000 / self.interval), # hue + t * 0.2: 5 s
+             "animate_wave": 1000 }
+
+#-------------------------------------------------------------------------------
+def init_rainbow(self, frame):
+    self.rainbow_hue = self.led_x / self.led_size[0]
+
+def animate_rainbow(self, frame, i, t):
+    return hue_to_rgb((self.rainbow_hue + t * 0.2) % 1.0)
+
+#-------------------------------------------------------------------------------
+def init_plasma(self, frame):
+    w, h = self.led_size
+    self.plasma_x = self.led_x / w * 4
+    self.plasma_y = self.led_y / h * 2
+
+def animate_plasma(self, frame, i, t):
+    x, y = self.plasma_x, self.plasma_y
+    v = np.sin(x + t) + np.sin(y * 2 + t * 1.3) + np.sin((x + y + t * 0.7) * 1.5)
+    return hue_to_rgb(v * 0.125 + t * 0.05)
+
+#-------------------------------------------------------------------------------
+# standing wave, red line
+def init_wave(self, frame):
+    w, h = self.led_size
+    self.wave_x = self.led_x[0] / (w - 1) * 20 - 10 # -10..10 per column
+    self.wave_rows = self.led_y / (h - 1) * 2 - 1  # -1..1, top row -1
+
+def animate_wave(self, frame, i, t):
+    n_waves = 3
+    amplitude = np.sin(np.pi * (i % 1000) / 1000) * 1.1
+    y = amplitude * np.sin(n_waves * 2 * np.pi * self.wave_x / 20) * np.cos(2 * np.pi * i / 50)
+    frame[:] = 0
+    frame[:, :, 0] = np.exp(-((self.wave_rows + y) * 3) ** 2)
+
+#-------------------------------------------------------------------------------
+def init_twinkle(self, frame):
+    self.twinkle_rng = np.random.default_rng()
+
+def animate_twinkle(self, frame, i, t):
+    frame *= 0.85
+    h, w, _ = frame.shape
+    n = max(1, w * h // 30)
+    rows = self.twinkle_rng.integers(0, h, n)
+    cols = self.twinkle_rng.integers(0, w, n)
+    frame[rows, cols] = hue_to_rgb(self.twinkle_rng.random(n))
+
+#-------------------------------------------------------------------------------
+# peak levels of the audio tab as bars, one column per band group
+def init_audio_bars(self, frame):
+    self.bars_max = 1.0
+
+def animate_audio_bars(self, frame, i, t):
+    peak_levels = self.audio_peak_levels()
+    frame[:] = 0
+    if not peak_levels:
+        return
+    w, h = self.led_size
+    levels = np.asarray(peak_levels, dtype=np.float32)
+    self.bars_max = max(self.bars_max * 0.995, float(levels.max()), 1e-3)
+    columns = np.interp(np.linspace(0, len(levels) - 1, w), np.arange(len(levels)), levels) / self.bars_max
+    lit = (h - 1 - self.led_y) < columns * h
+    frame[lit] = hue_to_rgb(self.led_x[lit] / w * 0.7)
+
+#-------------------------------------------------------------------------------
+# ring from a random led on every beat
+def init_beat_ripple(self, frame):
+    self.ripples = [] # (x, y, start time, color)
+    self.ripple_last_event = None
+
+def animate_beat_ripple(self, frame, i, t):
+    event = self.audio_onset()
+    now = time.monotonic()
+    if event is not None and event is not self.ripple_last_event and event[1] == "beat":
+        self.ripple_last_event = event
+        w, h = self.led_size
+        self.ripples.append((random.uniform(0, w - 1), random.uniform(0, h - 1), now, hue_to_rgb(random.random())))
+    frame *= 0.6
+    for x, y, start, color in self.ripples:
+        age = now - start
+        dist = np.hypot(self.led_x - x, (self.led_y - y) * 1.5)
+        ring = np.exp(-((dist - age * 20) ** 2)) * max(0.0, 1 - age)
+        frame += ring[:, :, None] * color
+    self.ripples = [ r for r in self.ripples if now - r[2] < 1.0 ]
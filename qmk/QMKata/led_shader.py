@@ -0,0 +1,88 @@
+# import necessary libraries in RGBAnimationTab.py
+
+#-------------------------------------------------------------------------------
+# per led shader examples (engine "shader" in the animation tab)
+# return the "init" and "shader" methods in animate_methods() here below
+#
+# init(self, g), shader(self, g, t): g the led geometry, computed once per
+# matrix size, t seconds since start. return rgb 0..1 of all leds (h, w, 3)
+# in one vectorized call, don't modify g.
+#
+# g.col, g.row: matrix column/row, g.x, g.y: position in qmk units (x 0..224,
+# y 0..64), g.dx, g.dy: position - center (112, 32), g.dist: distance from
+# center, g.angle: atan2(dy, dx) -pi..pi, all (h, w) float32
+# hue_to_rgb(hue), hsv_to_rgb(hue, sat, val): 0..1 arrays to rgb
+#
+# qmk effects are in uint8 units: hue, dist, atan2_8 wrap at 256, here hue
+# is 0..1 (dist / 256), time in turns: qmk_time(t) with speed as in rgb_config
+#-------------------------------------------------------------------------------
+
+# return the init, shader methods pair
+def animate_methods(self):
+    methods = "init_cycle_spiral","shader_cycle_spiral"
+    #methods = "init_cycle_out_in","shader_cycle_out_in"
+    #methods = "init_pinwheel","shader_pinwheel"
+    #methods = "init_band_spiral_sat","shader_band_spiral_sat"
+    #methods = "init_beat_rings","shader_beat_rings"
+    return methods
+
+# qmk effect time (scale16by8(timer, speed >> 1)) in turns (uint8 / 256)
+def qmk_time(self, t, speed=128):
+    return (t * 1000 * (1 + (speed >> 1)) / 256 / 256) % 1.0
+
+#-------------------------------------------------------------------------------
+# CYCLE_SPIRAL_math: hsv.h = dist - time - atan2_8(dy, dx)
+def init_cycle_spiral(self, g):
+    self.spiral_hue = g.dist / 256 - g.angle / (2 * np.pi)
+
+def shader_cycle_spiral(self, g, t):
+    return hue_to_rgb((self.spiral_hue - self.qmk_time(t, 64)) % 1.0)
+
+#-------------------------------------------------------------------------------
+# CYCLE_OUT_IN_math: hsv.h = 3 * dist / 2 + time
+def init_cycle_out_in(self, g):
+    self.out_in_hue = 1.5 * g.dist / 256
+
+def shader_cycle_out_in(self, g, t):
+    return hue_to_rgb((self.out_in_hue + self.qmk_time(t, 64)) % 1.0)
+
+#-------------------------------------------------------------------------------
+# CYCLE_PINWHEEL_math: hsv.h = atan2_8(dy, dx) + time
+def init_pinwheel(self, g):
+    self.pinwheel_hue = g.angle / (2 * np.pi)
+
+def shader_pinwheel(self, g, t):
+    return hue_to_rgb((self.pinwheel_hue + self.qmk_time(t, 64)) % 1.0)
+
+#-------------------------------------------------------------------------------
+# kb_dynld_animation.py BAND_SPIRAL_SAT_math on the host: saturation and value
+# spiral, new random hue every second
+def init_band_spiral_sat(self, g):
+    self.band_spiral = g.dist / 256 - g.angle / (2 * np.pi)
+    self.band_hue = 0.0
+    self.band_hue_time = -1.0
+
+def shader_band_spiral_sat(self, g, t):
+    if t - self.band_hue_time >= 1.0:
+        self.band_hue_time = t
+        self.band_hue = (self.band_hue + random.uniform(0.2, 0.8)) % 1.0
+    sat = (self.band_spiral - self.qmk_time(t)) % 1.0
+    return hsv_to_rgb(self.band_hue, sat, sat)
+
+#-------------------------------------------------------------------------------
+# ring from the center on every audio beat, background hue by angle
+def init_beat_rings(self, g):
+    self.rings = [] # start times
+    self.rings_last_event = None
+
+def shader_beat_rings(self, g, t):
+    event = self.audio_onset()
+    if event is not None and event is not self.rings_last_event and event[1] == "beat":
+        self.rings_last_event = event
+        self.rings.append(t)
+    self.rings = [ start for start in self.rings if t - start < 1.0 ]
+    val = np.full(g.dist.shape, 0.1, dtype=np.float32)
+    for start in self.rings:
+        age = t - start
+        val += np.exp(-((g.dist - age * 150) / 12) ** 2) * (1 - age)
+    return hsv_to_rgb(g.angle / (2 * np.pi) + t * 0.05, 1.0, val)
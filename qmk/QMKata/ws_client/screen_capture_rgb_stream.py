@@ -1,72 +1,181 @@
-import sys, time, argparse
-import d3dshot
-import cv2
+import sys, os, time, argparse
 import asyncio
-import websockets
+import numpy as np
+
+# RGBFrameProtocol, SharedFrameRing from qmkata
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from RGBFrameProtocol import RGBFrameProtocol, resample_frame
+
+#-------------------------------------------------------------------------------
+# capture backends: grab() returns the latest screen frame (h, w, 3 or 4) uint8
+# in the backend's pixel order (FMT, alpha dropped after resize), None if no new
+# frame. BLOCKING backends are grabbed on a worker thread.
+#
+class D3DShotCapture:
+    FMT = RGBFrameProtocol.FMT_RGB888
+    BLOCKING = False
+
+    def __init__(self, display):
+        import d3dshot
+        self.d = d3dshot.create(capture_output="numpy")
+        self.d.display = self.d.displays[display]
+        self.d.capture() # capture thread of d3dshot, grab() takes its latest frame
+
+    def grab(self):
+        return self.d.get_latest_frame()
+
+    def close(self):
+        self.d.stop()
+
+class MSSCapture:
+    FMT = RGBFrameProtocol.FMT_BGR888
+    BLOCKING = True
+
+    def __init__(self, display):
+        import mss
+        self.mss = mss.mss()
+        self.monitor = self.mss.monitors[display + 1]
+
+    def grab(self):
+        return np.asarray(self.mss.grab(self.monitor)) # bgra
+
+    def close(self):
+        self.mss.close()
+
+class WindowCaptureBackend:
+    FMT = RGBFrameProtocol.FMT_BGR888
+    BLOCKING = True
+
+    def __init__(self, window_name):
+        from windowcapture import WindowCapture
+        self.wincap = WindowCapture(window_name)
+
+    def grab(self):
+        return self.wincap.get_screenshot()
+
+    def close(self):
+        pass
+
+# synthetic moving gradient (no screen needed, e.g. linux tests)
+class TestPatternCapture:
+    FMT = RGBFrameProtocol.FMT_RGB888
+    BLOCKING = False
+
+    def __init__(self, width=320, height=180):
+        self.t0 = time.monotonic()
+        self.x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+        self.y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+
+    def grab(self):
+        t = time.monotonic() - self.t0
+        phase = (self.x + t * 0.25) % 1.0
+        self.frame[:, :, 0] = phase * 255
+        self.frame[:, :, 1] = self.y * 255
+        self.frame[:, :, 2] = (1.0 - phase) * 255
+        return self.frame
+
+    def close(self):
+        pass
+
+BACKENDS = {
+    "d3dshot": lambda args: D3DShotCapture(args.display),
+    "mss": lambda args: MSSCapture(args.display),
+    "window": lambda args: WindowCaptureBackend(args.window),
+    "test": lambda args: TestPatternCapture(),
+}
+
+def create_backend(args):
+    names = [args.backend] if args.backend != "auto" else ["d3dshot", "mss", "test"]
+    for name in names:
+        try:
+            backend = BACKENDS[name](args)
+            print(f"capture backend: {name}")
+            return backend
+        except Exception as e:
+            print(f"capture backend {name} not available: {e}")
+    raise Exception("no capture backend")
+
+#-------------------------------------------------------------------------------
+# resize to rgb matrix: cv2 area filter if available, else box filter of qmkata
+def make_resize(size):
+    try:
+        import cv2
+        return lambda frame: cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    except ImportError:
+        return lambda frame: resample_frame(frame, size)
 
 def parse_args():
-    parser = argparse.ArgumentParser(description="capture screen and stream as rgb image over websocket")
+    parser = argparse.ArgumentParser(description="capture screen and stream as rgb frames to qmkata")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(BACKENDS), help="capture backend")
     parser.add_argument("--display", type=int, default=0, help="display index to capture")
+    parser.add_argument("--window", default=None, help="window name (window backend)")
     parser.add_argument("--width", type=int, default=17, help="rgb matrix width")
     parser.add_argument("--height", type=int, default=6, help="rgb matrix height")
     parser.add_argument("--fps", type=int, default=25, help="frame rate of the capture")
     parser.add_argument("--port", type=int, default=8787, help="websocket server port")
+    parser.add_argument("--shm", nargs="?", const="qmkata_rgb", default=None,
+                        help="write frames to qmkata shared memory ring (name) instead of websocket")
+    parser.add_argument("--frames", type=int, default=0, help="stop after number of frames (0: run until stopped)")
     return parser.parse_args()
 
-if __name__ == "__main__":
-    args = parse_args()
+#-------------------------------------------------------------------------------
+# frame n is sent at t0 + n/fps (loop time), no blocking sleep in the coroutine
+async def capture_stream(args, backend, send):
+    loop = asyncio.get_running_loop()
+    resize = make_resize((args.width, args.height))
+    t0 = loop.time()
+    n = 0
+    while not args.frames or n < args.frames:
+        if backend.BLOCKING:
+            frame = await asyncio.to_thread(backend.grab)
+        else:
+            frame = backend.grab()
+        if frame is not None:
+            await send(resize(frame)[:, :, :3], n)
+        n += 1
+        next_time = t0 + n / args.fps
+        now = loop.time()
+        if next_time < now:
+            # behind: skip to the next slot instead of bursting
+            n = int((now - t0) * args.fps) + 1
+            next_time = t0 + n / args.fps
+        await asyncio.sleep(next_time - now)
 
-    display_index = args.display
-    rgb_w = args.width
-    rgb_h = args.height
-    fps = args.fps
-    port = args.port
+async def capture_ws_send(args, backend):
+    import websockets
+    uri = f"ws://localhost:{args.port}/rgb"
+    async with websockets.connect(uri) as websocket:
+        async def send(frame, seq):
+            await websocket.send(RGBFrameProtocol.encode(frame, seq, backend.FMT))
+        await capture_stream(args, backend, send)
 
-    d = d3dshot.create(capture_output="numpy")
-    d.display = d.displays[display_index]
-    # start capture
-    d.capture()
-    print("capture is running...")
-
-    async def capture_ws_send():
-        uri = f"ws://localhost:{port}"
-        try:
-            async with websockets.connect(uri) as websocket:
-                while True:
-                    try:
-                        frame = d.get_latest_frame()
-                        #print(frame.shape)
-                        frame = cv2.resize(frame, (rgb_w, rgb_h))
-                        #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        frame_bytes = bytearray()
-                        for y in range(0, rgb_h):
-                            for x in range(0, rgb_w):
-                                r,g,b = frame[y, x]
-                                frame_bytes.append(r)
-                                frame_bytes.append(g)
-                                frame_bytes.append(b)
-                        #print(frame_bytes)
-                        data = "rgb.img:".encode('utf-8')
-                        data = data + frame_bytes
-
-                        try:
-                            await websocket.send(data)
-                            await asyncio.sleep(0)
-                        except websockets.exceptions.ConnectionClosed as e:
-                            print("websocket connection closed: ", e)
-                            break
-                        except Exception as e:
-                            print("websocket send error:", e)
-                            break
-                    except Exception as e:
-                        print(e)
-                    time.sleep(1/fps)
-        except Exception as e:
-            print("websocket error: ", e)
+async def capture_shm_send(args, backend):
+    from SharedFrameRing import SharedFrameProducer
+    producer = SharedFrameProducer(args.shm)
+    print(f"shared memory ring {args.shm}, rgb matrix {producer.size}")
+    args.width, args.height = producer.size
+    async def send(frame, seq):
+        if backend.FMT == RGBFrameProtocol.FMT_BGR888:
+            frame = frame[:, :, ::-1]
+        producer.send(frame)
+    try:
+        await capture_stream(args, backend, send)
+    finally:
+        producer.close()
 
+if __name__ == "__main__":
+    args = parse_args()
+    backend = create_backend(args)
+    print("capture is running...")
     try:
-        asyncio.get_event_loop().run_until_complete(capture_ws_send())
+        if args.shm:
+            asyncio.run(capture_shm_send(args, backend))
+        else:
+            asyncio.run(capture_ws_send(args, backend))
     except KeyboardInterrupt:
         print("exit run")
-
-    d.stop()
+    except Exception as e:
+        print("error: ", e)
+    finally:
+        backend.close()
@@ -0,0 +1,28 @@
+import sys, json, argparse
+import asyncio
+import websockets
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="print keyboard and audio events (key presses, status, console, onsets/beats) from qmkata")
+    parser.add_argument("--topics", default="key,console", help="comma separated topics: key, status, console, onset")
+    parser.add_argument("--interval", type=float, default=0.01, help="batch interval in seconds")
+    parser.add_argument("--port", type=int, default=8765, help="websocket server port")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    async def subscribe():
+        uri = f"ws://localhost:{args.port}/events"
+        async with websockets.connect(uri) as websocket:
+            config = {"topics": args.topics.split(","), "format": "json", "interval": args.interval}
+            await websocket.send("subscribe:" + json.dumps(config))
+            async for message in websocket:
+                for line in message.split("\n"):
+                    print(line)
+
+    try:
+        asyncio.run(subscribe())
+    except KeyboardInterrupt:
+        print("exit run")
+    sys.exit(0)